@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Разбор access-лога V2Ray по мере записи: с места последнего чтения, без перечитывания файла.
+В памяти — только ограниченные топы (алгоритм Space-Saving): соединения по доменам,
+по outbound и причины отказов. Файл обрезается, когда вырастает больше MAX_LOG_BYTES.
+"""
+import json
+import re
+import time
+
+from app_dir import BASE_DIR
+
+ACCESS_LOG_PATH = BASE_DIR / "v2ray" / "access.log"
+STATS_JSON_PATH = BASE_DIR / "access_stats.json"
+MAX_LOG_BYTES = 4 * 1024 * 1024
+TOP_CAPACITY = 256
+READ_CHUNK = 256 * 1024
+
+# 2024/05/01 12:00:00.123456 [from ]127.0.0.1:5000 accepted tcp:example.com:443 [socks-in -> proxy]
+# У отклонённых без адреса назначения после статуса сразу идёт причина
+_LINE_RE = re.compile(r"(?:from )?(?P<src>\S+) (?P<status>accepted|rejected)\s+(?P<rest>.*)$")
+_DEST_RE = re.compile(
+    r"(?P<net>tcp|udp):(?P<dest>\S+)(?: \[(?P<detour>[^\]]*)\])?(?: (?P<reason>.*))?$"
+)
+
+
+class SpaceSaving:
+    """Приближённый топ-K в фиксированной памяти: при переполнении вытесняется самый редкий
+    ключ, новый наследует его счётчик (завышение не больше этого счётчика)."""
+
+    def __init__(self, capacity: int = TOP_CAPACITY):
+        self.capacity = capacity
+        self._counts = {}
+        self._errors = {}
+        self.total = 0
+
+    def add(self, key: str, count: int = 1):
+        self.total += count
+        if key in self._counts:
+            self._counts[key] += count
+            return
+        if len(self._counts) < self.capacity:
+            self._counts[key] = count
+            self._errors[key] = 0
+            return
+        victim = min(self._counts, key=self._counts.get)
+        floor = self._counts.pop(victim)
+        del self._errors[victim]
+        self._counts[key] = floor + count
+        self._errors[key] = floor
+
+    def top(self, n: int = 20) -> list[tuple[str, int]]:
+        return sorted(self._counts.items(), key=lambda kv: -kv[1])[:n]
+
+    def to_dict(self, n: int) -> list[dict]:
+        return [{"key": k, "count": c, "max_error": self._errors[k]} for k, c in self.top(n)]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+def _split_dest(dest: str) -> str:
+    """example.com:443 / [2001:db8::1]:443 -> хост без порта."""
+    if dest.startswith("["):
+        return dest[1:].split("]", 1)[0].lower()
+    if dest.count(":") == 1:
+        return dest.split(":", 1)[0].lower()
+    return dest.lower()
+
+
+def _outbound(detour: str | None) -> str:
+    """"socks-in -> proxy" / "socks-in >> proxy" / "proxy" -> "proxy"."""
+    if not detour:
+        return "?"
+    for sep in ("->", ">>"):
+        if sep in detour:
+            return detour.rsplit(sep, 1)[1].strip()
+    return detour.strip()
+
+
+class AccessStats:
+    """Агрегаты access-лога."""
+
+    def __init__(self, capacity: int = TOP_CAPACITY):
+        self.domains = SpaceSaving(capacity)
+        self.outbounds = SpaceSaving(capacity)
+        self.reasons = SpaceSaving(capacity)
+        self.accepted = 0
+        self.rejected = 0
+        self.unparsed = 0
+        self.started = time.time()
+
+    def feed(self, line: str):
+        match = _LINE_RE.search(line)
+        if match is None:
+            if line.strip():
+                self.unparsed += 1
+            return
+        rejected = match["status"] == "rejected"
+        dest = _DEST_RE.match(match["rest"])
+        if dest is not None:
+            self.domains.add(_split_dest(dest["dest"]))
+            self.outbounds.add(_outbound(dest["detour"]))
+            reason = dest["reason"]
+        elif rejected:
+            reason = match["rest"]
+        else:
+            self.unparsed += 1
+            return
+        if rejected:
+            self.rejected += 1
+            self.reasons.add((reason or "?").strip()[:200])
+        else:
+            self.accepted += 1
+
+    def to_dict(self, n: int = 50) -> dict:
+        return {
+            "since": self.started,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "unparsed": self.unparsed,
+            "domains": self.domains.to_dict(n),
+            "outbounds": self.outbounds.to_dict(n),
+            "reject_reasons": self.reasons.to_dict(n),
+        }
+
+    def dump(self, path=STATS_JSON_PATH, n: int = 50) -> bool:
+        try:
+            path.write_text(json.dumps(self.to_dict(n), ensure_ascii=False, indent=2), encoding="utf-8")
+            return True
+        except OSError:
+            return False
+
+    def summary(self, n: int = 20) -> str:
+        """Текст для окна «Журнал»."""
+        lines = [f"Соединений: {self.accepted}, отклонено: {self.rejected}", "", "Домены:"]
+        lines += [f"  {count:>7}  {key}" for key, count in self.domains.top(n)]
+        lines += ["", "Outbound:"]
+        lines += [f"  {count:>7}  {key}" for key, count in self.outbounds.top(n)]
+        if self.rejected:
+            lines += ["", "Причины отказов:"]
+            lines += [f"  {count:>7}  {key}" for key, count in self.reasons.top(n)]
+        return "\n".join(lines)
+
+
+class AccessLogTailer:
+    """Чтение новых строк access-лога с запомненного смещения."""
+
+    def __init__(self, path=ACCESS_LOG_PATH, stats: AccessStats | None = None, max_bytes: int = MAX_LOG_BYTES):
+        self.path = path
+        self.stats = stats if stats is not None else AccessStats()
+        self.max_bytes = max_bytes
+        self._offset = 0
+        self._partial = b""
+
+    def skip_existing(self):
+        """Начать с конца файла (старые записи не учитывать)."""
+        try:
+            self._offset = self.path.stat().st_size
+        except OSError:
+            self._offset = 0
+        self._partial = b""
+
+    def poll(self) -> int:
+        """Разобрать дописанное с прошлого вызова. Вернуть число новых строк."""
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return 0
+        with f:
+            size = f.seek(0, 2)
+            if size < self._offset:
+                # Файл обрезан или пересоздан
+                self._offset, self._partial = 0, b""
+            lines = self._read_from(f)
+        if self._offset > self.max_bytes:
+            lines += self._truncate()
+        return lines
+
+    def _read_from(self, f) -> int:
+        """Разобрать файл с self._offset до конца; недописанная строка остаётся в _partial."""
+        f.seek(self._offset)
+        lines = 0
+        while chunk := f.read(READ_CHUNK):
+            lines += self._feed(chunk)
+        self._offset = f.tell()
+        return lines
+
+    def _feed(self, chunk: bytes) -> int:
+        *complete, self._partial = (self._partial + chunk).split(b"\n")
+        for raw in complete:
+            self.stats.feed(raw.decode("utf-8", errors="replace").rstrip("\r"))
+        return len(complete)
+
+    def _truncate(self) -> int:
+        """Дочитать дописанное после poll и обрезать файл. Байты читаются без разбора, пока
+        чтение не вернёт пусто, и сразу после этого файл обрезается — строки, которые V2Ray
+        допишет между последним чтением и обрезкой, потерялись бы; окно сведено к одному вызову.
+        Переименовать файл нельзя: V2Ray держит его открытым и писал бы в старый (в Windows
+        переименование открытого файла и вовсе не проходит).
+        V2Ray пишет в режиме добавления — после обрезки продолжит с начала файла, поэтому
+        недописанная строка остаётся в _partial и склеится с окончанием, которое придёт первым.
+        Вернуть число дочитанных строк."""
+        chunks = []
+        try:
+            with open(self.path, "r+b") as f:
+                f.seek(self._offset)
+                while chunk := f.read(READ_CHUNK):
+                    chunks.append(chunk)
+                f.truncate(0)
+        except OSError:
+            return 0
+        self._offset = 0
+        return sum(self._feed(chunk) for chunk in chunks)
@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+Замер путей прокси на локальных заменах серверов: HTTP-источник, SOCKS5-сервер и сервер
+Shadowsocks поднимаются на 127.0.0.1, запросы идут напрямую (база), через встроенный
+прокси (LocalProxy -> SOCKS5), через pproxy (ProxyProcess -> SOCKS5) и через V2Ray
+(конфиг из config_builder -> Shadowsocks).
+Для каждого размера ответа — пропускная способность, TTFB и задержка p50/p95/p99.
+Результаты сохраняются в JSON (папка bench_results), чтобы сравнивать выпуски.
+
+    python bench.py [--paths direct,local,pproxy,v2ray] [--sizes 1024,65536,1048576] [--requests 30]
+                    [--transport mux] [--tuning low-latency] [--compare bench_results/прежний.json]
+                    [--threshold 0.1]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import NamedTuple
+
+from app_dir import BASE_DIR
+from config_builder import (
+    DEFAULT_TRANSPORT,
+    DEFAULT_TUNING,
+    TRANSPORT_PROFILES,
+    TUNING_PROFILES,
+    SsServer,
+    build_from_server,
+)
+from local_proxy import LocalProxy
+from prober import AEAD_METHODS, TAG_SIZE, AeadStream, handshake_supported
+from readiness import free_ports
+from v2ray_runner import LISTEN_HOST, V2RAY_EXE, InstancePool
+
+PATHS = ("direct", "local", "pproxy", "v2ray")
+DEFAULT_SIZES = (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+DEFAULT_REQUESTS = 30
+# Байт на один размер ответа: для больших ответов запросов меньше, но не меньше MIN_REQUESTS
+SIZE_BUDGET = 64 * 1024 * 1024
+MIN_REQUESTS = 5
+REQUEST_TIMEOUT = 30.0
+READ_CHUNK = 256 * 1024
+# Чанк Shadowsocks AEAD — не больше 0x3FFF байт
+RELAY_CHUNK = 0x3FFF
+ORIGIN_CHUNK = 64 * 1024
+SS_METHOD = "aes-128-gcm"
+SS_PASSWORD = "bench"
+BENCH_DIR = BASE_DIR / "bench_results"
+# Насколько хуже прежнего замера (доля) считается регрессией (--threshold). Два прогона подряд
+# на одной машине расходятся на 10–20% по p50; на тихой машине порог можно снизить
+REGRESSION_THRESHOLD = 0.25
+# Меньше удачных запросов на размер — p95 случаен, такие размеры не сравниваются
+COMPARE_MIN_REQUESTS = 10
+
+
+class BenchResult(NamedTuple):
+    path: str
+    size: int  # байт в ответе
+    requests: int
+    errors: int = 0
+    mbps: float | None = None  # все байты / суммарное время удачных запросов, Мбит/с
+    ttfb: float | None = None  # медиана времени до первого байта, с
+    p50: float | None = None  # время всего запроса, с
+    p95: float | None = None
+    p99: float | None = None
+    error: str = ""
+
+
+def _parse_address(data: bytes) -> tuple[str, int, bytes]:
+    """Адрес SOCKS5/Shadowsocks (ATYP, адрес, порт) в начале data -> (host, port, остаток)."""
+    atyp = data[0]
+    if atyp == 1:
+        host, end = socket.inet_ntop(socket.AF_INET, data[1:5]), 5
+    elif atyp == 4:
+        host, end = socket.inet_ntop(socket.AF_INET6, data[1:17]), 17
+    elif atyp == 3:
+        end = 2 + data[1]
+        host = data[2:end].decode("idna")
+    else:
+        raise ValueError(f"ATYP {atyp}")
+    (port,) = struct.unpack("!H", data[end : end + 2])
+    return host, port, data[end + 2 :]
+
+
+async def _relay(read_client, client_writer, up_reader, up_writer, seal=None):
+    """Клиент -> источник: read_client() до b"". Источник -> клиент: seal(данные) или как есть."""
+
+    async def forward():
+        try:
+            while data := await read_client():
+                up_writer.write(data)
+                await up_writer.drain()
+            if up_writer.can_write_eof():
+                up_writer.write_eof()
+        except (OSError, ValueError):
+            pass
+
+    task = asyncio.ensure_future(forward())
+    try:
+        while data := await up_reader.read(RELAY_CHUNK):
+            client_writer.write(seal(data) if seal else data)
+            await client_writer.drain()
+    finally:
+        task.cancel()
+        up_writer.close()
+
+
+class StandIns:
+    """Источник, SOCKS5 и Shadowsocks на свободных портах 127.0.0.1 — в цикле asyncio фонового потока."""
+
+    def __init__(self):
+        self.origin_port = self.socks_port = self.ss_port = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._servers = []
+
+    def __enter__(self):
+        self._thread.start()
+        self.origin_port = self._listen(self._origin)
+        self.socks_port = self._listen(self._socks5)
+        if handshake_supported(SS_METHOD):
+            self.ss_port = self._listen(self._shadowsocks)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _shutdown(self):
+        """Закрыть серверы и оборвать соединения, которые ещё держат клиенты (пул LocalProxy)."""
+        for server in self._servers:
+            server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _listen(self, handler) -> int:
+        future = asyncio.run_coroutine_threadsafe(asyncio.start_server(handler, LISTEN_HOST, 0), self._loop)
+        server = future.result()
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    def url(self, size: int) -> str:
+        return f"http://{LISTEN_HOST}:{self.origin_port}/bytes/{size}"
+
+    @staticmethod
+    async def _origin(reader, writer):
+        """GET /bytes/N -> N нулевых байт (путь может прийти и абсолютным URI от прокси)."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            path = urllib.parse.urlsplit(head.split(b" ", 2)[1].decode("latin-1")).path
+            size = int(path.rsplit("/", 1)[1]) if path.startswith("/bytes/") else 0
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                b"Content-Length: %d\r\nConnection: close\r\n\r\n" % size
+            )
+            block = bytes(ORIGIN_CHUNK)
+            while size > 0:
+                writer.write(block[: min(size, ORIGIN_CHUNK)])
+                size -= ORIGIN_CHUNK
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _socks5(reader, writer):
+        """SOCKS5 без авторизации, только CONNECT."""
+        try:
+            _, methods = await reader.readexactly(2)
+            await reader.readexactly(methods)
+            writer.write(b"\x05\x00")
+            _, command, _, atyp = await reader.readexactly(4)
+            if atyp == 3:
+                raw = await reader.readexactly(1)
+                raw += await reader.readexactly(raw[0])
+            else:
+                raw = await reader.readexactly(16 if atyp == 4 else 4)
+            host, port, _ = _parse_address(bytes([atyp]) + raw + await reader.readexactly(2))
+            if command != 1:
+                writer.write(b"\x05\x07\x00\x01" + bytes(6))
+                return
+            up_reader, up_writer = await asyncio.open_connection(host, port)
+            writer.write(b"\x05\x00\x00\x01" + bytes(6))
+            await _relay(lambda: reader.read(RELAY_CHUNK), writer, up_reader, up_writer)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError, struct.error):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _shadowsocks(reader, writer):
+        """Сервер Shadowsocks AEAD (SS_METHOD / SS_PASSWORD), шифрование — из prober."""
+        key_len, _ = AEAD_METHODS[SS_METHOD]
+        try:
+            decoder = AeadStream(SS_METHOD, SS_PASSWORD, await reader.readexactly(key_len))
+
+            async def read_chunk() -> bytes:
+                try:
+                    (length,) = struct.unpack("!H", decoder.open(await reader.readexactly(2 + TAG_SIZE)))
+                    return decoder.open(await reader.readexactly(length + TAG_SIZE))
+                except asyncio.IncompleteReadError:
+                    return b""
+
+            host, port, rest = _parse_address(await read_chunk())
+            up_reader, up_writer = await asyncio.open_connection(host, port)
+            if rest:
+                up_writer.write(rest)
+            salt = os.urandom(key_len)
+            encoder = AeadStream(SS_METHOD, SS_PASSWORD, salt)
+            writer.write(salt)
+            await _relay(read_chunk, writer, up_reader, up_writer, seal=encoder.seal_chunk)
+        except Exception:  # в том числе InvalidTag — клиент с другим ключом
+            pass
+        finally:
+            writer.close()
+
+
+def _opener(proxy_port: int | None):
+    """urllib без системного прокси или через HTTP-прокси 127.0.0.1:proxy_port."""
+    proxies = {} if proxy_port is None else {"http": f"http://{LISTEN_HOST}:{proxy_port}"}
+    return urllib.request.build_opener(urllib.request.ProxyHandler(proxies))
+
+
+def _get(opener, url: str, timeout: float) -> tuple[float, float, int]:
+    """Один запрос: (TTFB, всё время, байт)."""
+    started = time.perf_counter()
+    with opener.open(url, timeout=timeout) as response:
+        received = len(response.read(1))
+        first_byte = time.perf_counter()
+        while chunk := response.read(READ_CHUNK):
+            received += len(chunk)
+    return first_byte - started, time.perf_counter() - started, received
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    """(p50, p95, p99)."""
+    if len(values) < 2:
+        return values[0], values[0], values[0]
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return q[49], q[94], q[98]
+
+
+def measure(path: str, opener, url: str, size: int, requests: int, timeout: float = REQUEST_TIMEOUT) -> BenchResult:
+    """requests запросов подряд (после одного прогревочного, он в замер не входит)."""
+    try:
+        _get(opener, url, timeout)
+    except Exception as e:
+        return BenchResult(path, size, requests, requests, error=str(e) or type(e).__name__)
+    ttfbs, durations, total, errors = [], [], 0, 0
+    for _ in range(requests):
+        try:
+            ttfb, duration, received = _get(opener, url, timeout)
+        except Exception:
+            errors += 1
+            continue
+        if received != size:
+            errors += 1
+            continue
+        ttfbs.append(ttfb)
+        durations.append(duration)
+        total += received
+    if not durations:
+        return BenchResult(path, size, requests, errors, error="нет ответов")
+    p50, p95, p99 = percentiles(durations)
+    mbps = total * 8 / max(sum(durations), 1e-9) / 1e6
+    return BenchResult(path, size, requests, errors, mbps, statistics.median(ttfbs), p50, p95, p99)
+
+
+def _through_tunnel(config_json: str) -> str:
+    """Без правил direct: замены слушают 127.0.0.1, а профили пускают локальные адреса мимо туннеля."""
+    config = json.loads(config_json)
+    routing = config["routing"]
+    routing["rules"] = [r for r in routing["rules"] if r.get("outboundTag") != "direct"]
+    routing["domainStrategy"] = "AsIs"
+    return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+@contextlib.contextmanager
+def _proxy_path(path: str, stand_ins: StandIns, transport: str, tuning: str):
+    """Поднять путь path. Выдаёт (opener, "") или (None, причина)."""
+    if path == "direct":
+        yield _opener(None), ""
+    elif path == "local":
+        proxy = LocalProxy(free_ports(1)[0], LISTEN_HOST)
+        if not proxy.start(f"socks5://{LISTEN_HOST}:{stand_ins.socks_port}"):
+            yield None, "встроенный прокси не запустился"
+            return
+        try:
+            yield _opener(proxy.local_port), ""
+        finally:
+            proxy.stop()
+    elif path == "pproxy":
+        from proxy_manager import ProxyProcess, build_remote_url
+
+        process = ProxyProcess(free_ports(1)[0])
+        if not process.start(build_remote_url("socks5", LISTEN_HOST, stand_ins.socks_port)):
+            yield None, "pproxy не запустился"
+            return
+        try:
+            yield _opener(process.local_port), ""
+        finally:
+            process.stop()
+    elif path == "v2ray":
+        if not V2RAY_EXE.exists():
+            yield None, f"нет {V2RAY_EXE.name}"
+            return
+        if stand_ins.ss_port is None:
+            yield None, "для сервера Shadowsocks нужен пакет cryptography"
+            return
+        socks_port, http_port = free_ports(2)
+        config_json = build_from_server(
+            SsServer(LISTEN_HOST, stand_ins.ss_port, SS_METHOD, SS_PASSWORD),
+            socks_port=socks_port, http_port=http_port, api_port=None, dns=None,
+            transport=transport, tuning=tuning,
+        )
+        with InstancePool() as pool:
+            if pool.spawn(_through_tunnel(config_json)) is None:
+                yield None, "V2Ray не запустился"
+                return
+            yield _opener(http_port), ""
+    else:
+        yield None, "неизвестный путь"
+
+
+def requests_for(size: int, requests: int) -> int:
+    return max(MIN_REQUESTS, min(requests, SIZE_BUDGET // max(size, 1)))
+
+
+def run_bench(
+    paths=PATHS,
+    sizes=DEFAULT_SIZES,
+    requests: int = DEFAULT_REQUESTS,
+    transport: str = DEFAULT_TRANSPORT,
+    tuning: str = DEFAULT_TUNING,
+    on_result=None,
+) -> list[BenchResult]:
+    """Все размеры через каждый путь по очереди (пути не мешают друг другу).
+    Сбой одного пути записывается как ошибка его размеров, остальные пути замеряются.
+    on_result(BenchResult) — по мере готовности."""
+    results = []
+
+    def add(result: BenchResult):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    with StandIns() as stand_ins:
+        for path in paths:
+            done = 0
+            try:
+                with _proxy_path(path, stand_ins, transport, tuning) as (opener, error):
+                    for size in sizes:
+                        count = requests_for(size, requests)
+                        if opener is None:
+                            add(BenchResult(path, size, count, count, error=error))
+                        else:
+                            add(measure(path, opener, stand_ins.url(size), size, count))
+                        done += 1
+            except Exception as e:
+                for size in sizes[done:]:
+                    count = requests_for(size, requests)
+                    add(BenchResult(path, size, count, count, error=str(e) or type(e).__name__))
+    return results
+
+
+def _version(command) -> str:
+    try:
+        out = subprocess.run(command, capture_output=True, text=True, timeout=10, cwd=str(BASE_DIR))
+    except (OSError, subprocess.SubprocessError):
+        return ""
+    return out.stdout.strip().splitlines()[0] if out.returncode == 0 and out.stdout.strip() else ""
+
+
+def environment(transport: str, tuning: str) -> dict:
+    """С чем сделан замер: версии, платформа, настройки V2Ray."""
+    try:
+        from importlib.metadata import version
+
+        pproxy_version = version("pproxy")
+    except Exception:
+        pproxy_version = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _version(["git", "rev-parse", "--short", "HEAD"]),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "pproxy": pproxy_version,
+        "v2ray": _version([str(V2RAY_EXE), "version"]) if V2RAY_EXE.exists() else "",
+        "ss_method": SS_METHOD,
+        "transport": transport,
+        "tuning": tuning,
+    }
+
+
+def save_results(results, meta: dict, path=None):
+    """Записать {"meta": ..., "results": [...]} в path (по умолчанию bench_results/bench-время.json)."""
+    if path is None:
+        BENCH_DIR.mkdir(parents=True, exist_ok=True)
+        path = BENCH_DIR / time.strftime("bench-%Y%m%d-%H%M%S.json")
+    data = {"meta": meta, "results": [r._asdict() for r in results]}
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def load_results(path) -> list[BenchResult]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return [BenchResult(**row) for row in data.get("results", [])]
+
+
+def compare(
+    results, baseline, threshold: float = REGRESSION_THRESHOLD
+) -> list[tuple[BenchResult, BenchResult, bool | None]]:
+    """Пары (новый, прежний, регрессия) для общих путей и размеров. Регрессия — p50 или p95
+    выросли, либо пропускная способность упала больше чем на threshold (доля).
+    None — удачных запросов меньше COMPARE_MIN_REQUESTS, сравнивать нечего."""
+    previous = {(r.path, r.size): r for r in baseline if r.p50 is not None}
+    pairs = []
+    for r in results:
+        old = previous.get((r.path, r.size))
+        if old is None or r.p50 is None:
+            continue
+        if min(r.requests - r.errors, old.requests - old.errors) < COMPARE_MIN_REQUESTS:
+            pairs.append((r, old, None))
+            continue
+        limit = 1 + threshold
+        worse = r.p50 > old.p50 * limit or r.p95 > old.p95 * limit or r.mbps < old.mbps / limit
+        pairs.append((r, old, worse))
+    return pairs
+
+
+def _size_label(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):g} МБ"
+    if size >= 1024:
+        return f"{size / 1024:g} КБ"
+    return f"{size} Б"
+
+
+def _format(r: BenchResult) -> str:
+    head = f"{r.path:>7} {_size_label(r.size):>8}"
+    if r.p50 is None:
+        return f"{head}: ошибка — {r.error}"
+    return (
+        f"{head}: {r.mbps:9.1f} Мбит/с, TTFB {r.ttfb * 1000:6.1f} мс, "
+        f"p50 {r.p50 * 1000:7.1f} / p95 {r.p95 * 1000:7.1f} / p99 {r.p99 * 1000:7.1f} мс, "
+        f"запросов {r.requests}, ошибок {r.errors}"
+    )
+
+
+def _list(text: str, convert=str) -> list:
+    return [convert(x.strip()) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="bench.py", description="Замер путей прокси на локальных заменах серверов")
+    parser.add_argument("--paths", default=",".join(PATHS), help=", ".join(PATHS) + " через запятую")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="размеры ответа в байтах")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="запросов на размер")
+    parser.add_argument("--transport", default=DEFAULT_TRANSPORT, help="транспорт V2Ray: " + ", ".join(TRANSPORT_PROFILES))
+    parser.add_argument("--tuning", default=DEFAULT_TUNING, help="профиль сокетов V2Ray: " + ", ".join(TUNING_PROFILES))
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию bench_results/bench-время.json)")
+    parser.add_argument("--compare", help="прежний JSON: показать разницу, код 1 при регрессии")
+    parser.add_argument(
+        "--threshold", type=float, default=REGRESSION_THRESHOLD,
+        help=f"порог регрессии для --compare, доля (по умолчанию {REGRESSION_THRESHOLD:g})",
+    )
+    args = parser.parse_args(argv)
+    paths = _list(args.paths)
+    try:
+        sizes = _list(args.sizes, int)
+    except ValueError:
+        parser.error("--sizes: числа через запятую")
+    unknown = [p for p in paths if p not in PATHS]
+    if unknown or not paths or not sizes or min(sizes) < 1:
+        parser.error(f"пути: {', '.join(PATHS)}; размеры — положительные числа")
+    if args.transport not in TRANSPORT_PROFILES or args.tuning not in TUNING_PROFILES:
+        parser.error("неизвестный транспорт или профиль сокетов")
+    if args.threshold <= 0:
+        parser.error("--threshold: положительная доля, например 0.1")
+
+    results = run_bench(
+        paths, sizes, args.requests, args.transport, args.tuning, on_result=lambda r: print(_format(r), flush=True)
+    )
+    out = save_results(results, environment(args.transport, args.tuning), Path(args.out) if args.out else None)
+    print(f"Результаты: {out}")
+    if not args.compare:
+        return 0
+    try:
+        baseline = load_results(Path(args.compare))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Не удалось прочитать {args.compare}: {e}", file=sys.stderr)
+        return 2
+    regressions = 0
+    for new, old, worse in compare(results, baseline, args.threshold):
+        regressions += bool(worse)
+        print(
+            f"{new.path:>7} {_size_label(new.size):>8}: p50 {(new.p50 / old.p50 - 1) * 100:+.0f}%, "
+            f"p95 {(new.p95 / old.p95 - 1) * 100:+.0f}%, Мбит/с {(new.mbps / old.mbps - 1) * 100:+.0f}%"
+            + ("  — РЕГРЕССИЯ" if worse else "  — мало запросов, не сравнивается" if worse is None else "")
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Подключение без окна: для автозапуска при входе в систему и для скриптов.
+
+    python cli.py connect ss://... [--routing ru-direct] [--transport mux] [--tuning low-latency] [--fakedns] [--pac]
+    python cli.py manual socks5 host port [--user U --password P] [--pac]
+    python cli.py disconnect
+    python cli.py status
+    python cli.py probe [ss://...]
+    python cli.py startup
+
+connect и manual работают, пока их не остановят (Ctrl+C или disconnect из другого окна).
+Модули подключаются внутри команд: Tk не загружается, а каждая команда платит только за своё.
+"""
+import argparse
+import sys
+import time
+
+_STARTED = time.perf_counter()
+
+# Сколько может занимать запуск команды до начала работы (импорт модулей), с
+STARTUP_BUDGET = 0.3
+# Модули окна — в консольном режиме их быть не должно
+GUI_MODULES = ("tkinter", "customtkinter")
+WATCH_INTERVAL = 1.0
+
+
+def _state_path():
+    from app_dir import BASE_DIR
+
+    return BASE_DIR / "cli_state.json"
+
+
+def _read_state() -> dict | None:
+    import json
+
+    try:
+        return json.loads(_state_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(state: dict) -> bool:
+    import json
+    import os
+
+    try:
+        _state_path().write_text(json.dumps(dict(state, pid=os.getpid()), ensure_ascii=False), encoding="utf-8")
+        return True
+    except OSError:
+        return False
+
+
+def _remove_state():
+    try:
+        _state_path().unlink()
+    except OSError:
+        pass
+
+
+def _report_startup(args):
+    """С --timing: время от запуска до начала работы команды и проверка бюджета."""
+    if not args.timing:
+        return
+    elapsed = time.perf_counter() - _STARTED
+    loaded = [name for name in GUI_MODULES if name in sys.modules]
+    mark = "" if elapsed <= STARTUP_BUDGET else f" — больше бюджета {STARTUP_BUDGET * 1000:.0f} мс"
+    print(f"Запуск: {elapsed * 1000:.1f} мс{mark}", file=sys.stderr)
+    if loaded:
+        print("Загружены модули окна:", ", ".join(loaded), file=sys.stderr)
+
+
+def _point_proxy(port: int, pac: bool):
+    """Системный прокси на 127.0.0.1:port или PAC-скрипт. Возвращает (успех, PacServer | None)."""
+    from proxy_manager import LOCAL_PROXY_HOST, set_pac_url, set_system_proxy
+
+    if not pac:
+        return set_system_proxy(LOCAL_PROXY_HOST, port), None
+    from pac_server import PacServer
+
+    server = PacServer(LOCAL_PROXY_HOST, port)
+    if not server.start():
+        return False, None
+    return set_pac_url(server.url), server
+
+
+def _serve(state: dict, stop, tick=None) -> int:
+    """Ждать Ctrl+C или disconnect (удаление файла состояния), затем stop().
+    tick() — периодическая работа, пока подключены."""
+    import os
+
+    _write_state(state)
+    try:
+        while _state_path().exists():
+            time.sleep(WATCH_INTERVAL)
+            if tick is not None:
+                tick()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        # Файл мог уже занять другой запуск
+        if (_read_state() or {}).get("pid") == os.getpid():
+            _remove_state()
+    print("Отключено")
+    return 0
+
+
+def cmd_connect(args) -> int:
+    from config_builder import (
+        ROUTING_PROFILES,
+        TRANSPORT_PROFILES,
+        TUNING_PROFILES,
+        build_from_server,
+        parse_ss_link,
+        unsupported_reason,
+    )
+
+    if args.routing not in ROUTING_PROFILES:
+        print("Профили маршрутизации:", ", ".join(ROUTING_PROFILES), file=sys.stderr)
+        return 2
+    if args.transport not in TRANSPORT_PROFILES:
+        print("Транспорт:", ", ".join(TRANSPORT_PROFILES), file=sys.stderr)
+        return 2
+    if args.tuning not in TUNING_PROFILES:
+        print("Профили сокетов:", ", ".join(TUNING_PROFILES), file=sys.stderr)
+        return 2
+    options = {
+        "routing": args.routing,
+        "dns": "fakedns" if args.fakedns else "remote",
+        "transport": args.transport,
+        "mux_concurrency": args.mux,
+        "tuning": args.tuning,
+    }
+    if args.direct:
+        from config_builder import read_rule_list
+
+        options["direct"] = read_rule_list(args.direct)
+    tailer = None
+    if args.access_log:
+        from access_log import ACCESS_LOG_PATH, AccessLogTailer
+
+        options["access_log"] = str(ACCESS_LOG_PATH)
+        # Как в окне: разбор по мере записи, файл обрезается после MAX_LOG_BYTES
+        tailer = AccessLogTailer(ACCESS_LOG_PATH)
+        tailer.skip_existing()
+    server = parse_ss_link(args.link)
+    if server is None:
+        print("Неверный формат ссылки. Нужна ss://...", file=sys.stderr)
+        return 2
+    reason = unsupported_reason(server)
+    if reason:
+        print(reason, file=sys.stderr)
+        return 2
+    from resolver import AddressPinner
+    from supervisor import Supervisor
+
+    supervisor = Supervisor(on_event=print)
+    pinner = AddressPinner()
+    pac_server = None
+
+    def repoint(port):
+        nonlocal pac_server
+        ok, pac_server = _point_proxy(port, args.pac)
+        return ok
+
+    _report_startup(args)
+    # В конфиг — самый быстрый IP сервера вместо имени
+    def build(**ports):
+        return build_from_server(pinner.pinned(server), **options, **ports)
+
+    if not supervisor.apply(build, repoint):
+        supervisor.stop()
+        if supervisor.last_error == "proxy":
+            print("Ошибка настройки системного прокси", file=sys.stderr)
+        else:
+            print("V2Ray не запустился или не открыл порты. Проверьте папку v2ray", file=sys.stderr)
+        return 1
+    timings = supervisor.active.timings
+    print(f"Подключено по ссылке — трафик через V2Ray (готов за {timings.last:.2f} с)")
+
+    def stop():
+        from proxy_manager import clear_system_proxy
+
+        clear_system_proxy(pac_server.url if pac_server else "")
+        if pac_server is not None:
+            pac_server.stop()
+        supervisor.stop()
+        if tailer is not None:
+            from access_log import STATS_JSON_PATH
+
+            tailer.poll()
+            if tailer.stats.dump(STATS_JSON_PATH):
+                print(f"Статистика соединений: {STATS_JSON_PATH}")
+
+    def tick():
+        if tailer is not None:
+            tailer.poll()
+        # Истёк срок IP и выбран другой — заменить outbound (без перезапуска V2Ray)
+        if pinner.refresh_expired() and supervisor.apply(build, repoint):
+            print("Адрес сервера обновлён")
+
+    return _serve({"mode": "v2ray", "link": args.link, "http_port": supervisor.http_port}, stop, tick)
+
+
+def cmd_manual(args) -> int:
+    from local_proxy import LocalProxy
+    from proxy_manager import LOCAL_PROXY_HOST, LOCAL_PROXY_PORT, build_remote_url, clear_system_proxy
+
+    port = args.port or (1080 if args.protocol == "socks5" else 8080)
+    proxy = LocalProxy(local_port=LOCAL_PROXY_PORT, local_host=LOCAL_PROXY_HOST)
+    _report_startup(args)
+    if not proxy.start(build_remote_url(args.protocol, args.host, port, args.user, args.password)):
+        print("Ошибка запуска прокси", file=sys.stderr)
+        return 1
+    ok, pac_server = _point_proxy(LOCAL_PROXY_PORT, args.pac)
+    if not ok:
+        proxy.stop()
+        print("Ошибка настройки системного прокси", file=sys.stderr)
+        return 1
+    print("Подключено — трафик идёт через прокси")
+
+    def stop():
+        clear_system_proxy(pac_server.url if pac_server else "")
+        if pac_server is not None:
+            pac_server.stop()
+        proxy.stop()
+
+    return _serve({"mode": "manual", "remote": f"{args.protocol}://{args.host}:{port}"}, stop)
+
+
+def _pid_alive(pid) -> bool:
+    import os
+
+    if not isinstance(pid, int):
+        return False
+    if sys.platform == "win32":
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def cmd_disconnect(args) -> int:
+    from proxy_manager import clear_system_proxy
+
+    _report_startup(args)
+    state = _read_state()
+    _remove_state()
+    if state is None or not _pid_alive(state.get("pid")):
+        # Процесса нет — убрать то, что он мог оставить в реестре
+        clear_system_proxy()
+        print("Отключено")
+        return 0
+    # Процесс connect/manual заметит пропажу файла, уберёт прокси и остановит V2Ray
+    deadline = time.monotonic() + WATCH_INTERVAL * 10
+    while _pid_alive(state.get("pid")) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    print("Отключено")
+    return 0
+
+
+def cmd_status(args) -> int:
+    from proxy_manager import get_pac_url, get_system_proxy_status
+
+    _report_startup(args)
+    enabled, server = get_system_proxy_status()
+    pac_url = get_pac_url()
+    state = _read_state()
+    if state is not None and not _pid_alive(state.get("pid")):
+        state = None
+    if state is not None and state.get("mode") == "v2ray":
+        print("Подключено по ссылке — трафик через V2Ray")
+    elif state is not None:
+        print("Подключено —", state.get("remote", "встроенный прокси"))
+    else:
+        print("Не подключено (cli)")
+    if pac_url:
+        print("Системный прокси: PAC", pac_url)
+    elif enabled:
+        print("Системный прокси:", server)
+    else:
+        print("Системный прокси: выключен")
+    return 0 if state is not None else 3
+
+
+def cmd_probe(args) -> int:
+    from config_builder import parse_ss_link
+    from prober import run_probe
+
+    if args.links:
+        servers = [s for s in map(parse_ss_link, args.links) if s is not None]
+    else:
+        from subscription import load_cached_catalog
+
+        servers = load_cached_catalog().servers()
+    if not servers:
+        print("Нет серверов: укажите ссылки ss:// или импортируйте подписку", file=sys.stderr)
+        return 2
+    _report_startup(args)
+    for result in run_probe(servers, timeout=args.timeout, handshake=args.handshake):
+        server = result.server
+        title = server.name or f"{server.host}:{server.port}"
+        if result.ok:
+            detail = f"{result.rtt * 1000:.0f} мс"
+            if result.handshake is not None:
+                detail += f", рукопожатие {result.handshake * 1000:.0f} мс"
+        else:
+            detail = result.error or "недоступен"
+        print(f"{detail:>28}  {title}")
+    return 0
+
+
+def cmd_startup(args) -> int:
+    """Медиана времени запуска `cli.py status` в отдельных процессах за вычетом самого Python."""
+    import statistics
+    import subprocess
+
+    def run(argv) -> float:
+        started = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return time.perf_counter() - started
+
+    bare = statistics.median(run([sys.executable, "-c", "pass"]) for _ in range(args.runs))
+    command = [sys.executable, __file__, "status"]
+    full = statistics.median(run(command) for _ in range(args.runs))
+    overhead = max(full - bare, 0.0)
+    print(f"python: {bare * 1000:.0f} мс, cli.py status: {full * 1000:.0f} мс, своё: {overhead * 1000:.0f} мс")
+    print(f"Бюджет {STARTUP_BUDGET * 1000:.0f} мс: {'в норме' if overhead <= STARTUP_BUDGET else 'превышен'}")
+    return 0 if overhead <= STARTUP_BUDGET else 1
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Обход блокировок без окна")
+    parser.add_argument("--timing", action="store_true", help="показать время запуска команды")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    connect = commands.add_parser("connect", help="весь ПК через V2Ray по ссылке ss://")
+    connect.add_argument("link")
+    connect.add_argument("--routing", default="full", help="профиль маршрутизации: full, ru-direct")
+    connect.add_argument("--direct", help="файл со своими доменами мимо туннеля")
+    connect.add_argument("--fakedns", action="store_true")
+    connect.add_argument("--transport", default="tcp", help="tcp, udp, mux, mux-udp (mux — сервер V2Ray/Xray)")
+    connect.add_argument("--mux", type=int, help="потоков в одном соединении mux (по умолчанию 8)")
+    connect.add_argument("--tuning", default="default", help="default, low-latency, bulk — профиль сокетов")
+    connect.add_argument(
+        "--access-log", action="store_true", help="писать access-лог V2Ray (до 4 МБ) и при выходе сохранить топ доменов"
+    )
+    connect.add_argument("--pac", action="store_true", help="через прокси только домены из pac_domains.txt")
+    connect.set_defaults(func=cmd_connect)
+
+    manual = commands.add_parser("manual", help="через встроенный прокси к SOCKS5/HTTP-серверу")
+    manual.add_argument("protocol", choices=("socks5", "http"))
+    manual.add_argument("host")
+    manual.add_argument("port", type=int, nargs="?")
+    manual.add_argument("--user", default="")
+    manual.add_argument("--password", default="")
+    manual.add_argument("--pac", action="store_true")
+    manual.set_defaults(func=cmd_manual)
+
+    commands.add_parser("disconnect", help="отключить и убрать системный прокси").set_defaults(func=cmd_disconnect)
+    commands.add_parser("status", help="состояние подключения и системного прокси").set_defaults(func=cmd_status)
+
+    probe = commands.add_parser("probe", help="задержка серверов (по умолчанию — каталог подписок)")
+    probe.add_argument("links", nargs="*")
+    probe.add_argument("--timeout", type=float, default=3.0)
+    probe.add_argument("--handshake", action="store_true", help="проверять рукопожатие Shadowsocks")
+    probe.set_defaults(func=cmd_probe)
+
+    startup = commands.add_parser("startup", help="проверить время запуска против бюджета")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=cmd_startup)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
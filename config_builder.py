@@ -1,93 +1,623 @@
 # -*- coding: utf-8 -*-
 """
 Парсит ss:// ссылку и собирает JSON-конфиг для V2Ray/Xray на ПК.
-Формат: ss://base64(method:password)@host:port#tag
+Формат: ss://base64(method:password)@host:port/?plugin=...#tag (SIP002), userinfo может быть
+открытым текстом (method:password — так записываются ключи Shadowsocks-2022).
 """
 import base64
+import ipaddress
 import json
+import urllib.parse
+from pathlib import Path
+from typing import NamedTuple
 
+# Локальные порты inbound по умолчанию (HTTP — для системного прокси Windows)
+SOCKS_PORT = 1081
+HTTP_PORT = 3128
+# Локальный порт gRPC API V2Ray (HandlerService — замена outbound без перезапуска)
+API_PORT = 10085
+API_TAG = "api"
+API_INBOUND_TAG = "api-in"
+PROXY_TAG = "proxy"
+# Балансировка нескольких серверов (build_balanced_config)
+BALANCER_TAG = "balancer"
+BALANCER_STRATEGIES = ("random", "leastPing", "leastLoad")
+OBSERVATORY_PROBE_URL = "https://www.gstatic.com/generate_204"
+OBSERVATORY_INTERVAL = "30s"
 
-def build_from_ss_link(ss_link: str) -> str | None:
-    """Из ss:// ссылки собрать JSON-конфиг для V2Ray (с SOCKS и HTTP inbound для ПК)."""
+# Профили маршрутизации: что идёт в outbound direct, минуя туннель.
+# Локальная сеть (geoip:private, geosite:private) идёт напрямую во всех профилях.
+ROUTING_PROFILES = {
+    "full": {
+        "title": "Всё через туннель",
+        "domains": [],
+        "ips": [],
+        # Без правил по IP резолвить домены при маршрутизации не нужно
+        "domainStrategy": "IPIfNonMatch",
+    },
+    "ru-direct": {
+        "title": "Российские сайты напрямую",
+        "domains": ["domain:ru", "domain:su", "domain:xn--p1ai", "geosite:yandex", "geosite:vk"],
+        "ips": ["geoip:ru"],
+        "domainStrategy": "IPOnDemand",
+    },
+}
+DEFAULT_ROUTING = "full"
+
+# DNS внутри V2Ray: "remote" — DoH через туннель с кэшем, "fakedns" — поддельные адреса
+# из пула (домен восстанавливается сниффингом, настоящее разрешение не нужно), None — без блока dns
+DNS_MODES = ("remote", "fakedns")
+DEFAULT_DNS = "remote"
+# DoH-сервер; запросы к нему идут через outbound proxy (тег DNS_TAG в маршрутизации)
+REMOTE_DNS = "https://1.1.1.1/dns-query"
+DNS_TAG = "dns-internal"
+# Режим fakedns: локальный DNS-сервер для системы и пул поддельных адресов
+FAKEDNS_PORT = 53
+FAKEDNS_POOL = "198.18.0.0/15"
+FAKEDNS_POOL_SIZE = 65535
+DNS_INBOUND_TAG = "dns-in"
+DNS_OUTBOUND_TAG = "dns-out"
+# Транспорт до сервера. mux — соединения программ идут внутри общих TCP-соединений с сервером
+# (до "mux" потоков в каждом), без рукопожатия на каждое; сервер должен быть на V2Ray/Xray —
+# обычный shadowsocks-libev/Outline mux не понимает. udp — SOCKS inbound принимает UDP
+# (QUIC, DNS по UDP) и передаёт его через туннель; системный HTTP-прокси UDP не переносит.
+TRANSPORT_PROFILES = {
+    "tcp": {"title": "Только TCP", "mux": 0, "udp": False},
+    "udp": {"title": "TCP + UDP (QUIC, DNS)", "mux": 0, "udp": True},
+    "mux": {"title": "Mux (сервер V2Ray/Xray)", "mux": 8, "udp": False},
+    "mux-udp": {"title": "Mux + UDP (сервер V2Ray/Xray)", "mux": 8, "udp": True},
+}
+DEFAULT_TRANSPORT = "tcp"
+# Предел V2Ray для mux.concurrency
+MUX_MAX_CONCURRENCY = 1024
+# Настройка сокетов (streamSettings.sockopt V2Ray) для outbound Shadowsocks и локальных inbound.
+# tcpNoDelay задавать не нужно: Go включает TCP_NODELAY на всех TCP-сокетах сам.
+# Fast Open экономит RTT на новых соединениях, если его поддерживают ОС и сервер;
+# keepalive быстрее замечает оборванные соединения через NAT; буферы — для загрузок на большом RTT.
+TUNING_PROFILES = {
+    "default": {"title": "Как в системе", "outbound": {}, "inbound": {}},
+    "low-latency": {
+        "title": "Низкая задержка",
+        "outbound": {"tcpFastOpen": True, "tcpKeepAliveIdle": 30, "tcpKeepAliveInterval": 10},
+        "inbound": {"tcpFastOpen": True},
+    },
+    "bulk": {
+        "title": "Загрузки (большие буферы)",
+        "outbound": {
+            "tcpFastOpen": True,
+            "tcpKeepAliveIdle": 120,
+            "tcpKeepAliveInterval": 30,
+            "rxBufSize": 4 * 1024 * 1024,
+            "txBufSize": 4 * 1024 * 1024,
+        },
+        "inbound": {"rxBufSize": 1024 * 1024, "txBufSize": 1024 * 1024},
+    },
+}
+DEFAULT_TUNING = "default"
+# Shadowsocks-2022 (SIP022): метод -> длина ключа в байтах. Ключ — base64, у многопользовательских
+# серверов — "ключ_сервера:ключ_пользователя". Ссылки разбираются и хранятся в каталоге, но конфиг
+# не собирается: V2Ray из download_v2ray.py (v2fly 5.x) в outbound shadowsocks формата v4 этих
+# методов не знает и не запускается (см. unsupported_reason)
+SS2022_METHODS = {
+    "2022-blake3-aes-128-gcm": 16,
+    "2022-blake3-aes-256-gcm": 32,
+    "2022-blake3-chacha20-poly1305": 32,
+}
+# Префиксы правил V2Ray для доменов и для IP
+_DOMAIN_PREFIXES = ("domain:", "full:", "keyword:", "regexp:", "geosite:", "ext:")
+_IP_PREFIXES = ("geoip:",)
+
+
+class SsServer(NamedTuple):
+    """Сервер Shadowsocks из ссылки ss://."""
+
+    host: str  # IPv6 — без квадратных скобок
+    port: int
+    method: str
+    password: str
+    name: str = ""
+    plugin: str = ""  # SIP003: "имя;опция=значение;...", как в параметре plugin ссылки
+
+    @property
+    def key(self) -> tuple[str, int, str]:
+        """Ключ для удаления дублей: host:port:method."""
+        return self.host.lower(), self.port, self.method.lower()
+
+
+def _b64decode(text: str) -> str | None:
+    """Обычный или URL-safe base64, с паддингом или без. None — не base64."""
+    # URL-safe base64: - и _ заменяют + и /
+    pad = text.strip().replace("-", "+").replace("_", "/")
+    pad += "=" * (-len(pad) % 4)
+    try:
+        return base64.b64decode(pad, validate=True).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _valid_2022_password(method: str, password: str) -> bool:
+    """Ключи Shadowsocks-2022: base64 ровно нужной длины; у многопользовательских — "iPSK:uPSK"."""
+    key_len = SS2022_METHODS[method]
+    for psk in password.split(":"):
+        try:
+            if len(base64.b64decode(psk, validate=True)) != key_len:
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def parse_ss_link(ss_link: str) -> SsServer | None:
+    """Разобрать ss:// ссылку. None — если формат неверный. Понимает:
+    SIP002 — ss://base64(method:password)@host:port/?plugin=...#tag и открытый
+    ss://method:password@host:port (так записываются ключи 2022-blake3-*, пароль — до конца userinfo);
+    IPv6 в квадратных скобках; старую форму ss://base64(method:password@host:port)#tag."""
     link = ss_link.strip().removeprefix("ss://")
     hash_idx = link.find("#")
     main = link[:hash_idx] if hash_idx >= 0 else link
-    at_idx = main.find("@")
+    name = urllib.parse.unquote(link[hash_idx + 1 :]) if hash_idx >= 0 else ""
+    main, _, query = main.partition("?")
+    main = main.rstrip("/")
+    if "@" not in main:
+        decoded = _b64decode(main)
+        if decoded is None or "@" not in decoded:
+            return None
+        main = decoded
+    # Пароль в открытом виде может содержать незакодированный @ — адрес после последнего
+    at_idx = main.rfind("@")
     if at_idx <= 0:
         return None
-    user_info = main[:at_idx]
+    user_info = urllib.parse.unquote(main[:at_idx])
     host_port = main[at_idx + 1 :]
-    colon = host_port.rfind(":")
-    if colon <= 0:
-        return None
-    host = host_port[:colon]
-    port_str = host_port[colon + 1 :].split("/")[0].split("?")[0]
+
+    if host_port.startswith("["):
+        host, bracket, port_str = host_port[1:].partition("]")
+        if not bracket or not port_str.startswith(":"):
+            return None
+        port_str = port_str[1:]
+    else:
+        host, _, port_str = host_port.rpartition(":")
     try:
         port = int(port_str)
     except ValueError:
         return None
+    if not host or not 0 < port < 65536:
+        return None
 
-    try:
-        # URL-safe base64: - и _ заменяют + и /
-        pad = user_info.replace("-", "+").replace("_", "/")
-        pad += "=" * (4 - len(pad) % 4) if len(pad) % 4 else ""
-        decoded = base64.b64decode(pad).decode("utf-8", errors="replace")
-    except Exception:
+    # В base64 двоеточия не бывает: есть — значит userinfo открытым текстом
+    decoded = user_info if ":" in user_info else _b64decode(user_info)
+    if decoded is None or ":" not in decoded:
+        return None
+    method, password = decoded.split(":", 1)
+    method = method.strip().lower()
+    password = password.strip()
+    if not method or not password:
+        return None
+    if method in SS2022_METHODS and not _valid_2022_password(method, password):
         return None
+    plugin = urllib.parse.parse_qs(query).get("plugin", [""])[0].strip()
+    return SsServer(host, port, method, password, name, plugin)
 
-    parts = decoded.split(":", 2)
-    if len(parts) != 2:
+
+def format_ss_link(server: SsServer) -> str:
+    """Обратно в ссылку SIP002: base64(method:password), а для 2022-blake3-* — открытым текстом
+    (так требует SIP002); IPv6 — в скобках, plugin — в параметре запроса."""
+    if server.method in SS2022_METHODS:
+        user_info = urllib.parse.quote(server.method, safe="") + ":" + urllib.parse.quote(server.password, safe="")
+    else:
+        user_info = base64.urlsafe_b64encode(
+            f"{server.method}:{server.password}".encode("utf-8")
+        ).decode("ascii").rstrip("=")
+    host = f"[{server.host}]" if ":" in server.host else server.host
+    link = f"ss://{user_info}@{host}:{server.port}"
+    if server.plugin:
+        link += "/?plugin=" + urllib.parse.quote(server.plugin, safe="")
+    if server.name:
+        link += "#" + urllib.parse.quote(server.name, safe="")
+    return link
+
+
+def build_from_ss_link(ss_link: str, **options) -> str | None:
+    """Из ss:// ссылки собрать JSON-конфиг для V2Ray (с SOCKS и HTTP inbound для ПК).
+    options — параметры _build_config (routing, direct, ...)."""
+    server = parse_ss_link(ss_link)
+    if server is None:
         return None
-    method = parts[0].strip()
-    password = parts[1].strip()
+    return build_from_server(server, **options)
+
+
+def unsupported_reason(server: SsServer) -> str:
+    """Почему V2Ray не примет сервер в конфиге; "" — примет."""
+    if server.method in SS2022_METHODS:
+        return (
+            f"Метод {server.method} (Shadowsocks-2022) не поддерживается V2Ray в папке v2ray: "
+            "нужен сервер с aes-128-gcm, aes-256-gcm или chacha20-ietf-poly1305"
+        )
+    return ""
+
+
+def build_from_server(server: SsServer, **options) -> str:
+    """Конфиг для одного сервера. ValueError с текстом для пользователя, если V2Ray его не примет."""
+    return _build_config(server.host, server.port, server.method, server.password, plugin=server.plugin, **options)
+
+
+def _transport(transport: str, mux_concurrency: int | None = None) -> tuple[int, bool]:
+    """(потоков mux на соединение, 0 — без mux; принимать UDP) для профиля TRANSPORT_PROFILES.
+    mux_concurrency заменяет число потоков профиля с mux."""
+    profile = TRANSPORT_PROFILES.get(transport, TRANSPORT_PROFILES[DEFAULT_TRANSPORT])
+    mux = profile["mux"]
+    if mux and mux_concurrency:
+        mux = max(1, min(int(mux_concurrency), MUX_MAX_CONCURRENCY))
+    return mux, profile["udp"]
+
+
+def _plugin_options(plugin: str) -> tuple[str, dict]:
+    """Строка SIP003 -> (имя, опции): "obfs-local;obfs=http" -> ("obfs-local", {"obfs": "http"}).
+    Флаг без значения (tls) — True; экранированные \\; и \\= остаются частью значения."""
+    parts, current, escaped = [], "", False
+    for char in plugin:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == ";":
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    options = {}
+    for part in parts[1:]:
+        key, sep, value = part.partition("=")
+        if key.strip():
+            options[key.strip()] = value if sep else True
+    return parts[0].strip(), options
 
-    return _build_config(host, port, method, password)
 
+def _apply_plugin(outbound: dict, plugin: str, host: str) -> None:
+    """v2ray-plugin (websocket) — встроенным транспортом V2Ray ws/tls, без отдельной программы.
+    Остальные (obfs-local и др.) — через SIP003 V2Ray: программа плагина ищется рядом с v2ray.exe."""
+    name, options = _plugin_options(plugin)
+    if not name:
+        return
+    if name == "v2ray-plugin" and options.get("mode", "websocket") == "websocket":
+        server_name = options.get("host") if isinstance(options.get("host"), str) else host
+        stream = {
+            "network": "ws",
+            "wsSettings": {"path": options.get("path") or "/", "headers": {"Host": server_name}},
+        }
+        if options.get("tls"):
+            stream["security"] = "tls"
+            stream["tlsSettings"] = {"serverName": server_name}
+        outbound["streamSettings"] = stream
+        return
+    outbound["settings"]["plugin"] = name
+    outbound["settings"]["pluginOpts"] = plugin.partition(";")[2]
 
-def _build_config(host: str, port: int, method: str, password: str) -> str:
-    """Конфиг с SOCKS 1081 и HTTP 3128 (для системного прокси ПК)."""
+
+def _ss_outbound(
+    host: str, port: int, method: str, password: str, tag: str = PROXY_TAG, mux: int = 0, plugin: str = ""
+) -> dict:
+    reason = unsupported_reason(SsServer(host, port, method, password))
+    if reason:
+        raise ValueError(reason)
+    outbound = {
+        "protocol": "shadowsocks",
+        "settings": {
+            "servers": [
+                {
+                    "address": host,
+                    "port": port,
+                    "method": method,
+                    "password": password,
+                }
+            ]
+        },
+        "tag": tag,
+    }
+    if mux:
+        outbound["mux"] = {"enabled": True, "concurrency": mux}
+    if plugin:
+        _apply_plugin(outbound, plugin, host)
+    return outbound
+
+
+def read_rule_list(path) -> list[str]:
+    """Список правил из текстового файла: по одному на строку, # — комментарий."""
+    try:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    return [line.split("#", 1)[0].strip() for line in lines if line.split("#", 1)[0].strip()]
+
+
+def _split_rules(entries) -> tuple[list[str], list[str]]:
+    """Разделить пользовательские правила на доменные и IP.
+    'example.com' -> 'domain:example.com', '10.0.0.0/8' и 'geoip:xx' -> IP."""
+    domains, ips = [], []
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        if entry.startswith(_IP_PREFIXES):
+            ips.append(entry)
+            continue
+        if entry.startswith(_DOMAIN_PREFIXES):
+            domains.append(entry)
+            continue
+        try:
+            ipaddress.ip_network(entry, strict=False)
+            ips.append(entry)
+        except ValueError:
+            domains.append("domain:" + entry.lstrip("."))
+    return domains, ips
+
+
+def _apply_routing(config: dict, routing: str, direct) -> list[str]:
+    """Правила direct из профиля и пользовательского списка — перед правилом «всё в туннель».
+    Вернуть доменные правила direct."""
+    profile = ROUTING_PROFILES.get(routing, ROUTING_PROFILES[DEFAULT_ROUTING])
+    user_domains, user_ips = _split_rules(direct or ())
+    domains = profile["domains"] + user_domains
+    ips = profile["ips"] + user_ips
+    rules = config["routing"]["rules"]
+    at = rules.index(_catch_all_rule(config))
+    new_rules = []
+    if domains:
+        new_rules.append({"type": "field", "domain": domains, "outboundTag": "direct"})
+    if ips:
+        new_rules.append({"type": "field", "ip": ips, "outboundTag": "direct"})
+    rules[at:at] = new_rules
+    config["routing"]["domainStrategy"] = profile["domainStrategy"]
+    return domains
+
+
+def _add_dns(config: dict, mode: str, direct_domains: list[str]) -> None:
+    """Блок dns: кэш V2Ray, DoH через туннель, системный резолвер для доменов мимо туннеля.
+    В режиме fakedns — ещё пул поддельных адресов, сниффинг на inbound и DNS-сервер на FAKEDNS_PORT."""
+    servers = [{"address": REMOTE_DNS}]
+    local_domains = ["geosite:private"] + direct_domains
+    servers.append({"address": "localhost", "domains": local_domains, "skipFallback": True})
+    config["dns"] = {"servers": servers, "queryStrategy": "UseIPv4", "tag": DNS_TAG}
+    rules = config["routing"]["rules"]
+    rules.insert(0, {"type": "field", "inboundTag": [DNS_TAG], "outboundTag": PROXY_TAG})
+    # Прямые соединения берут адрес из кэша V2Ray, а не из системного резолвера
+    direct = next(ob for ob in config["outbounds"] if ob["tag"] == "direct")
+    direct["settings"] = {"domainStrategy": "UseIPv4"}
+    if mode != "fakedns":
+        return
+    config["fakedns"] = {"ipPool": FAKEDNS_POOL, "poolSize": FAKEDNS_POOL_SIZE}
+    # Внутренние запросы V2Ray (маршрутизация, freedom) fakedns не используют — только клиенты dns-in
+    servers.insert(0, "fakedns")
+    for inbound in config["inbounds"]:
+        inbound["sniffing"] = {"enabled": True, "destOverride": ["fakedns"]}
+    config["inbounds"].append(
+        {
+            "listen": "127.0.0.1",
+            "port": FAKEDNS_PORT,
+            "protocol": "dokodemo-door",
+            "tag": DNS_INBOUND_TAG,
+            "settings": {"address": "1.1.1.1", "port": 53, "network": "tcp,udp"},
+        }
+    )
+    config["outbounds"].append({"protocol": "dns", "tag": DNS_OUTBOUND_TAG})
+    rules.insert(0, {"type": "field", "inboundTag": [DNS_INBOUND_TAG], "outboundTag": DNS_OUTBOUND_TAG})
+    # Домен восстанавливается сниффингом, разрешать его для маршрутизации не нужно — если нет
+    # правил direct по IP (geoip:ru профиля ru-direct, подсети из direct_domains.txt): с AsIs они
+    # для доменов не срабатывают. Тогда IPIfNonMatch: домен без доменного правила разрешается
+    # (DoH через туннель, с кэшем) и сверяется с правилами по IP
+    ip_rules = [
+        r for r in rules if r.get("outboundTag") == "direct" and set(r.get("ip", ())) - {"geoip:private"}
+    ]
+    config["routing"]["domainStrategy"] = "IPIfNonMatch" if ip_rules else "AsIs"
+
+
+def _config_dict(
+    proxy_outbounds: list[dict],
+    socks_port: int,
+    http_port: int,
+    api_port: int | None,
+    routing: str = DEFAULT_ROUTING,
+    direct=(),
+    dns: str | None = DEFAULT_DNS,
+    access_log: str | None = None,
+    udp: bool = False,
+    tuning: str = DEFAULT_TUNING,
+) -> dict:
+    """Общая часть конфига: локальные inbound, outbound direct/block и маршрутизация в proxy.
+    routing — ключ ROUTING_PROFILES, direct — дополнительные домены/IP мимо туннеля,
+    dns — режим из DNS_MODES (None — без блока dns, разрешение системой),
+    access_log — путь к access-логу соединений (None — не писать), udp — UDP через SOCKS inbound,
+    tuning — профиль сокетов из TUNING_PROFILES."""
     config = {
         "log": {"loglevel": "warning"},
         "inbounds": [
             {
                 "listen": "127.0.0.1",
-                "port": 1081,
+                "port": socks_port,
                 "protocol": "socks",
                 "tag": "socks-in",
-                "settings": {"auth": "noauth", "udp": False},
+                "settings": {"auth": "noauth", "udp": udp},
             },
             {
                 "listen": "127.0.0.1",
-                "port": 3128,
+                "port": http_port,
                 "protocol": "http",
                 "tag": "http-in",
                 "settings": {},
             },
         ],
-        "outbounds": [
-            {
-                "protocol": "shadowsocks",
-                "settings": {
-                    "servers": [
-                        {
-                            "address": host,
-                            "port": port,
-                            "method": method,
-                            "password": password,
-                        }
-                    ]
-                },
-                "tag": "proxy",
-            },
+        "outbounds": proxy_outbounds
+        + [
             {"protocol": "freedom", "settings": {}, "tag": "direct"},
             {"protocol": "blackhole", "settings": {}, "tag": "block"},
         ],
         "routing": {
             "domainStrategy": "IPOnDemand",
             "rules": [
-                {"type": "field", "ip": ["geoip:private"], "outboundTag": "block"},
-                {"type": "field", "network": "tcp,udp", "outboundTag": "proxy"},
+                {"type": "field", "domain": ["geosite:private"], "outboundTag": "direct"},
+                {"type": "field", "ip": ["geoip:private"], "outboundTag": "direct"},
+                {"type": "field", "network": "tcp,udp", "outboundTag": PROXY_TAG},
             ],
         },
     }
+    if udp:
+        # Адрес, который SOCKS сообщает клиенту для UDP ASSOCIATE
+        config["inbounds"][0]["settings"]["ip"] = "127.0.0.1"
+    if access_log:
+        config["log"]["access"] = access_log
+    _apply_tuning(config, tuning)
+    direct_domains = _apply_routing(config, routing, direct)
+    if dns in DNS_MODES:
+        _add_dns(config, dns, direct_domains)
+    if api_port is not None:
+        _add_api(config, api_port)
+    return config
+
+
+def _apply_tuning(config: dict, tuning: str) -> None:
+    """sockopt профиля на outbound Shadowsocks и на SOCKS/HTTP inbound."""
+    profile = TUNING_PROFILES.get(tuning, TUNING_PROFILES[DEFAULT_TUNING])
+    sides = [("outbound", ob) for ob in config["outbounds"] if ob["protocol"] == "shadowsocks"]
+    sides += [("inbound", ib) for ib in config["inbounds"] if ib["protocol"] in ("socks", "http")]
+    for side, handler in sides:
+        if profile[side]:
+            handler.setdefault("streamSettings", {})["sockopt"] = dict(profile[side])
+
+
+def _catch_all_rule(config: dict) -> dict:
+    """Последнее правило: весь остальной TCP/UDP-трафик — в туннель."""
+    return next(r for r in config["routing"]["rules"] if r.get("network") == "tcp,udp")
+
+
+def _build_config(
+    host: str,
+    port: int,
+    method: str,
+    password: str,
+    socks_port: int = SOCKS_PORT,
+    http_port: int = HTTP_PORT,
+    api_port: int | None = API_PORT,
+    routing: str = DEFAULT_ROUTING,
+    direct=(),
+    dns: str | None = DEFAULT_DNS,
+    access_log: str | None = None,
+    transport: str = DEFAULT_TRANSPORT,
+    mux_concurrency: int | None = None,
+    tuning: str = DEFAULT_TUNING,
+    plugin: str = "",
+) -> str:
+    """Конфиг с SOCKS 1081 и HTTP 3128 (для системного прокси ПК) и API на API_PORT.
+    Порты можно переопределить (параллельные экземпляры); api_port=None — без API.
+    routing — профиль из ROUTING_PROFILES, direct — свои домены/IP мимо туннеля, dns — режим DNS,
+    access_log — путь к access-логу, transport — профиль из TRANSPORT_PROFILES,
+    tuning — профиль сокетов из TUNING_PROFILES, plugin — плагин SIP003 из ссылки."""
+    mux, udp = _transport(transport, mux_concurrency)
+    config = _config_dict(
+        [_ss_outbound(host, port, method, password, mux=mux, plugin=plugin)],
+        socks_port,
+        http_port,
+        api_port,
+        routing=routing,
+        direct=direct,
+        dns=dns,
+        access_log=access_log,
+        udp=udp,
+        tuning=tuning,
+    )
     return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+def build_balanced_config(
+    servers: list[SsServer],
+    strategy: str = "leastPing",
+    socks_port: int = SOCKS_PORT,
+    http_port: int = HTTP_PORT,
+    api_port: int | None = API_PORT,
+    probe_url: str = OBSERVATORY_PROBE_URL,
+    probe_interval: str = OBSERVATORY_INTERVAL,
+    routing: str = DEFAULT_ROUTING,
+    direct=(),
+    dns: str | None = DEFAULT_DNS,
+    access_log: str | None = None,
+    transport: str = DEFAULT_TRANSPORT,
+    mux_concurrency: int | None = None,
+    tuning: str = DEFAULT_TUNING,
+) -> str | None:
+    """Конфиг с несколькими серверами за балансировщиком V2Ray.
+    strategy: random, leastPing (observatory) или leastLoad (burstObservatory).
+    Outbound серверов — proxy-0, proxy-1, ...; новые соединения распределяются между ними.
+    ValueError — если какой-то сервер V2Ray не примет (unsupported_reason)."""
+    if not servers or strategy not in BALANCER_STRATEGIES:
+        return None
+    prefix = f"{PROXY_TAG}-"
+    mux, udp = _transport(transport, mux_concurrency)
+    outbounds = [
+        _ss_outbound(s.host, s.port, s.method, s.password, tag=f"{prefix}{i}", mux=mux, plugin=s.plugin)
+        for i, s in enumerate(servers)
+    ]
+    config = _config_dict(
+        outbounds,
+        socks_port,
+        http_port,
+        api_port,
+        routing=routing,
+        direct=direct,
+        dns=dns,
+        access_log=access_log,
+        udp=udp,
+        tuning=tuning,
+    )
+    # Всё, что шло в proxy (трафик и запросы DoH), — через балансировщик
+    for rule in config["routing"]["rules"]:
+        if rule.get("outboundTag") == PROXY_TAG:
+            del rule["outboundTag"]
+            rule["balancerTag"] = BALANCER_TAG
+    balancer = {"tag": BALANCER_TAG, "selector": [prefix], "strategy": {"type": strategy}}
+    config["routing"]["balancers"] = [balancer]
+    if strategy == "leastPing":
+        config["observatory"] = {
+            "subjectSelector": [prefix],
+            "probeURL": probe_url,
+            "probeInterval": probe_interval,
+        }
+    elif strategy == "leastLoad":
+        balancer["strategy"]["settings"] = {"tolerance": 0.01, "maxRTT": "2s"}
+        config["burstObservatory"] = {
+            "subjectSelector": [prefix],
+            "pingConfig": {
+                "destination": probe_url,
+                "interval": probe_interval,
+                "timeout": "5s",
+                "sampling": 5,
+            },
+        }
+    return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+def _add_api(config: dict, api_port: int):
+    """gRPC API на 127.0.0.1:api_port (dokodemo-door inbound + правило маршрутизации).
+    StatsService со счётчиками трафика по каждому inbound и outbound (секции stats и policy)."""
+    config["api"] = {"tag": API_TAG, "services": ["HandlerService", "StatsService"]}
+    config["stats"] = {}
+    config["policy"] = {
+        "system": {
+            "statsInboundUplink": True,
+            "statsInboundDownlink": True,
+            "statsOutboundUplink": True,
+            "statsOutboundDownlink": True,
+        }
+    }
+    config["inbounds"].append(
+        {
+            "listen": "127.0.0.1",
+            "port": api_port,
+            "protocol": "dokodemo-door",
+            "tag": API_INBOUND_TAG,
+            "settings": {"address": "127.0.0.1"},
+        }
+    )
+    config["routing"]["rules"].insert(
+        0, {"type": "field", "inboundTag": [API_INBOUND_TAG], "outboundTag": API_TAG}
+    )
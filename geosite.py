@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Чтение v2ray/geosite.dat без V2Ray: потоковый разбор protobuf (разбираются только нужные
+категории), сопоставление доменов по правилам domain/full/keyword/regexp и кэш
+скомпилированных категорий в папке cache (открывается через mmap, без разбора).
+"""
+import hashlib
+import json
+import mmap
+import re
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+
+from app_dir import BASE_DIR
+from config_builder import DEFAULT_ROUTING, ROUTING_PROFILES
+
+GEOSITE_PATH = BASE_DIR / "v2ray" / "geosite.dat"
+CACHE_DIR = BASE_DIR / "cache"
+# Типы правил в geosite.dat (router.proto, Domain.Type)
+PLAIN, REGEX, DOMAIN, FULL = 0, 1, 2, 3
+_CACHE_MAGIC = b"GSM2"
+_CACHE_HEADER = struct.Struct("<4sIII")  # magic, суффиксов, полных имён, длина JSON
+
+
+def _varint(buf, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf, pos: int, end: int):
+    """Поля protobuf-сообщения buf[pos:end]: (номер, значение или (начало, конец) для bytes)."""
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 1:
+            value, pos = None, pos + 8
+        elif wire == 5:
+            value, pos = None, pos + 4
+        else:
+            raise ValueError(f"geosite.dat: неизвестный тип поля {wire}")
+        yield number, value
+
+
+def _parse_domain(buf, start: int, end: int) -> tuple[int, str, set[str]]:
+    """Domain: (тип, значение, имена атрибутов)."""
+    kind, value, attrs = PLAIN, "", set()
+    for number, field in _fields(buf, start, end):
+        if number == 1:
+            kind = field
+        elif number == 2:
+            value = bytes(buf[field[0]:field[1]]).decode("utf-8")
+        elif number == 3:
+            for attr_number, attr_field in _fields(buf, *field):
+                if attr_number == 1:
+                    attrs.add(bytes(buf[attr_field[0]:attr_field[1]]).decode("utf-8").lower())
+    return kind, value, attrs
+
+
+def iter_categories(wanted, path: Path = GEOSITE_PATH):
+    """(категория, [(тип, значение, атрибуты), ...]) для категорий из wanted (без учёта регистра).
+    Остальные записи пропускаются по длине, не разбирая их домены."""
+    wanted = {name.upper() for name in wanted}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for number, field in _fields(buf, 0, len(buf)):
+            if not wanted:
+                break
+            if number != 1:
+                continue
+            start, end = field
+            code, domains = None, []
+            for entry_number, entry_field in _fields(buf, start, end):
+                if entry_number == 1:
+                    code = bytes(buf[entry_field[0]:entry_field[1]]).decode("utf-8").upper()
+                    if code not in wanted:
+                        break
+                elif entry_number == 2 and code is not None:
+                    domains.append(_parse_domain(buf, *entry_field))
+            if code in wanted:
+                wanted.discard(code)
+                yield code.lower(), domains
+
+
+def list_categories(path: Path = GEOSITE_PATH) -> list[str]:
+    """Имена всех категорий файла."""
+    names = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for number, field in _fields(buf, 0, len(buf)):
+            if number != 1:
+                continue
+            for entry_number, entry_field in _fields(buf, *field):
+                if entry_number == 1:
+                    names.append(bytes(buf[entry_field[0]:entry_field[1]]).decode("utf-8").lower())
+                    break
+    return names
+
+
+def _slot_count(count: int) -> int:
+    """Степень двойки не меньше 2*count: таблица заполнена не больше чем наполовину."""
+    slots = 8
+    while slots < 2 * count:
+        slots *= 2
+    return slots
+
+
+class _HashTable:
+    """Множество строк в буфере: открытая адресация по crc32 (слоты uint32 — номер строки + 1),
+    затем таблица смещений uint32 и сами строки. Работает прямо поверх mmap."""
+
+    def __init__(self, buf, offset: int, count: int):
+        self._slots_n = _slot_count(count)
+        view = memoryview(buf)
+        self._slots = view[offset:offset + 4 * self._slots_n].cast("I")
+        offset += 4 * self._slots_n
+        self._offsets = view[offset:offset + 4 * (count + 1)].cast("I")
+        self._data = offset + 4 * (count + 1)
+        self._buf = buf
+        self._count = count
+        data_len = self._offsets[count]
+        # Сколько байт занимает таблица в буфере (данные выровнены до 4)
+        self.size = 4 * self._slots_n + 4 * (count + 1) + data_len + (-data_len % 4)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._item(i)
+
+    def _item(self, i: int) -> bytes:
+        return self._buf[self._data + self._offsets[i]:self._data + self._offsets[i + 1]]
+
+    def __contains__(self, key: bytes) -> bool:
+        mask = self._slots_n - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            index = self._slots[slot]
+            if not index:
+                return False
+            if self._item(index - 1) == key:
+                return True
+            slot = (slot + 1) & mask
+
+    @staticmethod
+    def pack(items) -> bytes:
+        items = sorted(items)
+        slots_n = _slot_count(len(items))
+        slots = [0] * slots_n
+        offsets, pos = [0], 0
+        for i, item in enumerate(items):
+            slot = zlib.crc32(item) & (slots_n - 1)
+            while slots[slot]:
+                slot = (slot + 1) & (slots_n - 1)
+            slots[slot] = i + 1
+            pos += len(item)
+            offsets.append(pos)
+        return (
+            struct.pack(f"<{slots_n}I", *slots)
+            + struct.pack(f"<{len(offsets)}I", *offsets)
+            + b"".join(items)
+            + b"\0" * (-pos % 4)
+        )
+
+
+class DomainMatcher:
+    """Проверка имени хоста по правилам V2Ray: domain (суффикс), full, keyword, regexp.
+    Суффиксы и полные имена — множество bytes или _HashTable из кэша."""
+
+    def __init__(self, suffixes=(), fulls=(), keywords=(), regexps=()):
+        self.suffixes = suffixes if isinstance(suffixes, _HashTable) else {s.encode() for s in suffixes}
+        self.fulls = fulls if isinstance(fulls, _HashTable) else {s.encode() for s in fulls}
+        self.keywords = list(keywords)
+        self.regexps = list(regexps)
+        self._keyword_re = re.compile("|".join(map(re.escape, self.keywords))) if self.keywords else None
+        # Одно выражение на все regexp-правила — один проход вместо десятков
+        try:
+            self._regexps = [re.compile("|".join(f"(?:{r})" for r in self.regexps))] if self.regexps else []
+        except re.error:
+            self._regexps = [re.compile(r) for r in self.regexps]
+
+    def __len__(self):
+        return len(self.suffixes) + len(self.fulls) + len(self.keywords) + len(self.regexps)
+
+    def match(self, host: str) -> bool:
+        host = host.lower().rstrip(".")
+        try:
+            key = host.encode("idna") if not host.isascii() else host.encode()
+        except UnicodeError:
+            return False
+        if key in self.fulls:
+            return True
+        suffixes = self.suffixes
+        pos = 0
+        while pos >= 0:
+            if key[pos:] in suffixes:
+                return True
+            pos = key.find(b".", pos)
+            if pos >= 0:
+                pos += 1
+        if self._keyword_re is not None and self._keyword_re.search(host):
+            return True
+        return any(r.search(host) for r in self._regexps)
+
+    def dump(self) -> bytes:
+        """Скомпилированная форма для кэша."""
+        extra = json.dumps({"keywords": self.keywords, "regexps": self.regexps}).encode("utf-8")
+        extra += b"\0" * (-len(extra) % 4)
+        return (
+            _CACHE_HEADER.pack(_CACHE_MAGIC, len(self.suffixes), len(self.fulls), len(extra))
+            + extra
+            + _HashTable.pack(self.suffixes)
+            + _HashTable.pack(self.fulls)
+        )
+
+    @classmethod
+    def from_buffer(cls, buf) -> "DomainMatcher":
+        magic, n_suffixes, n_fulls, extra_len = _CACHE_HEADER.unpack_from(buf, 0)
+        if magic != _CACHE_MAGIC:
+            raise ValueError("не кэш geosite")
+        pos = _CACHE_HEADER.size
+        extra = json.loads(bytes(buf[pos:pos + extra_len]).rstrip(b"\0"))
+        pos += extra_len
+        suffixes = _HashTable(buf, pos, n_suffixes)
+        pos += suffixes.size
+        fulls = _HashTable(buf, pos, n_fulls)
+        return cls(suffixes, fulls, extra["keywords"], extra["regexps"])
+
+
+def _split_category(name: str) -> tuple[str, str | None]:
+    """'google@cn' -> ('google', 'cn'): только домены с атрибутом cn."""
+    name, _, attr = name.strip().lower().partition("@")
+    return name, attr or None
+
+
+def compile_categories(categories, path: Path = GEOSITE_PATH) -> DomainMatcher:
+    """Собрать матчер из категорий geosite.dat (разбор файла, без кэша)."""
+    selected = {}
+    for name in categories:
+        base, attr = _split_category(name)
+        selected.setdefault(base, set()).add(attr)
+    suffixes, fulls, keywords, regexps = set(), set(), [], []
+    for code, domains in iter_categories(selected, path):
+        attrs_wanted = selected[code]
+        for kind, value, attrs in domains:
+            if None not in attrs_wanted and not (attrs & attrs_wanted):
+                continue
+            value = value.lower()
+            if kind == DOMAIN:
+                suffixes.add(value)
+            elif kind == FULL:
+                fulls.add(value)
+            elif kind == PLAIN:
+                keywords.append(value)
+            elif kind == REGEX:
+                regexps.append(value)
+    return DomainMatcher(suffixes, fulls, sorted(set(keywords)), sorted(set(regexps)))
+
+
+_loaded = {}
+
+
+def load_categories(categories, path: Path = GEOSITE_PATH) -> DomainMatcher | None:
+    """Матчер категорий через кэш в CACHE_DIR (mmap). None — если geosite.dat нет или он битый."""
+    categories = sorted({c.strip().lower() for c in categories if c.strip()})
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    source = f"{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{','.join(categories)}"
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    if digest in _loaded:
+        return _loaded[digest]
+    cache_path = CACHE_DIR / f"geosite-{digest}.bin"
+    matcher = None
+    try:
+        with open(cache_path, "rb") as f:
+            matcher = DomainMatcher.from_buffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError, struct.error):
+        pass
+    if matcher is None:
+        try:
+            matcher = compile_categories(categories, path)
+        except (OSError, ValueError, IndexError, UnicodeDecodeError):
+            return None
+        try:
+            CACHE_DIR.mkdir(exist_ok=True)
+            tmp = cache_path.with_suffix(".tmp")
+            tmp.write_bytes(matcher.dump())
+            tmp.replace(cache_path)
+        except OSError:
+            pass
+    _loaded[digest] = matcher
+    return matcher
+
+
+class RuleSet:
+    """Список правил V2Ray (domain:, full:, keyword:, regexp:, geosite:, просто домен).
+    Правила по IP (geoip:, подсети) пропускаются — они требуют разрешения имени."""
+
+    def __init__(self, rules, path: Path = GEOSITE_PATH):
+        suffixes, fulls, keywords, regexps, categories = set(), set(), [], [], []
+        for rule in rules:
+            rule = rule.strip()
+            prefix, _, value = rule.partition(":")
+            if not value:
+                prefix, value = "domain", rule
+            if prefix == "geosite":
+                categories.append(value)
+            elif prefix == "domain":
+                suffixes.add(value.lower().lstrip("."))
+            elif prefix == "full":
+                fulls.add(value.lower())
+            elif prefix == "keyword":
+                keywords.append(value.lower())
+            elif prefix == "regexp":
+                regexps.append(value)
+        self.matchers = [DomainMatcher(suffixes, fulls, keywords, regexps)]
+        if categories:
+            geosite = load_categories(categories, path)
+            if geosite is not None:
+                self.matchers.append(geosite)
+
+    def match(self, host: str) -> bool:
+        return any(m.match(host) for m in self.matchers)
+
+
+def route_of(host: str, routing: str = DEFAULT_ROUTING, direct=()) -> str:
+    """"direct" или "proxy" — куда V2Ray отправит домен по профилю маршрутизации
+    (по доменным правилам; geoip и подсети не проверяются)."""
+    profile = ROUTING_PROFILES.get(routing, ROUTING_PROFILES[DEFAULT_ROUTING])
+    rules = ["geosite:private"] + profile["domains"] + list(direct)
+    return "direct" if RuleSet(rules).match(host) else "proxy"
+
+
+def benchmark(matcher, hosts, rounds: int = 5) -> float:
+    """Проверок в секунду на списке hosts."""
+    hosts = list(hosts)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for host in hosts:
+            matcher.match(host)
+    return rounds * len(hosts) / max(time.perf_counter() - started, 1e-9)
+
+
+def main(argv=None):
+    """python geosite.py <категория>... [--bench] — размер категорий и скорость проверки."""
+    argv = sys.argv[1:] if argv is None else argv
+    categories = [a for a in argv if not a.startswith("--")] or ["geolocation-!cn"]
+    started = time.perf_counter()
+    compiled = compile_categories(categories)
+    print(f"Разбор geosite.dat: {len(compiled)} правил за {time.perf_counter() - started:.3f} с")
+    started = time.perf_counter()
+    cached = load_categories(categories)
+    if cached is None:
+        print("Не удалось открыть", GEOSITE_PATH)
+        return
+    print(f"Загрузка из кэша: {time.perf_counter() - started:.3f} с")
+    if "--bench" in argv:
+        sample = [s.decode() for s in list(compiled.suffixes)[:1000]]
+        hosts = [f"www.{s}" for s in sample] + [f"host{i}.example.invalid" for i in range(len(sample))]
+        print(f"В памяти: {benchmark(compiled, hosts):,.0f} проверок/с")
+        print(f"Кэш (mmap): {benchmark(cached, hosts):,.0f} проверок/с")
+
+
+if __name__ == "__main__":
+    main()
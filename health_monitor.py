@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Контроль активного подключения: периодический запрос через локальный HTTP inbound V2Ray,
+сглаженные (EWMA) задержка и доля ошибок. При превышении порогов — вызов on_degraded,
+дальше решает приложение — например, переключает сервер. Проверки — корутина run() в общем
+цикле asyncio окна (TaskRunner), сам запрос — в его пуле потоков.
+"""
+import asyncio
+import threading
+import time
+import urllib.request
+from typing import NamedTuple
+
+from config_builder import HTTP_PORT, OBSERVATORY_PROBE_URL
+
+CHECK_INTERVAL = 10.0
+PROBE_TIMEOUT = 5.0
+# Вес нового замера в EWMA
+ALPHA = 0.3
+# Пороги: сглаженная задержка (с) и доля неудачных проверок
+MAX_LATENCY = 2.0
+MAX_FAILURE_RATE = 0.5
+# Сколько замеров накопить перед первым решением (после старта или переключения)
+MIN_SAMPLES = 3
+
+
+class Health(NamedTuple):
+    latency: float | None  # EWMA задержки удачных проверок, с
+    failure_rate: float  # EWMA доли неудачных (0..1)
+    samples: int
+    last_error: str = ""
+
+    @property
+    def degraded(self) -> bool:
+        if self.samples < MIN_SAMPLES:
+            return False
+        return self.failure_rate > MAX_FAILURE_RATE or (self.latency or 0.0) > MAX_LATENCY
+
+
+def probe_through_proxy(
+    port: int = HTTP_PORT, url: str = OBSERVATORY_PROBE_URL, timeout: float = PROBE_TIMEOUT, host: str = "127.0.0.1"
+) -> float:
+    """Секунды до ответа на запрос url через HTTP-прокси host:port. Ошибка — исключение."""
+    proxy = f"http://{host}:{port}"
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+    started = time.perf_counter()
+    with opener.open(url, timeout=timeout) as response:
+        response.read(1)
+    return time.perf_counter() - started
+
+
+class HealthMonitor:
+    """Проверки до отмены run(); on_degraded(Health) — один раз, пока не вызван reset(),
+    из потока пула. reset() и health можно вызывать из любого потока."""
+
+    def __init__(self, on_degraded, probe=probe_through_proxy, interval: float = CHECK_INTERVAL, alpha: float = ALPHA):
+        self.on_degraded = on_degraded
+        self.probe = probe
+        self.interval = interval
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Начать оценку заново (после переключения сервера)."""
+        with self._lock:
+            self._latency = None
+            self._failure = 0.0
+            self._samples = 0
+            self._error = ""
+            self._fired = False
+
+    @property
+    def health(self) -> Health:
+        with self._lock:
+            return Health(self._latency, self._failure, self._samples, self._error)
+
+    def check(self) -> Health:
+        """Одна проверка и обновление EWMA."""
+        try:
+            latency, error = self.probe(), ""
+        except Exception as e:
+            latency, error = None, str(e) or type(e).__name__
+        a = self.alpha
+        with self._lock:
+            failed = 1.0 if latency is None else 0.0
+            self._failure = failed if self._samples == 0 else a * failed + (1 - a) * self._failure
+            if latency is not None:
+                self._latency = latency if self._latency is None else a * latency + (1 - a) * self._latency
+            self._samples += 1
+            self._error = error
+            health = Health(self._latency, self._failure, self._samples, self._error)
+            fire = health.degraded and not self._fired
+            if fire:
+                self._fired = True
+        if fire:
+            self.on_degraded(health)
+        return health
+
+    async def run(self):
+        """Проверять каждые interval секунд, пока задачу не отменят."""
+        loop = asyncio.get_running_loop()
+        self.reset()
+        while True:
+            await asyncio.sleep(self.interval)
+            await loop.run_in_executor(None, self.check)
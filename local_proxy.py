@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""
+Встроенный локальный прокси на asyncio (замена отдельному процессу pproxy).
+Принимает HTTP CONNECT и обычный HTTP на локальном порту и пересылает трафик
+через удалённый SOCKS5/HTTP-прокси (URL из proxy_manager.build_remote_url).
+"""
+import asyncio
+import base64
+import errno
+import ipaddress
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+from proc_log import LogBuffer
+from readiness import StartupTimings
+from upstream_pool import (
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_IDLE_PER_HOST,
+    DEFAULT_POOL_SIZE,
+    UpstreamPool,
+)
+
+# Размер буфера пересылки и буферов сокетов
+RELAY_BUFFER = 256 * 1024
+# Нулевое копирование через os.splice (только Linux): сокет -> pipe -> сокет
+USE_SPLICE = sys.platform.startswith("linux") and hasattr(os, "splice")
+PIPE_SIZE = 1024 * 1024
+CONNECT_TIMEOUT = 10.0
+# Сколько ждать второе направление после закрытия первого
+HALF_CLOSE_TIMEOUT = 30.0
+MAX_HEADER_BYTES = 64 * 1024
+
+HOP_BY_HOP_HEADERS = {"proxy-connection", "proxy-authorization", "connection", "keep-alive"}
+# Запросы, которые можно повторить на новом соединении, если из пула досталось закрытое (RFC 9110, 9.2.2)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"}
+
+
+class ProxyError(Exception):
+    """Ошибка рукопожатия с удалённым прокси или разбора запроса клиента."""
+
+
+class PeerClosed(ProxyError):
+    """Собеседник закрыл соединение посреди рукопожатия."""
+
+
+def parse_remote_url(remote_url: str) -> tuple[str, str, int, str, str]:
+    """socks5://[user:pass@]host:port -> (протокол, хост, порт, логин, пароль)."""
+    parts = urllib.parse.urlsplit(remote_url)
+    scheme = parts.scheme.lower()
+    if scheme not in ("socks5", "http"):
+        raise ProxyError(f"неподдерживаемый протокол: {parts.scheme}")
+    if not parts.hostname:
+        raise ProxyError("не указан хост удалённого прокси")
+    port = parts.port or (1080 if scheme == "socks5" else 8080)
+    user = urllib.parse.unquote(parts.username or "")
+    password = urllib.parse.unquote(parts.password or "")
+    return scheme, parts.hostname, port, user, password
+
+
+def split_host_port(target: str, default_port: int) -> tuple[str, int]:
+    """'example.com:443' / '[::1]:443' / 'example.com' -> (хост, порт)."""
+    if target.startswith("["):
+        end = target.find("]")
+        if end < 0:
+            raise ProxyError(f"неверный адрес: {target}")
+        host, rest = target[1:end], target[end + 1 :]
+        port = int(rest[1:]) if rest.startswith(":") else default_port
+        return host, port
+    host, sep, port_str = target.rpartition(":")
+    if not sep or not port_str.isdigit():
+        return target, default_port
+    return host, int(port_str)
+
+
+class _SockReader:
+    """Чтение из неблокирующего сокета с внутренним буфером (для рукопожатий)."""
+
+    def __init__(self, loop, sock):
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+
+    async def _fill(self):
+        data = await self.loop.sock_recv(self.sock, 16 * 1024)
+        if not data:
+            raise PeerClosed("соединение закрыто")
+        self.buffer += data
+
+    async def read_exact(self, n: int) -> bytes:
+        while len(self.buffer) < n:
+            await self._fill()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_until(self, marker: bytes, limit: int = MAX_HEADER_BYTES) -> bytes:
+        while True:
+            idx = self.buffer.find(marker)
+            if idx >= 0:
+                end = idx + len(marker)
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            if len(self.buffer) > limit:
+                raise ProxyError("слишком длинный заголовок")
+            await self._fill()
+
+    def take_buffer(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _tune_socket(sock: socket.socket):
+    sock.setblocking(False)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RELAY_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, RELAY_BUFFER)
+    except OSError:
+        pass
+
+
+async def open_tcp(loop, host: str, port: int, timeout: float = CONNECT_TIMEOUT) -> socket.socket:
+    """TCP-соединение с первым доступным адресом host:port."""
+    infos = await asyncio.wait_for(
+        loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout
+    )
+    last_error = None
+    for family, type_, proto, _, addr in infos:
+        sock = socket.socket(family, type_, proto)
+        _tune_socket(sock)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, addr), timeout)
+            return sock
+        except (OSError, asyncio.TimeoutError) as e:
+            sock.close()
+            last_error = e
+    raise ProxyError(f"не удалось подключиться к {host}:{port}: {last_error}")
+
+
+def _socks5_address(host: str, port: int) -> bytes:
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        encoded = host.encode("idna")
+        if len(encoded) > 255:
+            raise ProxyError("слишком длинное имя хоста")
+        return b"\x03" + bytes([len(encoded)]) + encoded + struct.pack("!H", port)
+    atyp = b"\x01" if ip.version == 4 else b"\x04"
+    return atyp + ip.packed + struct.pack("!H", port)
+
+
+async def socks5_greet(reader: _SockReader, user: str, password: str):
+    """Приветствие и (при наличии логина) авторизация RFC 1929. После неё можно слать CONNECT."""
+    loop, sock = reader.loop, reader.sock
+    methods = b"\x00\x02" if (user or password) else b"\x00"
+    await loop.sock_sendall(sock, b"\x05" + bytes([len(methods)]) + methods)
+    ver, method = await reader.read_exact(2)
+    if ver != 5:
+        raise ProxyError("удалённый сервер не SOCKS5")
+    if method == 0x02:
+        u, p = user.encode("utf-8"), password.encode("utf-8")
+        await loop.sock_sendall(sock, b"\x01" + bytes([len(u)]) + u + bytes([len(p)]) + p)
+        _, status = await reader.read_exact(2)
+        if status != 0:
+            raise ProxyError("SOCKS5: неверный логин или пароль")
+    elif method != 0x00:
+        raise ProxyError("SOCKS5: сервер не принял способ авторизации")
+
+
+async def socks5_connect(reader: _SockReader, host: str, port: int):
+    """Команда CONNECT на уже поприветствованном SOCKS5-соединении."""
+    await reader.loop.sock_sendall(reader.sock, b"\x05\x01\x00" + _socks5_address(host, port))
+    ver, rep, _, atyp = await reader.read_exact(4)
+    if ver != 5 or rep != 0:
+        raise ProxyError(f"SOCKS5: отказ в подключении к {host}:{port} (код {rep})")
+    if atyp == 1:
+        await reader.read_exact(4 + 2)
+    elif atyp == 4:
+        await reader.read_exact(16 + 2)
+    elif atyp == 3:
+        (length,) = await reader.read_exact(1)
+        await reader.read_exact(length + 2)
+    else:
+        raise ProxyError("SOCKS5: неверный ответ сервера")
+
+
+def _basic_auth(user: str, password: str) -> str:
+    token = base64.b64encode(f"{user}:{password}".encode("utf-8")).decode("ascii")
+    return f"Basic {token}"
+
+
+async def http_connect(reader: _SockReader, host: str, port: int, user: str, password: str):
+    """CONNECT через удалённый HTTP-прокси."""
+    authority = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+    lines = [f"CONNECT {authority} HTTP/1.1", f"Host: {authority}"]
+    if user or password:
+        lines.append(f"Proxy-Authorization: {_basic_auth(user, password)}")
+    request = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+    await reader.loop.sock_sendall(reader.sock, request)
+    head = await reader.read_until(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    fields = status_line.split(" ", 2)
+    if len(fields) < 2 or fields[1] != "200":
+        raise ProxyError(f"HTTP-прокси: {status_line}")
+
+
+async def _wait_fd(loop, fd: int, write: bool = False):
+    fut = loop.create_future()
+
+    def ready():
+        if not fut.done():
+            fut.set_result(None)
+
+    if write:
+        loop.add_writer(fd, ready)
+    else:
+        loop.add_reader(fd, ready)
+    try:
+        await fut
+    finally:
+        if write:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def _pipe_splice(loop, src: socket.socket, dst: socket.socket) -> int:
+    """Пересылка src -> dst без копирования в пространство пользователя."""
+    rfd, wfd = os.pipe()
+    total = 0
+    try:
+        try:
+            import fcntl
+
+            fcntl.fcntl(wfd, getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+        except OSError:
+            pass
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        while True:
+            try:
+                n = os.splice(src.fileno(), wfd, PIPE_SIZE, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop, src.fileno())
+                continue
+            if n == 0:
+                return total
+            total += n
+            while n:
+                try:
+                    n -= os.splice(rfd, dst.fileno(), n, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop, dst.fileno(), write=True)
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+async def _pipe_copy(loop, src: socket.socket, dst: socket.socket) -> int:
+    buf = bytearray(RELAY_BUFFER)
+    view = memoryview(buf)
+    total = 0
+    while True:
+        n = await loop.sock_recv_into(src, buf)
+        if n == 0:
+            return total
+        await loop.sock_sendall(dst, view[:n])
+        total += n
+
+
+async def pipe(loop, src: socket.socket, dst: socket.socket) -> int:
+    """Переслать src -> dst до EOF, затем закрыть запись в dst. Вернуть число байт."""
+    try:
+        if USE_SPLICE:
+            try:
+                return await _pipe_splice(loop, src, dst)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+        return await _pipe_copy(loop, src, dst)
+    finally:
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+async def relay(loop, a: socket.socket, b: socket.socket) -> tuple[int, int]:
+    """Двусторонняя пересылка a <-> b. Вернуть (байт a->b, байт b->a)."""
+    up = asyncio.ensure_future(pipe(loop, a, b))
+    down = asyncio.ensure_future(pipe(loop, b, a))
+    try:
+        _, pending = await asyncio.wait({up, down}, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.wait(pending, timeout=HALF_CLOSE_TIMEOUT)
+    finally:
+        for task in (up, down):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(up, down, return_exceptions=True)
+    sent = up.result() if not up.cancelled() and up.exception() is None else 0
+    received = down.result() if not down.cancelled() and down.exception() is None else 0
+    return sent, received
+
+
+def _rewrite_request(head: bytes, absolute: bool, proxy_auth: str | None) -> tuple[bytes, str, int]:
+    """Разобрать HTTP-запрос к прокси. Вернуть (новый заголовок, хост, порт)."""
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, version = lines[0].split(" ", 2)
+    parts = urllib.parse.urlsplit(target)
+    if parts.scheme != "http" or not parts.hostname:
+        raise ProxyError(f"неподдерживаемый адрес: {target}")
+    host, port = parts.hostname, parts.port or 80
+    if absolute:
+        request_line = f"{method} {target} {version}"
+    else:
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request_line = f"{method} {path} {version}"
+    headers = [
+        line
+        for line in lines[1:]
+        if line and line.split(":", 1)[0].strip().lower() not in HOP_BY_HOP_HEADERS
+    ]
+    if proxy_auth:
+        headers.append(f"Proxy-Authorization: {proxy_auth}")
+    headers.append("Connection: close")
+    return ("\r\n".join([request_line] + headers) + "\r\n\r\n").encode("latin-1"), host, port
+
+
+class LocalProxy:
+    """Локальный HTTP-прокси в потоке с asyncio: тот же интерфейс, что у ProxyProcess.
+    pool_size=0 отключает пул тёплых соединений с удалённым прокси."""
+
+    def __init__(
+        self,
+        local_port: int,
+        local_host: str = "127.0.0.1",
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_idle_per_host: int = DEFAULT_MAX_IDLE_PER_HOST,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ):
+        self.local_host = local_host
+        self.local_port = local_port
+        self.pool_size = pool_size
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.pool = None
+        self.log = LogBuffer()
+        self.timings = StartupTimings()
+        self.connections_total = 0
+        self.connections_active = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self._remote = None
+        self._loop = None
+        self._thread = None
+        self._listener = None
+        self._serve_task = None
+        self._tasks = set()
+
+    def start(self, remote_url: str) -> bool:
+        """remote_url: socks5://host:port или http://host:port, с опцией user:pass@."""
+        if self.is_running():
+            return True
+        started = time.perf_counter()
+        try:
+            self._remote = parse_remote_url(remote_url)
+        except (ProxyError, ValueError) as e:
+            self.log.append(f"Ошибка: {e}")
+            return False
+        try:
+            listener = socket.create_server((self.local_host, self.local_port), backlog=256)
+        except OSError as e:
+            self.log.append(f"Порт {self.local_port} недоступен: {e}")
+            return False
+        listener.setblocking(False)
+        self._listener = listener
+        loop_ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(loop_ready,), daemon=True)
+        self._thread.start()
+        loop_ready.wait()
+        self.timings.record(time.perf_counter() - started)
+        scheme, host, port, _, _ = self._remote
+        self.log.append(f"Слушаю {self.local_host}:{self.local_port} -> {scheme}://{host}:{port}")
+        return True
+
+    def stop(self) -> bool:
+        if not self.is_running():
+            return False
+        loop = self._loop
+        loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.log.append("Остановлен")
+        return True
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> dict:
+        result = {
+            "connections_total": self.connections_total,
+            "connections_active": self.connections_active,
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+        }
+        if self.pool is not None:
+            result["pool"] = self.pool.stats()
+        return result
+
+    def _run(self, loop_ready: threading.Event):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        asyncio.set_event_loop(loop)
+        self.pool = UpstreamPool(
+            self._dial_upstream,
+            pool_size=self.pool_size,
+            max_idle_per_host=self.max_idle_per_host,
+            idle_timeout=self.idle_timeout,
+        )
+        try:
+            self._serve_task = loop.create_task(self._serve())
+            loop.call_soon(loop_ready.set)
+            loop.run_until_complete(self._serve_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop_ready.set()
+            pending = [t for t in self._tasks if not t.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.pool.close()
+            loop.run_until_complete(asyncio.sleep(0))
+            self._listener.close()
+            loop.close()
+
+    def _shutdown(self):
+        if self._serve_task is not None:
+            self._serve_task.cancel()
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self.pool.warm(self._pool_key())
+        while True:
+            conn, _ = await loop.sock_accept(self._listener)
+            _tune_socket(conn)
+            task = loop.create_task(self._handle(conn))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _pool_key(self):
+        scheme, r_host, r_port, user, _ = self._remote
+        return scheme, r_host, r_port, user
+
+    async def _dial_upstream(self, key) -> socket.socket:
+        """Новое соединение с удалённым прокси; для SOCKS5 — уже после приветствия."""
+        loop = asyncio.get_running_loop()
+        scheme, r_host, r_port, user, password = self._remote
+        sock = await open_tcp(loop, r_host, r_port)
+        if scheme != "socks5":
+            return sock
+        try:
+            await asyncio.wait_for(
+                socks5_greet(_SockReader(loop, sock), user, password), CONNECT_TIMEOUT
+            )
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _open_tunnel(self, host: str, port: int) -> tuple[socket.socket, bytes]:
+        """Соединение с host:port через удалённый прокси. Вернуть (сокет, лишние байты).
+        Соединение из пула могло быть закрыто сервером — тогда одна повторная попытка."""
+        loop = asyncio.get_running_loop()
+        scheme, _, _, user, password = self._remote
+        for attempt in (1, 2):
+            sock = await self.pool.acquire(self._pool_key())
+            try:
+                reader = _SockReader(loop, sock)
+                if scheme == "socks5":
+                    await asyncio.wait_for(socks5_connect(reader, host, port), CONNECT_TIMEOUT)
+                else:
+                    await asyncio.wait_for(
+                        http_connect(reader, host, port, user, password), CONNECT_TIMEOUT
+                    )
+                return sock, reader.take_buffer()
+            except (OSError, PeerClosed):
+                sock.close()
+                if attempt == 2:
+                    raise
+            except BaseException:
+                sock.close()
+                raise
+
+    async def _send_via_http_upstream(self, request: bytes, retry: bool) -> tuple[socket.socket, bytes]:
+        """Отправить запрос удалённому HTTP-прокси. Вернуть (сокет, начало ответа).
+        Соединение из пула могло быть закрыто сервером: ошибка отправки или пустой ответ —
+        повтор на новом соединении (пустой ответ — только если retry: запрос без тела и идемпотентный)."""
+        loop = asyncio.get_running_loop()
+        for attempt in (1, 2):
+            if attempt == 1:
+                sock = await self.pool.acquire(self._pool_key())
+            else:
+                sock = await self._dial_upstream(self._pool_key())
+            try:
+                await loop.sock_sendall(sock, request)
+                if not retry:
+                    return sock, b""
+                response = await loop.sock_recv(sock, RELAY_BUFFER)
+                if response:
+                    return sock, response
+                error = PeerClosed("удалённый прокси закрыл соединение")
+            except OSError as e:
+                error = e
+            except BaseException:
+                sock.close()
+                raise
+            sock.close()
+            if attempt == 2:
+                raise error
+
+    async def _handle(self, client: socket.socket):
+        loop = asyncio.get_running_loop()
+        upstream = None
+        self.connections_total += 1
+        self.connections_active += 1
+        target = ""
+        try:
+            reader = _SockReader(loop, client)
+            head = await reader.read_until(b"\r\n\r\n")
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            fields = request_line.split(" ")
+            if len(fields) != 3:
+                raise ProxyError(f"неверный запрос: {request_line[:80]}")
+            method, target = fields[0].upper(), fields[1]
+            if method == "CONNECT":
+                host, port = split_host_port(target, 443)
+                upstream, extra = await self._open_tunnel(host, port)
+                await loop.sock_sendall(client, b"HTTP/1.1 200 Connection established\r\n\r\n")
+                if extra:
+                    await loop.sock_sendall(client, extra)
+                first = reader.take_buffer()
+            else:
+                scheme, r_host, r_port, user, password = self._remote
+                if scheme == "http":
+                    auth = _basic_auth(user, password) if (user or password) else None
+                    new_head, _, _ = _rewrite_request(head, absolute=True, proxy_auth=auth)
+                    request = new_head + reader.take_buffer()
+                    lowered = head.lower()
+                    complete = b"\r\ncontent-length:" not in lowered and b"\r\ntransfer-encoding:" not in lowered
+                    upstream, response = await self._send_via_http_upstream(
+                        request, retry=complete and method in IDEMPOTENT_METHODS
+                    )
+                    self.bytes_up += len(request)
+                    if response:
+                        await loop.sock_sendall(client, response)
+                        self.bytes_down += len(response)
+                    first = b""
+                else:
+                    new_head, host, port = _rewrite_request(head, absolute=False, proxy_auth=None)
+                    upstream, extra = await self._open_tunnel(host, port)
+                    if extra:
+                        await loop.sock_sendall(client, extra)
+                    first = new_head + reader.take_buffer()
+            if first:
+                await loop.sock_sendall(upstream, first)
+                self.bytes_up += len(first)
+            sent, received = await relay(loop, client, upstream)
+            self.bytes_up += sent
+            self.bytes_down += received
+        except (ProxyError, OSError, asyncio.TimeoutError, ValueError) as e:
+            self.log.append(f"{target or '?'}: {e or type(e).__name__}")
+            if upstream is None:
+                try:
+                    await loop.sock_sendall(client, b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+                except OSError:
+                    pass
+        finally:
+            self.connections_active -= 1
+            client.close()
+            if upstream is not None:
+                upstream.close()
@@ -2,27 +2,69 @@
 """
 Клиент для обхода блокировок — подключение по ссылке (ss://) или вручную (SOCKS5/HTTP).
 """
-import json
-import threading
 import tkinter as tk
+from functools import partial
 from pathlib import Path
 
 import customtkinter as ctk
-from config_builder import build_from_ss_link
+from config_builder import (
+    BALANCER_STRATEGIES,
+    DEFAULT_DNS,
+    DEFAULT_ROUTING,
+    DEFAULT_TRANSPORT,
+    DEFAULT_TUNING,
+    ROUTING_PROFILES,
+    TRANSPORT_PROFILES,
+    TUNING_PROFILES,
+    build_balanced_config,
+    build_from_server,
+    format_ss_link,
+    parse_ss_link,
+    read_rule_list,
+    unsupported_reason,
+)
 from proxy_manager import (
     LOCAL_PROXY_HOST,
     LOCAL_PROXY_PORT,
-    ProxyProcess,
     build_remote_url,
     clear_system_proxy,
+    get_pac_url,
     get_system_proxy_status,
+    set_pac_url,
     set_system_proxy,
 )
+from access_log import ACCESS_LOG_PATH, STATS_JSON_PATH, AccessLogTailer, AccessStats
 from app_dir import BASE_DIR
-from v2ray_runner import is_running as v2ray_is_running, start as v2ray_start, stop as v2ray_stop
+from local_proxy import LocalProxy
+from geosite import route_of
+from health_monitor import HealthMonitor, probe_through_proxy
+from pac_server import PacServer
+from prober import ProbeResult, probe_all
+from profile_store import ProfileStore
+from resolver import AddressPinner
+from speedtest import SpeedResult, speed_test
+from stats_poller import HIDDEN_INTERVAL, VISIBLE_INTERVAL, StatsPoller, format_sample
+from subscription import Subscription, load_cached_catalog
+from supervisor import SLOT_PORTS, Supervisor
+from task_runner import TaskRunner
+from v2ray_runner import (
+    V2RAY_EXE,
+    log as v2ray_log,
+    timings as v2ray_timings,
+)
 
-PROFILES_FILE = BASE_DIR / "profiles.json"
-LAST_LINK_FILE = BASE_DIR / "last_link.txt"
+# Свои домены и подсети мимо туннеля: по одному на строку (example.com, 10.0.0.0/8, geosite:...)
+DIRECT_RULES_FILE = BASE_DIR / "direct_domains.txt"
+# Сколько лучших по задержке серверов проверять тестом скорости
+SPEED_TEST_TOP = 5
+# Сколько лучших серверов ставить за балансировщик
+BALANCE_TOP = 5
+# Как часто дочитывать access-лог V2Ray, мс
+ACCESS_POLL_MS = 2000
+# Как часто окно забирает результаты фоновых задач, мс
+TASK_DRAIN_MS = 50
+# Как часто проверять срок выбранных IP серверов, мс
+PIN_REFRESH_MS = 60_000
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
@@ -31,31 +73,78 @@ class VPNClientApp(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Обход блокировок — Прокси-клиент")
-        self.geometry("480x600")
+        self.geometry("480x780")
         self.minsize(400, 500)
 
-        self.proxy_process = ProxyProcess(local_port=LOCAL_PROXY_PORT)
+        # Вся фоновая работа (подключение, проверки, тесты) — в одном цикле asyncio
+        self.tasks = TaskRunner()
+        self.proxy_process = LocalProxy(local_port=LOCAL_PROXY_PORT, local_host=LOCAL_PROXY_HOST)
+        # PAC-режим: через прокси только домены из pac_domains.txt
+        self.pac_server = PacServer(LOCAL_PROXY_HOST, LOCAL_PROXY_PORT)
+        # V2Ray по ссылке: смена сервера через запасной экземпляр, перезапуск при падении
+        self.supervisor = Supervisor(on_event=lambda text: self.tasks.post(self._on_v2ray_event, text))
+        # IP серверов, выбранные при подключении (в конфиг V2Ray вместо имени)
+        self.pinner = AddressPinner()
+        self._active_build = None  # как собран конфиг текущего подключения (для обновления IP)
         self.connected = False
-        self.connected_via_v2ray = False  # True = по ссылке (V2Ray), False = форма (pproxy)
-        self.profiles = self._load_profiles()
+        self.connected_via_v2ray = False  # True = по ссылке (V2Ray), False = форма (встроенный прокси)
+        self.active_link = None  # ссылка, по которой сейчас подключён V2Ray
+        # Ручные профили и серверы ss:// (profiles.db)
+        self.profiles = ProfileStore()
+        self._profile_choices = {}  # подпись в списке профилей -> профиль
+        self.catalog = load_cached_catalog()  # серверы из подписок (из кэша, без сети)
+        self.probe_results = self._load_probe_results()  # SsServer.key -> ProbeResult последней проверки
+        self.speed_results = self._load_speed_results()  # SsServer.key -> SpeedResult последнего теста скорости
+        self.stats_poller = None  # счётчики трафика V2Ray, пока подключены по ссылке
+        self.access_stats = AccessStats()  # топ доменов из access-лога за сеанс
+        self.access_tailer = None
+        # Проверка активного сервера и автопереключение на следующий лучший
+        self.health_monitor = None
+        self._failed_servers = set()  # SsServer.key серверов, с которых уже переключались
+        self._failover_from = None  # имя сервера, с которого идёт автопереключение
+        self._servers_dirty = False  # пришли результаты проверки — перерисовать окно «Серверы»
 
         self._build_ui()
+        self.after(TASK_DRAIN_MS, self._drain_tasks)
+        self.after(PIN_REFRESH_MS, self._refresh_pins)
 
-    def _load_profiles(self):
-        if PROFILES_FILE.exists():
-            try:
-                with open(PROFILES_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                pass
-        return []
+    def _drain_tasks(self):
+        """Забрать накопившиеся результаты фоновых задач одной пачкой."""
+        self.tasks.drain()
+        if self._servers_dirty:
+            self._servers_dirty = False
+            self._refresh_servers_window()
+        self.after(TASK_DRAIN_MS, self._drain_tasks)
 
-    def _save_profiles(self):
-        try:
-            with open(PROFILES_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.profiles, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
+    def _load_probe_results(self) -> dict:
+        """Сохранённые результаты проверки для серверов каталога."""
+        stored = self.profiles.probes()
+        return {
+            s.key: ProbeResult(s, *stored[s.key][:3])
+            for s in self.catalog.servers()
+            if s.key in stored
+        }
+
+    def _load_speed_results(self) -> dict:
+        stored = self.profiles.speed_results()
+        return {
+            s.key: SpeedResult(s, *stored[s.key])
+            for s in self.catalog.servers()
+            if s.key in stored
+        }
+
+    def _search_profiles(self, text: str = "") -> list[str]:
+        """Подписи профилей, подходящих под text; запоминает соответствие подпись -> профиль."""
+        found = self.profiles.search(text)
+        self._profile_choices = {p["label"]: p for p in found}
+        return [""] + list(self._profile_choices)
+
+    def _on_profile_typed(self, event=None):
+        """Подсказки по мере ввода имени или адреса в поле профиля."""
+        text = self.profile_var.get()
+        if text in self._profile_choices:
+            return
+        self.profile_combo.configure(values=self._search_profiles(text))
 
     def _build_ui(self):
         # Заголовок
@@ -91,10 +180,11 @@ class VPNClientApp(ctk.CTk):
         ).pack(side="right")
         self.link_entry.bind("<Control-v>", self._paste_into_link_entry)
         self.link_entry.bind("<Button-3>", self._show_link_paste_menu)
+        self.link_entry.bind("<KeyRelease>", lambda e: self._update_link_button())
         self.bind("<Control-V>", self._on_global_paste)
         self.bind("<Control-v>", self._on_global_paste)
         link_btn_frame = ctk.CTkFrame(link_frame, fg_color="transparent")
-        link_btn_frame.pack(fill="x", pady=(0, 16))
+        link_btn_frame.pack(fill="x", pady=(0, 6))
         self.link_connect_btn = ctk.CTkButton(
             link_btn_frame,
             text="Подключить по ссылке",
@@ -102,6 +192,88 @@ class VPNClientApp(ctk.CTk):
             command=self._toggle_link_connection,
         )
         self.link_connect_btn.pack(side="left", padx=(0, 8))
+        ctk.CTkButton(
+            link_btn_frame,
+            text="Журнал",
+            width=90,
+            fg_color="gray",
+            command=self._show_log_window,
+        ).pack(side="left")
+        servers_row = ctk.CTkFrame(link_frame, fg_color="transparent")
+        servers_row.pack(fill="x", pady=(0, 6))
+        ctk.CTkButton(
+            servers_row,
+            text="Подписка...",
+            width=120,
+            fg_color="gray",
+            command=self._import_subscription,
+        ).pack(side="left", padx=(0, 8))
+        ctk.CTkButton(
+            servers_row,
+            text="Серверы",
+            width=90,
+            fg_color="gray",
+            command=self._show_servers_window,
+        ).pack(side="left", padx=(0, 8))
+        ctk.CTkButton(
+            servers_row,
+            text="Проверить домен",
+            width=130,
+            fg_color="gray",
+            command=self._check_domain_route,
+        ).pack(side="left")
+        routing_row = ctk.CTkFrame(link_frame, fg_color="transparent")
+        routing_row.pack(fill="x", pady=(0, 6))
+        ctk.CTkLabel(routing_row, text="Маршрутизация").pack(side="left", padx=(0, 8))
+        self._routing_var = ctk.StringVar(value=ROUTING_PROFILES[DEFAULT_ROUTING]["title"])
+        ctk.CTkOptionMenu(
+            routing_row,
+            values=[p["title"] for p in ROUTING_PROFILES.values()],
+            variable=self._routing_var,
+            width=220,
+            command=self._on_routing_change,
+        ).pack(side="left", padx=(0, 8))
+        # FakeDNS: V2Ray отвечает на DNS-запросы системы (127.0.0.1:53) адресами из своего пула
+        self._fakedns_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            routing_row,
+            text="FakeDNS",
+            variable=self._fakedns_var,
+            command=lambda: self._on_routing_change(None),
+        ).pack(side="left")
+        # Транспорт до сервера: mux (сервер V2Ray/Xray) и UDP через SOCKS inbound
+        transport_row = ctk.CTkFrame(link_frame, fg_color="transparent")
+        transport_row.pack(fill="x", pady=(0, 6))
+        ctk.CTkLabel(transport_row, text="Транспорт").pack(side="left", padx=(0, 8))
+        self._transport_var = ctk.StringVar(value=TRANSPORT_PROFILES[DEFAULT_TRANSPORT]["title"])
+        ctk.CTkOptionMenu(
+            transport_row,
+            values=[p["title"] for p in TRANSPORT_PROFILES.values()],
+            variable=self._transport_var,
+            width=220,
+            command=self._on_routing_change,
+        ).pack(side="left")
+        # Профиль сокетов (Fast Open, keepalive, буферы) — записывается и в результаты теста скорости
+        tuning_row = ctk.CTkFrame(link_frame, fg_color="transparent")
+        tuning_row.pack(fill="x", pady=(0, 6))
+        ctk.CTkLabel(tuning_row, text="Сокеты").pack(side="left", padx=(0, 8))
+        self._tuning_var = ctk.StringVar(value=TUNING_PROFILES[DEFAULT_TUNING]["title"])
+        ctk.CTkOptionMenu(
+            tuning_row,
+            values=[p["title"] for p in TUNING_PROFILES.values()],
+            variable=self._tuning_var,
+            width=220,
+            command=self._on_routing_change,
+        ).pack(side="left")
+        self._pac_var = ctk.BooleanVar(value=False)
+        # Access-лог V2Ray (переключатель в окне «Журнал»)
+        self._access_log_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            link_frame,
+            text="Через прокси только сайты из списка (PAC)",
+            variable=self._pac_var,
+            command=self._on_pac_toggle,
+        ).pack(anchor="w", pady=(0, 16))
 
         subtitle = ctk.CTkLabel(
             self,
@@ -153,11 +325,12 @@ class VPNClientApp(ctk.CTk):
         self.profile_var = ctk.StringVar(value="")
         self.profile_combo = ctk.CTkComboBox(
             prof_frame,
-            values=[""] + [p.get("name", "Без имени") for p in self.profiles],
+            values=self._search_profiles(),
             variable=self.profile_var,
             command=self._on_profile_select,
         )
         self.profile_combo.pack(fill="x", pady=(4, 4))
+        self.profile_combo.bind("<KeyRelease>", self._on_profile_typed)
         btn_row = ctk.CTkFrame(prof_frame, fg_color="transparent")
         btn_row.pack(fill="x", pady=(0, 16))
         ctk.CTkButton(btn_row, text="Сохранить профиль", width=140, command=self._save_profile).pack(side="left", padx=(0, 8))
@@ -182,7 +355,12 @@ class VPNClientApp(ctk.CTk):
             font=ctk.CTkFont(size=13),
             text_color="gray",
         )
-        self.status_label.pack(pady=12)
+        self.status_label.pack(pady=(12, 0))
+        self.traffic_label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=12), text_color="gray")
+        self.traffic_label.pack(pady=(0, 12))
+        # Свёрнутое окно — опрашивать статистику реже
+        self.bind("<Map>", self._on_visibility_change)
+        self.bind("<Unmap>", self._on_visibility_change)
 
         self._load_last_link()
         self._update_status_from_system()
@@ -205,6 +383,7 @@ class VPNClientApp(ctk.CTk):
                 self.link_entry.insert(0, text.strip())
         except Exception:
             pass
+        self._update_link_button()
         return "break"
 
     def _on_global_paste(self, event=None):
@@ -220,38 +399,326 @@ class VPNClientApp(ctk.CTk):
         finally:
             menu.grab_release()
 
+    def _active_log(self):
+        """Лог текущего подключения: V2Ray (по ссылке) или встроенный прокси (форма)."""
+        if self.connected and not self.connected_via_v2ray:
+            return self.proxy_process.log
+        return v2ray_log
+
+    def _show_log_window(self):
+        if getattr(self, "_log_window", None) is not None and self._log_window.winfo_exists():
+            self._log_window.focus_force()
+            return
+        window = ctk.CTkToplevel(self)
+        window.title("Журнал")
+        window.geometry("640x360")
+        self._log_rate_label = ctk.CTkLabel(window, text="", text_color="gray")
+        self._log_rate_label.pack(anchor="w", padx=12, pady=(8, 0))
+        view_row = ctk.CTkFrame(window, fg_color="transparent")
+        view_row.pack(fill="x", padx=12, pady=(4, 0))
+        self._log_view = ctk.StringVar(value="Вывод V2Ray")
+        ctk.CTkSegmentedButton(
+            view_row, values=["Вывод V2Ray", "Домены", "Ошибки"], variable=self._log_view
+        ).pack(side="left", padx=(0, 8))
+        ctk.CTkCheckBox(
+            view_row,
+            text="Access-лог",
+            variable=self._access_log_var,
+            command=lambda: self._on_routing_change(None),
+        ).pack(side="left", padx=(0, 8))
+        ctk.CTkButton(
+            view_row, text="Сохранить JSON", width=130, fg_color="gray", command=self._dump_access_stats
+        ).pack(side="left")
+        self._log_text = ctk.CTkTextbox(window, wrap="none")
+        self._log_text.pack(fill="both", expand=True, padx=12, pady=8)
+        self._log_window = window
+        self._refresh_log_window()
+
+    def _refresh_log_window(self):
+        if self._log_window is None or not self._log_window.winfo_exists():
+            self._log_window = None
+            return
+        log = self.tasks.log if self._log_view.get() == "Ошибки" else self._active_log()
+        text = f"Строк всего: {log.total_lines}, в секунду: {log.line_rate():.1f}"
+        if log is self.proxy_process.log and self.proxy_process.pool is not None:
+            pool = self.proxy_process.pool.stats()
+            text += (
+                f"  |  пул: попаданий {pool['hits']}, промахов {pool['misses']},"
+                f" сэкономлено ~{pool['saved_ms']:.0f} мс"
+            )
+        self._log_rate_label.configure(text=text)
+        self._log_text.delete("1.0", tk.END)
+        if self._log_view.get() == "Домены":
+            summary = self.access_stats.summary()
+            if self.access_tailer is None:
+                summary = "Access-лог выключен (галочка выше, применяется к подключению по ссылке)\n\n" + summary
+            self._log_text.insert(tk.END, summary)
+        else:
+            self._log_text.insert(tk.END, "\n".join(log.tail(200)))
+            self._log_text.see(tk.END)
+        self.after(1000, self._refresh_log_window)
+
+    def _dump_access_stats(self):
+        if self.access_stats.dump(STATS_JSON_PATH):
+            self.status_label.configure(text=f"Статистика доменов сохранена: {STATS_JSON_PATH.name}")
+        else:
+            self.status_label.configure(text="Не удалось сохранить статистику доменов")
+
+    def _start_access_log(self):
+        """Разбирать access-лог, если он включён в конфиге запущенного V2Ray."""
+        active = self.supervisor.active
+        config = (active.config if active is not None else None) or {}
+        path = config.get("log", {}).get("access")
+        if not path:
+            self._stop_access_log()
+            return
+        if self.access_tailer is not None and str(self.access_tailer.path) == path:
+            return
+        self.access_tailer = AccessLogTailer(Path(path), self.access_stats)
+        self.access_tailer.skip_existing()
+        self.after(ACCESS_POLL_MS, self._poll_access_log)
+
+    def _stop_access_log(self):
+        if self.access_tailer is not None:
+            self.access_tailer.poll()
+            self.access_tailer = None
+
+    def _poll_access_log(self):
+        if self.access_tailer is None:
+            return
+        self.access_tailer.poll()
+        self.after(ACCESS_POLL_MS, self._poll_access_log)
+
+    def _import_subscription(self):
+        url = ctk.CTkInputDialog(text="Адрес подписки (http/https):", title="Подписка").get_input()
+        if not url or not url.strip():
+            return
+        self.status_label.configure(text="Загрузка подписки...")
+
+        def do_load():
+            subscription = Subscription(url)
+            try:
+                subscription.load(max_age=0)
+                error = None
+            except Exception as e:
+                error = str(e)
+            return subscription, error
+
+        self.tasks.submit(
+            do_load, key="subscription", on_done=lambda result: self._on_subscription_loaded(*result)
+        )
+
+    def _on_subscription_loaded(self, subscription, error):
+        if error is not None:
+            self.status_label.configure(text=f"Ошибка загрузки подписки: {error}")
+            return
+        self.catalog = load_cached_catalog()
+        self.profiles.add_servers(subscription.catalog)
+        text = f"Подписка: {len(subscription.catalog)} серверов"
+        if subscription.source == "not-modified":
+            text += " (без изменений)"
+        self.status_label.configure(text=text)
+        self._refresh_servers_window()
+
+    def _show_servers_window(self):
+        if getattr(self, "_servers_window", None) is not None and self._servers_window.winfo_exists():
+            self._servers_window.focus_force()
+            return
+        window = ctk.CTkToplevel(self)
+        window.title("Серверы")
+        window.geometry("520x420")
+        ctk.CTkLabel(
+            window, text="Двойной щелчок — вставить ссылку сервера", text_color="gray"
+        ).pack(anchor="w", padx=12, pady=(8, 0))
+        btn_row = ctk.CTkFrame(window, fg_color="transparent")
+        btn_row.pack(fill="x", padx=12, pady=(4, 0))
+        self._probe_btn = ctk.CTkButton(
+            btn_row, text="Проверить задержку", width=160, command=self._probe_servers
+        )
+        self._probe_btn.pack(side="left", padx=(0, 8))
+        ctk.CTkButton(
+            btn_row, text="Подключить к лучшему", width=170, command=self._connect_fastest
+        ).pack(side="left", padx=(0, 8))
+        self._speed_btn = ctk.CTkButton(
+            btn_row, text="Тест скорости", width=120, fg_color="gray", command=self._speed_test_servers
+        )
+        self._speed_btn.pack(side="left")
+        balance_row = ctk.CTkFrame(window, fg_color="transparent")
+        balance_row.pack(fill="x", padx=12, pady=(4, 0))
+        ctk.CTkButton(
+            balance_row,
+            text=f"Балансировка (лучшие {BALANCE_TOP})",
+            width=200,
+            command=self._connect_balanced,
+        ).pack(side="left", padx=(0, 8))
+        self._balance_strategy = ctk.StringVar(value="leastPing")
+        ctk.CTkOptionMenu(
+            balance_row, values=list(BALANCER_STRATEGIES), variable=self._balance_strategy, width=130
+        ).pack(side="left")
+        # Обычный Listbox: тысячи строк без тормозов, в отличие от виджетов на каждую строку
+        self._servers_list = tk.Listbox(window, activestyle="none")
+        self._servers_list.pack(fill="both", expand=True, padx=12, pady=8)
+        self._servers_list.bind("<Double-Button-1>", self._on_server_pick)
+        self._servers_window = window
+        self._refresh_servers_window()
+
+    def _server_rows(self):
+        """Серверы в порядке отображения в окне «Серверы»: после проверки — от быстрых к медленным."""
+        servers = self.catalog.servers()
+        if self.probe_results:
+            inf = float("inf")
+            servers.sort(key=lambda s: self.probe_results[s.key].score if s.key in self.probe_results else inf)
+        return servers
+
+    @staticmethod
+    def _format_probe(result) -> str:
+        if result is None:
+            return ""
+        if not result.ok:
+            return "  [недоступен]"
+        ms = (result.handshake if result.handshake is not None else result.rtt) * 1000
+        return f"  [{ms:.0f} мс]"
+
+    @staticmethod
+    def _format_speed(result) -> str:
+        if result is None or result.mbps is None:
+            return ""
+        text = f"  {result.mbps:.1f} Мбит/с, TTFB {result.ttfb * 1000:.0f} мс, джиттер {result.jitter * 1000:.0f} мс"
+        if result.tuning != DEFAULT_TUNING and result.tuning in TUNING_PROFILES:
+            text += f" ({TUNING_PROFILES[result.tuning]['title']})"
+        return text
+
+    def _probe_servers(self):
+        """Проверить задержку всех серверов; повторное нажатие — остановить проверку."""
+        if self.tasks.pending("probe"):
+            self.tasks.cancel("probe")
+            self._probe_btn.configure(text="Проверить задержку")
+            self.status_label.configure(text="Проверка остановлена")
+            return
+        servers = self.catalog.servers()
+        if not servers:
+            self.status_label.configure(text="Нет серверов — загрузите подписку")
+            return
+        self._probe_btn.configure(text="Остановить")
+        self.tasks.submit(
+            partial(
+                probe_all,
+                servers,
+                handshake=True,
+                on_result=lambda result: self.tasks.post(self._on_probe_result, result),
+            ),
+            key="probe",
+            on_done=self._on_probe_done,
+        )
+
+    def _on_probe_result(self, result):
+        """Результат одного сервера — окно перерисуется один раз на пачку (_drain_tasks)."""
+        self.probe_results[result.server.key] = result
+        self._servers_dirty = True
+
+    def _on_probe_done(self, results):
+        self.probe_results = {r.server.key: r for r in results}
+        self.profiles.save_probes(results)
+        alive = sum(1 for r in results if r.ok)
+        self.status_label.configure(text=f"Проверено серверов: {len(results)}, доступно: {alive}")
+        if getattr(self, "_servers_window", None) is not None and self._servers_window.winfo_exists():
+            self._probe_btn.configure(text="Проверить задержку")
+        self._refresh_servers_window()
+
+    def _speed_test_servers(self):
+        """Тест скорости для SPEED_TEST_TOP лучших по задержке серверов (параллельно)."""
+        servers = self._server_rows()[:SPEED_TEST_TOP]
+        if not servers:
+            self.status_label.configure(text="Нет серверов — загрузите подписку")
+            return
+        self._speed_btn.configure(state="disabled", text="Замер...")
+        self.status_label.configure(text=f"Тест скорости: {len(servers)} серверов...")
+
+        self.tasks.submit(
+            partial(speed_test, servers, tuning=self._config_options()["tuning"]),
+            key="speed",
+            on_done=self._on_speed_test_done,
+        )
+
+    def _on_speed_test_done(self, results):
+        self.speed_results.update({r.server.key: r for r in results})
+        self.profiles.save_speed(results)
+        best = next((r for r in results if r.mbps is not None), None)
+        if best is None:
+            self.status_label.configure(text="Тест скорости: ни один сервер не ответил")
+        else:
+            self.status_label.configure(
+                text=f"Быстрее всех: {best.server.name or best.server.host} — {best.mbps:.1f} Мбит/с"
+            )
+        if getattr(self, "_servers_window", None) is not None and self._servers_window.winfo_exists():
+            self._speed_btn.configure(state="normal", text="Тест скорости")
+        self._refresh_servers_window()
+
+    def _connect_fastest(self):
+        """Вставить ссылку самого быстрого сервера и подключиться (или переключиться) на него."""
+        best = next((r for r in sorted(self.probe_results.values(), key=lambda r: r.score) if r.ok), None)
+        if best is None:
+            self.status_label.configure(text="Сначала проверьте задержку серверов")
+            return
+        self.link_entry.delete(0, tk.END)
+        self.link_entry.insert(0, format_ss_link(best.server))
+        if self.connected and not self.connected_via_v2ray:
+            self.status_label.configure(text="Сначала отключите ручное подключение")
+            return
+        if self.connected and not self._link_switch_pending():
+            return
+        self._toggle_link_connection()
+
+    def _refresh_servers_window(self):
+        if getattr(self, "_servers_window", None) is None or not self._servers_window.winfo_exists():
+            return
+        self._servers_list.delete(0, tk.END)
+        for server in self._server_rows():
+            self._servers_list.insert(
+                tk.END,
+                f"{server.name or server.host} — {server.host}:{server.port}"
+                + self._format_probe(self.probe_results.get(server.key))
+                + self._format_speed(self.speed_results.get(server.key))
+                + ("  [V2Ray не поддерживает метод]" if unsupported_reason(server) else ""),
+            )
+
+    def _on_server_pick(self, event=None):
+        selection = self._servers_list.curselection()
+        if not selection:
+            return
+        server = self._server_rows()[selection[0]]
+        self.link_entry.delete(0, tk.END)
+        self.link_entry.insert(0, format_ss_link(server))
+        self._update_link_button()
+
     def _load_last_link(self):
-        try:
-            if LAST_LINK_FILE.exists():
-                text = LAST_LINK_FILE.read_text(encoding="utf-8").strip()
-                if text and text.startswith("ss://"):
-                    self.link_entry.delete(0, tk.END)
-                    self.link_entry.insert(0, text)
-        except Exception:
-            pass
+        link = self.profiles.last_link()
+        if link:
+            self.link_entry.delete(0, tk.END)
+            self.link_entry.insert(0, link)
 
     def _save_last_link(self, link: str):
-        try:
-            if link and link.strip().startswith("ss://"):
-                LAST_LINK_FILE.write_text(link.strip(), encoding="utf-8")
-        except Exception:
-            pass
+        self.profiles.touch_link(link)
 
     def _on_profile_select(self, choice):
-        if not choice:
-            return
-        for p in self.profiles:
-            if p.get("name") == choice:
-                self.protocol_var.set(p.get("protocol", "socks5"))
-                self.host_entry.delete(0, tk.END)
-                self.host_entry.insert(0, p.get("host", ""))
-                self.port_entry.delete(0, tk.END)
-                self.port_entry.insert(0, str(p.get("port", "")))
-                self.user_entry.delete(0, tk.END)
-                self.user_entry.insert(0, p.get("user", ""))
-                self.password_entry.delete(0, tk.END)
-                self.password_entry.insert(0, p.get("password", ""))
-                break
+        p = self._profile_choices.get(choice)
+        if p is None:
+            return
+        if p["protocol"] == "ss":
+            # Сервер ss:// — в поле ссылки
+            self.link_entry.delete(0, tk.END)
+            self.link_entry.insert(0, p["link"])
+            self._update_link_button()
+            return
+        self.protocol_var.set(p.get("protocol", "socks5"))
+        self.host_entry.delete(0, tk.END)
+        self.host_entry.insert(0, p.get("host", ""))
+        self.port_entry.delete(0, tk.END)
+        self.port_entry.insert(0, str(p.get("port", "")))
+        self.user_entry.delete(0, tk.END)
+        self.user_entry.insert(0, p.get("user", ""))
+        self.password_entry.delete(0, tk.END)
+        self.password_entry.insert(0, p.get("password", ""))
 
     def _save_profile(self):
         name = ctk.CTkInputDialog(text="Название профиля:", title="Сохранить профиль").get_input()
@@ -275,20 +742,19 @@ class VPNClientApp(ctk.CTk):
             "user": self.user_entry.get().strip(),
             "password": self.password_entry.get().strip(),
         }
-        self.profiles = [p for p in self.profiles if p.get("name") != name]
-        self.profiles.append(profile)
-        self._save_profiles()
-        self.profile_combo.configure(values=[""] + [p.get("name", "") for p in self.profiles])
-        self.profile_var.set(name)
-        self.status_label.configure(text=f"Профиль «{name}» сохранён")
+        if not self.profiles.save_manual(profile):
+            self.status_label.configure(text="Не удалось сохранить профиль")
+            return
+        self.profile_combo.configure(values=self._search_profiles())
+        self.profile_var.set(name.strip())
+        self.status_label.configure(text=f"Профиль «{name.strip()}» сохранён")
 
     def _delete_profile(self):
-        name = self.profile_var.get()
-        if not name:
+        profile = self._profile_choices.get(self.profile_var.get())
+        if profile is None:
             return
-        self.profiles = [p for p in self.profiles if p.get("name") != name]
-        self._save_profiles()
-        self.profile_combo.configure(values=[""] + [p.get("name", "") for p in self.profiles])
+        self.profiles.delete(profile["key"])
+        self.profile_combo.configure(values=self._search_profiles())
         self.profile_var.set("")
         self.status_label.configure(text="Профиль удалён")
 
@@ -298,45 +764,312 @@ class VPNClientApp(ctk.CTk):
         if not link:
             self.status_label.configure(text="Вставьте ссылку ss://")
             return
-        config_json = build_from_ss_link(link)
-        if not config_json:
+        server = parse_ss_link(link)
+        if server is None:
             self.status_label.configure(text="Неверный формат ссылки. Нужна ss://...")
             return
+        reason = unsupported_reason(server)
+        if reason:
+            self.status_label.configure(text=reason)
+            return
+        options = self._config_options()
         self._save_last_link(link)
-        self.link_connect_btn.configure(state="disabled", text="Запуск...")
+        # Имя сервера разрешается в фоне при сборке конфига, в конфиг идёт самый быстрый IP
+        self._start_v2ray(lambda **ports: build_from_server(self.pinner.pinned(server), **options, **ports), link)
+
+    def _config_options(self) -> dict:
+        """Параметры конфига V2Ray из настроек окна: профиль маршрутизации, свой список direct, DNS,
+        транспорт и профиль сокетов."""
+        title = self._routing_var.get()
+        routing = next(
+            (key for key, p in ROUTING_PROFILES.items() if p["title"] == title), DEFAULT_ROUTING
+        )
+        title = self._transport_var.get()
+        transport = next(
+            (key for key, p in TRANSPORT_PROFILES.items() if p["title"] == title), DEFAULT_TRANSPORT
+        )
+        title = self._tuning_var.get()
+        tuning = next((key for key, p in TUNING_PROFILES.items() if p["title"] == title), DEFAULT_TUNING)
+        return {
+            "routing": routing,
+            "transport": transport,
+            "tuning": tuning,
+            "direct": read_rule_list(DIRECT_RULES_FILE),
+            "dns": "fakedns" if self._fakedns_var.get() else DEFAULT_DNS,
+            "access_log": str(ACCESS_LOG_PATH) if self._access_log_var.get() else None,
+        }
+
+    def _check_domain_route(self):
+        """Куда пойдёт домен при текущем профиле маршрутизации (без запуска V2Ray)."""
+        host = ctk.CTkInputDialog(title="Проверить домен", text="Домен, например youtube.com").get_input()
+        host = (host or "").strip()
+        if not host:
+            return
+        options = self._config_options()
+        route = route_of(host, options["routing"], options["direct"])
+        text = "напрямую" if route == "direct" else "через туннель"
+        if self._pac_var.get() and route != "direct":
+            text += " (в PAC-режиме — если домен есть в списке PAC)"
+        self.status_label.configure(text=f"{host}: {text}")
+
+    def _on_routing_change(self, choice):
+        """Сменили профиль, DNS, транспорт или сокеты при подключении по ссылке — сразу применить к текущему серверу."""
+        if self.connected and self.connected_via_v2ray and self.active_link:
+            self.link_entry.delete(0, "end")
+            self.link_entry.insert(0, self.active_link)
+            self._connect_by_link()
+
+    def _start_v2ray(self, build, link: str):
+        """Запустить (или переключить) V2Ray в фоне. build(**порты) -> JSON-конфиг.
+        Новый экземпляр поднимается рядом со старым, системный прокси переводится после готовности.
+        Пока идёт запуск, кнопка отменяет его."""
+        self.link_connect_btn.configure(state="normal", text="Отмена")
         self.status_label.configure(text="Запуск V2Ray...")
+        pac = self._pac_var.get()
+        self.tasks.submit(
+            self.supervisor.apply,
+            build,
+            lambda port: self._point_system_proxy(port, pac),
+            key="v2ray",
+            on_done=lambda ok: self._on_link_connect_done(ok, link, build),
+            on_cancelled=self._on_link_connect_cancelled,
+        )
 
-        def do_start():
-            ok = v2ray_start(config_json)
-            self.after(0, lambda: self._on_link_connect_done(ok))
+    def _cancel_link_connect(self):
+        self.tasks.cancel("v2ray")
+        self._failover_from = None
+        self.status_label.configure(text="Запуск отменён")
+        if self.connected and self.connected_via_v2ray:
+            self.link_connect_btn.configure(text="Отключить")
+            self._update_link_button()
+        else:
+            self.link_connect_btn.configure(text="Подключить по ссылке")
 
-        threading.Thread(target=do_start, daemon=True).start()
+    def _on_link_connect_cancelled(self):
+        """Отменённый запуск всё же доработал: если подключения не было — убрать то, что он поднял."""
+        if self.connected and self.connected_via_v2ray or self.tasks.pending("v2ray"):
+            return
+        self._clear_system_proxy()
+        self.tasks.submit(self.supervisor.stop, key="v2ray")
 
-    def _on_link_connect_done(self, ok: bool):
+    def _connect_balanced(self):
+        """Весь ПК через несколько лучших серверов за балансировщиком V2Ray."""
+        if self.connected and not self.connected_via_v2ray:
+            self.status_label.configure(text="Сначала отключите ручное подключение")
+            return
+        servers = [
+            s for s in self._server_rows()
+            if (s.key not in self.probe_results or self.probe_results[s.key].ok) and not unsupported_reason(s)
+        ][:BALANCE_TOP]
+        if len(servers) < 2:
+            self.status_label.configure(text="Для балансировки нужно хотя бы два сервера")
+            return
+        strategy, options = self._balance_strategy.get(), self._config_options()
+        self._start_v2ray(
+            lambda **ports: build_balanced_config(
+                [self.pinner.pinned(s) for s in servers], strategy, **options, **ports
+            ),
+            link="",
+        )
+
+    def _on_link_connect_done(self, ok: bool, link: str = "", build=None):
         if not ok:
+            self._failover_from = None
+            server = parse_ss_link(link)
+            if server is not None:
+                # Выбранный IP мог перестать отвечать — в следующий раз разрешить имя заново
+                self.pinner.forget(server.host, server.port)
+            if self.connected and self.connected_via_v2ray and self.supervisor.is_running():
+                # Новый экземпляр не поднялся — трафик идёт через прежний
+                self.link_connect_btn.configure(state="normal")
+                self._update_link_button()
+                self.status_label.configure(text="Не удалось переключить сервер — работает прежний")
+                return
             self.link_connect_btn.configure(state="normal", text="Подключить по ссылке")
-            self.status_label.configure(
-                text="Ошибка запуска V2Ray. Проверьте папку v2ray и v2ray.exe"
-            )
+            if self.supervisor.last_error == "proxy":
+                self.status_label.configure(text="Ошибка настройки системного прокси")
+            else:
+                self.status_label.configure(
+                    text="V2Ray не запустился или не открыл порты. Проверьте папку v2ray и «Журнал»"
+                )
             return
-        set_ok = set_system_proxy(LOCAL_PROXY_HOST, LOCAL_PROXY_PORT)
-        if set_ok:
-            self.connected = True
-            self.connected_via_v2ray = True
-            self.link_connect_btn.configure(
-                state="normal", text="Отключить", fg_color="#c0392b"
-            )
-            self.connect_btn.configure(state="disabled")
-            self.status_label.configure(text="Подключено по ссылке — трафик через V2Ray")
+        self.connected = True
+        self.connected_via_v2ray = True
+        self.active_link = link
+        self._active_build = build
+        self.link_connect_btn.configure(
+            state="normal", text="Отключить", fg_color="#c0392b"
+        )
+        self.connect_btn.configure(state="disabled")
+        text = "Подключено по ссылке — трафик через V2Ray"
+        if not link:
+            text = "Подключено — балансировка между серверами V2Ray"
+        elif self._failover_from is not None:
+            text = f"Автопереключение: {self._failover_from} не отвечал, теперь {self._server_title(link)}"
+        elif self.supervisor.last_apply == "hot":
+            text = "Сервер переключён без перезапуска V2Ray"
+        elif self.supervisor.last_apply == "switch":
+            text = "Сервер переключён без разрыва (запасной экземпляр V2Ray)"
+        self._failover_from = None
+        self.status_label.configure(text=text + self._ready_suffix(v2ray_timings))
+        self._start_stats()
+        self._start_access_log()
+        if link:
+            self._start_health()
         else:
-            v2ray_stop()
-            self.link_connect_btn.configure(state="normal", text="Подключить по ссылке")
+            # За балансировщиком V2Ray сам уводит трафик с плохих серверов
+            self._stop_health()
+
+    def _refresh_pins(self):
+        """Истёк срок выбранных IP — выбрать заново в фоне; сменился IP — применить
+        (меняется только outbound, V2Ray не перезапускается)."""
+        self.after(PIN_REFRESH_MS, self._refresh_pins)
+        if not (self.connected and self.connected_via_v2ray) or self.tasks.pending("v2ray"):
+            return
+        self.tasks.submit(self.pinner.refresh_expired, key="pins", on_done=self._on_pins_refreshed)
+
+    def _on_pins_refreshed(self, changed: bool):
+        if changed and self.connected and self.connected_via_v2ray and self._active_build is not None:
+            self._start_v2ray(self._active_build, self.active_link or "")
+
+    def _on_v2ray_event(self, text: str):
+        """Сообщение супервизора (падение и перезапуск V2Ray)."""
+        if self.connected and self.connected_via_v2ray:
+            self.status_label.configure(text=text)
+
+    def _point_system_proxy(self, port: int, pac: bool) -> bool:
+        """Системный прокси на 127.0.0.1:port; pac — только домены из списка (через PAC-скрипт).
+        Можно вызывать из фонового потока."""
+        if not pac:
+            return set_system_proxy(LOCAL_PROXY_HOST, port)
+        self.pac_server.set_proxy(LOCAL_PROXY_HOST, port)
+        return self.pac_server.start() and set_pac_url(self.pac_server.url)
+
+    def _set_system_proxy(self) -> bool:
+        """Весь трафик через локальный прокси или, в PAC-режиме, только домены из списка."""
+        port = self.supervisor.http_port if self.connected_via_v2ray else LOCAL_PROXY_PORT
+        return self._point_system_proxy(port, self._pac_var.get())
+
+    def _clear_system_proxy(self):
+        clear_system_proxy(self.pac_server.url)
+        self.pac_server.stop()
+
+    def _on_pac_toggle(self):
+        """Переключить режим системного прокси на ходу."""
+        if not self.connected:
+            return
+        self._clear_system_proxy()
+        if not self._set_system_proxy():
             self.status_label.configure(text="Ошибка настройки системного прокси")
+            return
+        if self._pac_var.get():
+            self.status_label.configure(
+                text=f"PAC: через прокси только {self.pac_server.domain_count} доменов из списка"
+            )
+        else:
+            self.status_label.configure(text="Весь трафик через прокси")
+
+    @staticmethod
+    def _ready_suffix(timings) -> str:
+        """« (готов за 0.42 с)» — время до открытия портов последнего запуска."""
+        if timings.last is None:
+            return ""
+        return f" (готов за {timings.last:.2f} с)"
+
+    def _stats_interval(self) -> float:
+        return HIDDEN_INTERVAL if self.state() in ("iconic", "withdrawn") else VISIBLE_INTERVAL
+
+    def _start_stats(self):
+        """Опрос счётчиков трафика V2Ray (если в конфиге есть API)."""
+        if self.stats_poller is not None:
+            # После переключения на запасной экземпляр у API другой порт
+            self._stop_stats()
+        active = self.supervisor.active
+        server = active.api_server if active is not None else None
+        if server is None:
+            return
+        self.stats_poller = StatsPoller(
+            V2RAY_EXE,
+            server,
+            lambda sample: self.tasks.post(self._show_traffic, sample),
+            interval=self._stats_interval(),
+        )
+        self.tasks.submit(self.stats_poller.run, key="stats")
+
+    def _stop_stats(self):
+        if self.stats_poller is not None:
+            self.tasks.cancel("stats")
+            self.stats_poller = None
+        self.traffic_label.configure(text="")
+
+    def _show_traffic(self, sample):
+        if self.stats_poller is not None:
+            self.traffic_label.configure(text=format_sample(sample))
+
+    def _on_visibility_change(self, event):
+        if event.widget is self and self.stats_poller is not None:
+            self.stats_poller.interval = self._stats_interval()
+
+    def _start_health(self):
+        """Следить за активным сервером; после переключения — оценка заново."""
+        if self.health_monitor is not None:
+            self.health_monitor.reset()
+            return
+        monitor = HealthMonitor(
+            lambda health: self.tasks.post(self._on_degraded, monitor, health),
+            probe=lambda: probe_through_proxy(self.supervisor.http_port),
+        )
+        self.health_monitor = monitor
+        self.tasks.submit(monitor.run, key="health")
+
+    def _stop_health(self):
+        if self.health_monitor is not None:
+            self.tasks.cancel("health")
+            self.health_monitor = None
+
+    @staticmethod
+    def _server_title(link: str) -> str:
+        server = parse_ss_link(link)
+        if server is None:
+            return "?"
+        return server.name or f"{server.host}:{server.port}"
+
+    def _on_degraded(self, monitor, health):
+        """Активный сервер деградировал — переключиться на следующий лучший из каталога."""
+        if monitor is not self.health_monitor or not (self.connected and self.connected_via_v2ray):
+            return
+        current = parse_ss_link(self.active_link or "")
+        if current is not None:
+            self._failed_servers.add(current.key)
+        candidates = [
+            s for s in self._server_rows()
+            if s.key not in self._failed_servers
+            and (s.key not in self.probe_results or self.probe_results[s.key].ok)
+            and not unsupported_reason(s)
+        ]
+        problem = f"ошибок {health.failure_rate:.0%}"
+        if health.latency is not None:
+            problem += f", задержка {health.latency:.1f} с"
+        if not candidates:
+            self.status_label.configure(text=f"Сервер отвечает плохо ({problem}), замены в каталоге нет")
+            monitor.reset()
+            return
+        self._failover_from = self._server_title(self.active_link or "")
+        self.status_label.configure(text=f"Сервер отвечает плохо ({problem}), переключение...")
+        self.link_entry.delete(0, tk.END)
+        self.link_entry.insert(0, format_ss_link(candidates[0]))
+        self._connect_by_link()
 
     def _disconnect_by_link(self):
         """Отключить подключение по ссылке (V2Ray)."""
-        v2ray_stop()
+        self._stop_health()
+        self._failed_servers.clear()
+        self._stop_stats()
+        self._stop_access_log()
+        self.tasks.cancel("v2ray")
+        self.tasks.submit(self.supervisor.stop, key="v2ray")
         self.connected_via_v2ray = False
+        self.active_link = None
         self.link_connect_btn.configure(
             text="Подключить по ссылке", fg_color=["#3B8ED0", "#1F6AA5"]
         )
@@ -361,10 +1094,34 @@ class VPNClientApp(ctk.CTk):
         else:
             self._connect()
 
+    def _link_switch_pending(self) -> bool:
+        """Подключены через V2Ray, а в поле вставлена другая ссылка."""
+        link = self.link_entry.get().strip()
+        return (
+            self.connected
+            and self.connected_via_v2ray
+            and self.active_link is not None
+            and link.startswith("ss://")
+            and link != self.active_link
+        )
+
+    def _update_link_button(self):
+        if not (self.connected and self.connected_via_v2ray) or self.tasks.pending("v2ray"):
+            return
+        text = "Переключить" if self._link_switch_pending() else "Отключить"
+        if self.link_connect_btn.cget("text") != text:
+            self.link_connect_btn.configure(text=text)
+
     def _toggle_link_connection(self):
-        """Подключить по ссылке или отключить (кнопка «Отключить»)."""
+        """Подключить по ссылке, переключить сервер (другая ссылка в поле), отменить запуск или отключить."""
+        if self.tasks.pending("v2ray"):
+            self._cancel_link_connect()
+            return
+        if self._link_switch_pending():
+            self._connect_by_link()
+            return
         if self.connected and self.connected_via_v2ray:
-            clear_system_proxy()
+            self._clear_system_proxy()
             self._disconnect_by_link()
             self.connected = False
             return
@@ -384,40 +1141,42 @@ class VPNClientApp(ctk.CTk):
 
         self.connect_btn.configure(state="disabled", text="Подключение...")
         self.status_label.configure(text="Запуск прокси...")
-
-        def do_connect():
-            remote_url = self._get_remote_url()
-            ok = self.proxy_process.start(remote_url)
-            self.after(0, lambda: self._on_connect_done(ok))
-
-        threading.Thread(target=do_connect, daemon=True).start()
+        self.tasks.submit(
+            self.proxy_process.start, self._get_remote_url(), key="manual", on_done=self._on_connect_done
+        )
 
     def _on_connect_done(self, process_ok: bool):
         if not process_ok:
             self.connect_btn.configure(state="normal", text="Подключиться")
-            self.status_label.configure(text="Ошибка запуска прокси. Проверьте pproxy: pip install pproxy")
+            self.status_label.configure(text="Ошибка запуска прокси. Подробности — в «Журнал»")
             return
-        set_ok = set_system_proxy(LOCAL_PROXY_HOST, LOCAL_PROXY_PORT)
+        set_ok = self._set_system_proxy()
         if set_ok:
             self.connected = True
             self.connect_btn.configure(state="normal", text="Отключиться", fg_color="#c0392b")
             self.link_connect_btn.configure(state="disabled")
-            self.status_label.configure(text="Подключено — трафик идёт через прокси")
+            self.status_label.configure(
+                text="Подключено — трафик идёт через прокси" + self._ready_suffix(self.proxy_process.timings)
+            )
         else:
             self.proxy_process.stop()
             self.connect_btn.configure(state="normal", text="Подключиться")
             self.status_label.configure(text="Ошибка настройки системного прокси")
 
     def _disconnect(self):
-        clear_system_proxy()
+        self._clear_system_proxy()
         if self.connected_via_v2ray:
-            v2ray_stop()
+            self._stop_health()
+            self._stop_stats()
+            self._stop_access_log()
+            self.tasks.cancel("v2ray")
+            self.tasks.submit(self.supervisor.stop, key="v2ray")
             self.link_connect_btn.configure(
                 text="Подключить по ссылке", fg_color=["#3B8ED0", "#1F6AA5"]
             )
             self.connect_btn.configure(state="normal")
         else:
-            self.proxy_process.stop()
+            self.tasks.submit(self.proxy_process.stop, key="manual")
         self.connected = False
         self.connected_via_v2ray = False
         self.link_connect_btn.configure(state="normal")
@@ -426,8 +1185,9 @@ class VPNClientApp(ctk.CTk):
 
     def _update_status_from_system(self):
         enabled, server = get_system_proxy_status()
-        if enabled and server and server.startswith(f"{LOCAL_PROXY_HOST}:{LOCAL_PROXY_PORT}"):
-            if v2ray_is_running():
+        ports = {LOCAL_PROXY_PORT} | {slot["http_port"] for slot in SLOT_PORTS}
+        if enabled and server in {f"{LOCAL_PROXY_HOST}:{port}" for port in ports}:
+            if self.supervisor.is_running():
                 self.connected = True
                 self.connected_via_v2ray = True
                 self.link_connect_btn.configure(text="Отключить", fg_color="#c0392b")
@@ -440,14 +1200,23 @@ class VPNClientApp(ctk.CTk):
                 self.status_label.configure(text="Подключено — трафик идёт через прокси")
             else:
                 clear_system_proxy()
+        elif get_pac_url() == self.pac_server.url:
+            # PAC остался от прошлого запуска, а сервер скрипта уже не работает
+            clear_system_proxy(self.pac_server.url)
 
     def on_closing(self):
-        if self.connected:
-            clear_system_proxy()
-            if self.connected_via_v2ray:
-                v2ray_stop()
+        starting = self.tasks.pending("v2ray")
+        self.tasks.shutdown()
+        if self.connected or starting:
+            if self.connected_via_v2ray or starting:
+                self._stop_health()
+                self._stop_stats()
+                # Дождётся незавершённого запуска — после него прокси уже никто не переставит
+                self.supervisor.stop()
             else:
                 self.proxy_process.stop()
+            self._clear_system_proxy()
+        self.profiles.close()
         self.destroy()
 
 
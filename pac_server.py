@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+PAC-режим: встроенный HTTP-сервер отдаёт сгенерированный PAC-скрипт, через прокси идут
+только домены из списка. Список компилируется в хэш-таблицу суффиксов внутри скрипта:
+проверка хоста — по одному поиску на каждую метку имени, независимо от размера списка.
+"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import geosite
+from app_dir import BASE_DIR
+from config_builder import read_rule_list
+
+PAC_HOST = "127.0.0.1"
+PAC_PORT = 3129
+PAC_PATH = "/proxy.pac"
+# Свои домены для PAC-режима (по одному на строку); если файла нет — DEFAULT_DOMAINS
+PAC_DOMAINS_FILE = BASE_DIR / "pac_domains.txt"
+DEFAULT_DOMAINS = [
+    "youtube.com", "youtu.be", "googlevideo.com", "ytimg.com", "ggpht.com",
+    "instagram.com", "cdninstagram.com", "facebook.com", "fbcdn.net", "messenger.com",
+    "twitter.com", "x.com", "twimg.com", "t.co",
+    "linkedin.com", "licdn.com",
+    "discord.com", "discord.gg", "discordapp.com", "discordapp.net", "discord.media",
+    "medium.com", "patreon.com", "soundcloud.com", "rutracker.org",
+    "openai.com", "chatgpt.com", "oaiusercontent.com",
+]
+
+_PAC_TEMPLATE = """var PROXY = %(proxy)s;
+var SUFFIXES = %(suffixes)s;
+var EXACT = %(exact)s;
+function FindProxyForURL(url, host) {
+  if (isPlainHostName(host)) return "DIRECT";
+  host = host.toLowerCase();
+  if (host.charAt(host.length - 1) == ".") host = host.substring(0, host.length - 1);
+  if (EXACT.hasOwnProperty(host)) return PROXY;
+  var pos = 0;
+  while (pos >= 0) {
+    if (SUFFIXES.hasOwnProperty(host.substring(pos))) return PROXY;
+    pos = host.indexOf(".", pos);
+    if (pos >= 0) pos++;
+  }
+  return "DIRECT";
+}
+"""
+
+
+def _normalize(entry: str) -> tuple[str, str] | None:
+    """('suffix' | 'exact', домен) из строки списка; правила V2Ray без домена — None."""
+    entry = entry.strip().lower()
+    kind = "suffix"
+    if entry.startswith("full:"):
+        kind, entry = "exact", entry[5:]
+    elif entry.startswith("domain:"):
+        entry = entry[7:]
+    elif ":" in entry or "/" in entry:
+        # regexp:, keyword:, IP-подсети — в PAC-скрипт не переносятся
+        return None
+    entry = entry.lstrip("*").strip(".")
+    if not entry:
+        return None
+    try:
+        return kind, entry.encode("idna").decode("ascii")
+    except UnicodeError:
+        return None
+
+
+def _expand_geosite(domains):
+    """geosite:категория -> её правила domain/full из geosite.dat."""
+    categories = []
+    for entry in domains:
+        if entry.strip().lower().startswith("geosite:"):
+            categories.append(entry.strip()[8:])
+        else:
+            yield entry
+    if not categories:
+        return
+    matcher = geosite.load_categories(categories)
+    if matcher is None:
+        return
+    for suffix in matcher.suffixes:
+        yield "domain:" + suffix.decode("ascii", errors="replace")
+    for full in matcher.fulls:
+        yield "full:" + full.decode("ascii", errors="replace")
+
+
+def compile_pac(domains, proxy: str) -> str:
+    """PAC-скрипт: домены (и их поддомены) из domains — через proxy ("PROXY host:port"), остальное напрямую.
+    geosite:категория раскрывается по geosite.dat (без keyword/regexp)."""
+    suffixes, exact = {}, {}
+    for entry in _expand_geosite(domains):
+        parsed = _normalize(entry)
+        if parsed is None:
+            continue
+        kind, domain = parsed
+        (exact if kind == "exact" else suffixes)[domain] = 1
+    # Поддомены уже покрытых суффиксов не нужны
+    suffixes = {
+        d: 1 for d in suffixes
+        if not any(d[i + 1:] in suffixes for i, ch in enumerate(d) if ch == ".")
+    }
+    return _PAC_TEMPLATE % {
+        "proxy": json.dumps(proxy),
+        "suffixes": json.dumps(suffixes, separators=(",", ":"), sort_keys=True),
+        "exact": json.dumps(exact, separators=(",", ":"), sort_keys=True),
+    }
+
+
+def load_domains() -> list[str]:
+    """Домены из PAC_DOMAINS_FILE или список по умолчанию."""
+    if PAC_DOMAINS_FILE.exists():
+        return read_rule_list(PAC_DOMAINS_FILE)
+    return list(DEFAULT_DOMAINS)
+
+
+class _PacHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if self.path.split("?", 1)[0] != PAC_PATH:
+            self.send_error(404)
+            return
+        body, etag = server.pac_body, server.pac_etag
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PacServer:
+    """HTTP-сервер PAC-скрипта в фоновом потоке."""
+
+    def __init__(self, proxy_host: str, proxy_port: int, port: int = PAC_PORT, host: str = PAC_HOST):
+        self.host = host
+        self.port = port
+        self.proxy = f"PROXY {proxy_host}:{proxy_port}"
+        self._server = None
+        self._body = b""
+        self._etag = ""
+        self._domains = []
+        self.domain_count = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{PAC_PATH}"
+
+    def set_domains(self, domains):
+        """Пересобрать скрипт; работающий сервер сразу отдаёт новый."""
+        domains = list(domains)
+        self._domains = domains
+        self._body = compile_pac(domains, self.proxy).encode("utf-8")
+        self._etag = '"' + hashlib.sha1(self._body).hexdigest()[:16] + '"'
+        self.domain_count = len(domains)
+        if self._server is not None:
+            self._server.pac_body, self._server.pac_etag = self._body, self._etag
+
+    def set_proxy(self, proxy_host: str, proxy_port: int):
+        """Другой адрес прокси в скрипте (например, после переключения V2Ray на запасные порты)."""
+        proxy = f"PROXY {proxy_host}:{proxy_port}"
+        if proxy != self.proxy:
+            self.proxy = proxy
+            self.set_domains(self._domains)
+
+    def start(self, domains=None) -> bool:
+        """Запустить сервер (domains=None — load_domains())."""
+        self.set_domains(load_domains() if domains is None else domains)
+        if self._server is not None:
+            return True
+        try:
+            server = ThreadingHTTPServer((self.host, self.port), _PacHandler)
+        except OSError:
+            return False
+        server.daemon_threads = True
+        server.pac_body, server.pac_etag = self._body, self._etag
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._server = server
+        return True
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def is_running(self) -> bool:
+        return self._server is not None
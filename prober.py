@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Параллельная проверка серверов Shadowsocks: время TCP-подключения (RTT) и, по желанию,
+настоящее AEAD-рукопожатие (нужен пакет cryptography; без него шаг пропускается).
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import time
+from typing import NamedTuple
+
+from config_builder import SsServer
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:  # необязательная зависимость
+    AESGCM = ChaCha20Poly1305 = None
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_TIMEOUT = 3.0
+# Куда сервер подключается при проверке рукопожатием
+HANDSHAKE_TARGET = ("www.gstatic.com", 80)
+HANDSHAKE_REQUEST = b"HEAD /generate_204 HTTP/1.1\r\nHost: www.gstatic.com\r\nConnection: close\r\n\r\n"
+
+# method -> (длина ключа, класс шифра)
+AEAD_METHODS = {
+    "aes-128-gcm": (16, "aes"),
+    "aes-192-gcm": (24, "aes"),
+    "aes-256-gcm": (32, "aes"),
+    "chacha20-ietf-poly1305": (32, "chacha"),
+    "chacha20-poly1305": (32, "chacha"),
+}
+TAG_SIZE = 16
+
+
+class ProbeResult(NamedTuple):
+    server: SsServer
+    rtt: float | None  # секунды до установки TCP-соединения
+    handshake: float | None = None  # секунды до первого расшифрованного ответа сервера
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.rtt is not None and not self.error
+
+    @property
+    def score(self) -> float:
+        """Чем меньше — тем лучше; недоступные серверы — в конце."""
+        if not self.ok:
+            return float("inf")
+        return self.handshake if self.handshake is not None else self.rtt
+
+
+def handshake_supported(method: str) -> bool:
+    return AESGCM is not None and method.lower() in AEAD_METHODS
+
+
+def _evp_bytes_to_key(password: bytes, key_len: int) -> bytes:
+    key, prev = b"", b""
+    while len(key) < key_len:
+        prev = hashlib.md5(prev + password).digest()
+        key += prev
+    return key[:key_len]
+
+
+def _hkdf_sha1(key: bytes, salt: bytes, length: int) -> bytes:
+    prk = hmac.new(salt, key, hashlib.sha1).digest()
+    out, block, counter = b"", b"", 1
+    while len(out) < length:
+        block = hmac.new(prk, block + b"ss-subkey" + bytes([counter]), hashlib.sha1).digest()
+        out += block
+        counter += 1
+    return out[:length]
+
+
+class AeadStream:
+    """Шифрование/расшифровка чанков Shadowsocks AEAD с счётчиком nonce."""
+
+    def __init__(self, method: str, password: str, salt: bytes):
+        key_len, kind = AEAD_METHODS[method.lower()]
+        subkey = _hkdf_sha1(_evp_bytes_to_key(password.encode("utf-8"), key_len), salt, key_len)
+        self._cipher = AESGCM(subkey) if kind == "aes" else ChaCha20Poly1305(subkey)
+        self._nonce = 0
+
+    def _next_nonce(self) -> bytes:
+        nonce = self._nonce.to_bytes(12, "little")
+        self._nonce += 1
+        return nonce
+
+    def seal(self, data: bytes) -> bytes:
+        return self._cipher.encrypt(self._next_nonce(), data, None)
+
+    def open(self, data: bytes) -> bytes:
+        return self._cipher.decrypt(self._next_nonce(), data, None)
+
+    def seal_chunk(self, payload: bytes) -> bytes:
+        return self.seal(struct.pack("!H", len(payload))) + self.seal(payload)
+
+
+def _target_address(host: str, port: int) -> bytes:
+    encoded = host.encode("idna")
+    return b"\x03" + bytes([len(encoded)]) + encoded + struct.pack("!H", port)
+
+
+async def _handshake(reader, writer, server: SsServer) -> None:
+    """Отправить запрос через сервер и расшифровать длину первого ответного чанка."""
+    key_len, _ = AEAD_METHODS[server.method.lower()]
+    salt = os.urandom(key_len)
+    encoder = AeadStream(server.method, server.password, salt)
+    payload = _target_address(*HANDSHAKE_TARGET) + HANDSHAKE_REQUEST
+    writer.write(salt + encoder.seal_chunk(payload))
+    await writer.drain()
+    server_salt = await reader.readexactly(key_len)
+    decoder = AeadStream(server.method, server.password, server_salt)
+    decoder.open(await reader.readexactly(2 + TAG_SIZE))
+
+
+async def probe_server(server: SsServer, timeout: float = DEFAULT_TIMEOUT, handshake: bool = False) -> ProbeResult:
+    """Замерить TCP RTT до сервера (и рукопожатие, если handshake и метод поддерживается).
+    С плагином SIP003 рукопожатие идёт внутри его транспорта — замеряется только RTT."""
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await asyncio.wait_for(
+            loop.getaddrinfo(server.host, server.port, type=socket.SOCK_STREAM), timeout
+        )
+        family, _, _, _, addr = infos[0]
+        started = time.perf_counter()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(addr[0], addr[1], family=family), timeout
+        )
+        rtt = time.perf_counter() - started
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError) as e:
+        # UnicodeError (подкласс ValueError) — имя, которое не кодируется в IDNA (метка длиннее 63 байт)
+        return ProbeResult(server, None, None, str(e) or type(e).__name__)
+    try:
+        if not (handshake and handshake_supported(server.method)) or server.plugin:
+            return ProbeResult(server, rtt)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(_handshake(reader, writer, server), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            return ProbeResult(server, rtt, None, f"рукопожатие: {e or type(e).__name__}")
+        except Exception:  # cryptography.exceptions.InvalidTag — неверный пароль/метод
+            return ProbeResult(server, rtt, None, "рукопожатие: неверный пароль или метод")
+        return ProbeResult(server, rtt, time.perf_counter() - started)
+    finally:
+        writer.close()
+
+
+async def probe_all(
+    servers,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    handshake: bool = False,
+    on_result=None,
+) -> list[ProbeResult]:
+    """Проверить все серверы (не больше concurrency одновременно). Результат отсортирован.
+    on_result(ProbeResult) — по мере готовности каждого сервера."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(server):
+        async with semaphore:
+            result = await probe_server(server, timeout, handshake)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    results = await asyncio.gather(*(limited(s) for s in servers))
+    return rank(results)
+
+
+def rank(results) -> list[ProbeResult]:
+    """Доступные — по возрастанию задержки, затем недоступные."""
+    return sorted(results, key=lambda r: r.score)
+
+
+def run_probe(servers, **kwargs) -> list[ProbeResult]:
+    """Синхронная обёртка для потоков GUI."""
+    return asyncio.run(probe_all(list(servers), **kwargs))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновое чтение вывода дочерних процессов (V2Ray, pproxy) в кольцевой буфер.
+Поток постоянно вычитывает pipe, чтобы процесс никогда не блокировался на записи лога.
+"""
+import collections
+import threading
+import time
+
+# Максимальная длина одной строки лога (длиннее — обрезается, чтобы не держать память)
+MAX_LINE_BYTES = 8192
+
+
+class LogBuffer:
+    """Последние N строк лога процесса и счётчик строк в секунду."""
+
+    def __init__(self, max_lines: int = 500):
+        self._lines = collections.deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self.total_lines = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._rate = 0.0
+
+    def attach(self, stream) -> threading.Thread:
+        """Запустить поток, который читает stream (bytes) до EOF."""
+        thread = threading.Thread(target=self._drain, args=(stream,), daemon=True)
+        thread.start()
+        return thread
+
+    def _drain(self, stream):
+        try:
+            for raw in iter(lambda: stream.readline(MAX_LINE_BYTES), b""):
+                self.append(raw.decode("utf-8", errors="replace").rstrip("\r\n"))
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def append(self, line: str):
+        now = time.monotonic()
+        with self._lock:
+            self._lines.append(line)
+            self.total_lines += 1
+            self._window_count += 1
+            elapsed = now - self._window_start
+            if elapsed >= 1.0:
+                self._rate = self._window_count / elapsed
+                self._window_start = now
+                self._window_count = 0
+
+    def tail(self, n: int = 100) -> list[str]:
+        """Последние n строк (от старых к новым)."""
+        with self._lock:
+            if n >= len(self._lines):
+                return list(self._lines)
+            return list(self._lines)[-n:]
+
+    def line_rate(self) -> float:
+        """Строк в секунду за последнее окно (0, если лог давно молчит)."""
+        with self._lock:
+            elapsed = time.monotonic() - self._window_start
+            if elapsed >= 2.0:
+                return self._window_count / elapsed
+            return self._rate
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
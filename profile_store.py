@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Профили в SQLite (profiles.db): ручные SOCKS5/HTTP и серверы ss:// из ссылок и подписок.
+Индексы по имени и по host:port, запись — одной строкой (без перезаписи всего файла),
+поиск по началу имени или адреса — для подсказок при вводе. Здесь же — последние
+результаты проверки задержки и теста скорости каждого сервера (скорость — вместе
+с профилем сокетов, на котором она получена).
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from app_dir import BASE_DIR
+from config_builder import SsServer, format_ss_link, parse_ss_link
+
+PROFILES_DB = BASE_DIR / "profiles.db"
+# Прежние файлы — переносятся в базу при первом открытии
+LEGACY_PROFILES_FILE = BASE_DIR / "profiles.json"
+LEGACY_LAST_LINK_FILE = BASE_DIR / "last_link.txt"
+SEARCH_LIMIT = 50
+MANUAL_KINDS = ("socks5", "http")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    kind TEXT NOT NULL,
+    host TEXT NOT NULL COLLATE NOCASE,
+    port INTEGER NOT NULL,
+    user TEXT NOT NULL DEFAULT '',
+    password TEXT NOT NULL DEFAULT '',
+    method TEXT NOT NULL DEFAULT '',
+    plugin TEXT NOT NULL DEFAULT '',
+    last_used REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS profiles_name ON profiles (name);
+CREATE INDEX IF NOT EXISTS profiles_endpoint ON profiles (host, port);
+CREATE INDEX IF NOT EXISTS profiles_last_used ON profiles (last_used);
+CREATE TABLE IF NOT EXISTS probes (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    rtt REAL,
+    handshake REAL,
+    error TEXT NOT NULL DEFAULT '',
+    checked REAL NOT NULL,
+    PRIMARY KEY (host, port, method)
+);
+CREATE TABLE IF NOT EXISTS speed_results (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    tuning TEXT NOT NULL,
+    mbps REAL,
+    ttfb REAL,
+    jitter REAL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT '',
+    checked REAL NOT NULL,
+    PRIMARY KEY (host, port, method, tuning)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_UPSERT_SS = """
+INSERT INTO profiles (key, name, kind, host, port, password, method, plugin, last_used)
+VALUES (?, ?, 'ss', ?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    name = CASE WHEN excluded.name != '' THEN excluded.name ELSE profiles.name END,
+    password = excluded.password,
+    plugin = excluded.plugin,
+    last_used = MAX(profiles.last_used, excluded.last_used)
+"""
+
+
+def _ss_key(server: SsServer) -> str:
+    host, port, method = server.key
+    return f"ss:{host}:{port}:{method}"
+
+
+def _manual_key(name: str) -> str:
+    return "manual:" + name.strip().lower()
+
+
+def _like_prefix(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class ProfileStore:
+    """Профили и результаты проверок. Можно вызывать из разных потоков."""
+
+    def __init__(self, path=PROFILES_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(profiles)")}
+            if "plugin" not in columns:
+                # База от версии без плагинов SIP003
+                self._db.execute("ALTER TABLE profiles ADD COLUMN plugin TEXT NOT NULL DEFAULT ''")
+        self._import_legacy()
+
+    def _import_legacy(self):
+        """Один раз перенести profiles.json и last_link.txt (сами файлы не трогаются)."""
+        with self._lock:
+            done = self._db.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone()
+        if done:
+            return
+        try:
+            legacy = json.loads(LEGACY_PROFILES_FILE.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            legacy = []
+        for profile in legacy if isinstance(legacy, list) else []:
+            if isinstance(profile, dict):
+                self.save_manual(profile)
+        try:
+            self.touch_link(LEGACY_LAST_LINK_FILE.read_text(encoding="utf-8"))
+        except OSError:
+            pass
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', '1')")
+
+    @staticmethod
+    def _profile(row) -> dict:
+        """Строка таблицы -> словарь как в прежнем profiles.json (+ key, label, link для ss)."""
+        profile = {
+            "key": row["key"],
+            "name": row["name"],
+            "protocol": row["kind"],
+            "host": row["host"],
+            "port": row["port"],
+            "user": row["user"],
+            "password": row["password"],
+        }
+        if row["kind"] == "ss":
+            server = SsServer(row["host"], row["port"], row["method"], row["password"], row["name"], row["plugin"])
+            profile["link"] = format_ss_link(server)
+            profile["label"] = f"{row['name'] or row['host']} — {row['host']}:{row['port']}"
+        else:
+            profile["label"] = row["name"]
+        return profile
+
+    def save_manual(self, profile: dict) -> bool:
+        """Сохранить (или заменить по имени) профиль SOCKS5/HTTP."""
+        name = str(profile.get("name", "")).strip()
+        protocol = profile.get("protocol", "socks5")
+        try:
+            port = int(profile.get("port", 0))
+        except (TypeError, ValueError):
+            return False
+        if not name or protocol not in MANUAL_KINDS:
+            return False
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO profiles (key, name, kind, host, port, user, password, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        _manual_key(name), name, protocol, str(profile.get("host", "")).strip(), port,
+                        str(profile.get("user", "")), str(profile.get("password", "")), time.time(),
+                    ),
+                )
+            return True
+        except sqlite3.Error:
+            return False
+
+    def add_servers(self, servers) -> int:
+        """Добавить или обновить серверы ss:// (например, из подписки). Вернуть их число."""
+        rows = [
+            (_ss_key(s), s.name, s.host, s.port, s.password, s.method, s.plugin, 0.0)
+            for s in servers
+        ]
+        try:
+            with self._lock, self._db:
+                self._db.executemany(_UPSERT_SS, rows)
+        except sqlite3.Error:
+            return 0
+        return len(rows)
+
+    def touch_link(self, link: str) -> bool:
+        """Запомнить ссылку как последнюю использованную."""
+        server = parse_ss_link(link.strip())
+        if server is None:
+            return False
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    _UPSERT_SS,
+                    (
+                        _ss_key(server), server.name, server.host, server.port,
+                        server.password, server.method, server.plugin, time.time(),
+                    ),
+                )
+            return True
+        except sqlite3.Error:
+            return False
+
+    def last_link(self) -> str | None:
+        """Ссылка последнего подключения по ss://."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM profiles WHERE kind = 'ss' AND last_used > 0 ORDER BY last_used DESC LIMIT 1"
+            ).fetchone()
+        return self._profile(row)["link"] if row is not None else None
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM profiles WHERE key = ?", (key,)).fetchone()
+        return self._profile(row) if row is not None else None
+
+    def delete(self, key: str) -> bool:
+        try:
+            with self._lock, self._db:
+                return self._db.execute("DELETE FROM profiles WHERE key = ?", (key,)).rowcount > 0
+        except sqlite3.Error:
+            return False
+
+    def search(self, text: str = "", limit: int = SEARCH_LIMIT) -> list[dict]:
+        """Профили, у которых имя или адрес начинается с text (без учёта регистра).
+        Сначала ручные, затем недавно использованные."""
+        text = text.strip()
+        query = "SELECT * FROM profiles"
+        params = []
+        if text:
+            query += " WHERE name LIKE ? ESCAPE '\\' OR host LIKE ? ESCAPE '\\'"
+            params = [_like_prefix(text)] * 2
+        query += " ORDER BY kind = 'ss', last_used DESC, name LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, params + [limit]).fetchall()
+        return [self._profile(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def save_probes(self, results) -> int:
+        """Запомнить результаты prober.ProbeResult (по host:port:method)."""
+        now = time.time()
+        rows = [(*r.server.key, r.rtt, r.handshake, r.error, now) for r in results]
+        try:
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO probes (host, port, method, rtt, handshake, error, checked)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error:
+            return 0
+        return len(rows)
+
+    def probes(self) -> dict[tuple[str, int, str], tuple[float | None, float | None, str, float]]:
+        """SsServer.key -> (rtt, handshake, error, время проверки)."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM probes").fetchall()
+        return {
+            (row["host"], row["port"], row["method"]): (row["rtt"], row["handshake"], row["error"], row["checked"])
+            for row in rows
+        }
+
+    def save_speed(self, results) -> int:
+        """Запомнить результаты speedtest.SpeedResult (по серверу и профилю сокетов)."""
+        now = time.time()
+        rows = [(*r.server.key, r.tuning, r.mbps, r.ttfb, r.jitter, r.bytes, r.error, now) for r in results]
+        try:
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO speed_results"
+                    " (host, port, method, tuning, mbps, ttfb, jitter, bytes, error, checked)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error:
+            return 0
+        return len(rows)
+
+    def speed_results(self) -> dict[tuple[str, int, str], tuple]:
+        """SsServer.key -> (mbps, ttfb, jitter, байт, error, профиль сокетов) последнего теста."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM speed_results ORDER BY checked").fetchall()
+        return {
+            (row["host"], row["port"], row["method"]): (
+                row["mbps"], row["ttfb"], row["jitter"], row["bytes"], row["error"], row["tuning"]
+            )
+            for row in rows
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
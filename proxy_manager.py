@@ -1,21 +1,42 @@
 # -*- coding: utf-8 -*-
 """
 Управление системным прокси в Windows и локальный прокси-сервер.
+winreg загружается внутри функций реестра: без Windows они возвращают False / "",
+а ProxyProcess (pproxy) работает везде.
 """
 import subprocess
 import sys
-import winreg
 import urllib.parse
 
+from proc_log import LogBuffer
+from readiness import StartupTimings, wait_for_ports
+
 # Адрес локального прокси (Windows использует только HTTP-прокси)
 LOCAL_PROXY_HOST = "127.0.0.1"
 LOCAL_PROXY_PORT = 3128
 REG_PATH = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
+# InternetSetOption: перечитать настройки прокси (иначе PAC подхватывается не сразу)
+INTERNET_OPTION_SETTINGS_CHANGED = 39
+INTERNET_OPTION_REFRESH = 37
+
+
+def _notify_settings_changed():
+    """Сообщить WinINet, что настройки прокси в реестре изменились."""
+    try:
+        import ctypes
+
+        wininet = ctypes.windll.wininet
+        wininet.InternetSetOptionW(0, INTERNET_OPTION_SETTINGS_CHANGED, 0, 0)
+        wininet.InternetSetOptionW(0, INTERNET_OPTION_REFRESH, 0, 0)
+    except (OSError, AttributeError):
+        pass
 
 
 def set_system_proxy(host: str, port: int) -> bool:
     """Включить системный прокси в Windows."""
     try:
+        import winreg
+
         key = winreg.OpenKey(
             winreg.HKEY_CURRENT_USER,
             REG_PATH,
@@ -25,14 +46,17 @@ def set_system_proxy(host: str, port: int) -> bool:
         winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 1)
         winreg.SetValueEx(key, "ProxyServer", 0, winreg.REG_SZ, f"{host}:{port}")
         winreg.CloseKey(key)
+        _notify_settings_changed()
         return True
-    except OSError:
+    except (OSError, ImportError):
         return False
 
 
-def clear_system_proxy() -> bool:
-    """Отключить системный прокси."""
+def set_pac_url(url: str) -> bool:
+    """PAC-режим: AutoConfigURL на url, постоянный прокси выключен."""
     try:
+        import winreg
+
         key = winreg.OpenKey(
             winreg.HKEY_CURRENT_USER,
             REG_PATH,
@@ -40,15 +64,65 @@ def clear_system_proxy() -> bool:
             winreg.KEY_SET_VALUE
         )
         winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+        winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, url)
+        winreg.CloseKey(key)
+        _notify_settings_changed()
+        return True
+    except (OSError, ImportError):
+        return False
+
+
+def get_pac_url() -> str:
+    """Текущий AutoConfigURL ("" — не задан)."""
+    try:
+        import winreg
+
+        key = winreg.OpenKey(
+            winreg.HKEY_CURRENT_USER,
+            REG_PATH,
+            0,
+            winreg.KEY_READ
+        )
+        try:
+            return winreg.QueryValueEx(key, "AutoConfigURL")[0] or ""
+        except FileNotFoundError:
+            return ""
+        finally:
+            winreg.CloseKey(key)
+    except (OSError, ImportError):
+        return ""
+
+
+def clear_system_proxy(pac_url: str = "") -> bool:
+    """Отключить системный прокси. Если AutoConfigURL равен pac_url (наш PAC) — убрать и его."""
+    try:
+        import winreg
+
+        key = winreg.OpenKey(
+            winreg.HKEY_CURRENT_USER,
+            REG_PATH,
+            0,
+            winreg.KEY_SET_VALUE | winreg.KEY_READ
+        )
+        winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+        if pac_url:
+            try:
+                if winreg.QueryValueEx(key, "AutoConfigURL")[0] == pac_url:
+                    winreg.DeleteValue(key, "AutoConfigURL")
+            except FileNotFoundError:
+                pass
         winreg.CloseKey(key)
+        _notify_settings_changed()
         return True
-    except OSError:
+    except (OSError, ImportError):
         return False
 
 
 def get_system_proxy_status() -> tuple[bool, str]:
     """Вернуть (включен ли прокси, строка ProxyServer)."""
     try:
+        import winreg
+
         key = winreg.OpenKey(
             winreg.HKEY_CURRENT_USER,
             REG_PATH,
@@ -63,7 +137,7 @@ def get_system_proxy_status() -> tuple[bool, str]:
             pass
         winreg.CloseKey(key)
         return bool(enabled), server
-    except OSError:
+    except (OSError, ImportError):
         return False, ""
 
 
@@ -83,6 +157,8 @@ class ProxyProcess:
     def __init__(self, local_port: int = LOCAL_PROXY_PORT):
         self.local_port = local_port
         self._process = None
+        self.log = LogBuffer()
+        self.timings = StartupTimings()
 
     def start(self, remote_url: str) -> bool:
         """remote_url: socks5://host:port или http://host:port, с опцией user:pass@."""
@@ -93,13 +169,19 @@ class ProxyProcess:
         try:
             self._process = subprocess.Popen(
                 cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
             )
-            return self._process.poll() is None
+            self.log.attach(self._process.stdout)
         except Exception:
             return False
+        ready = wait_for_ports(LOCAL_PROXY_HOST, [self.local_port], self._process)
+        if ready is None:
+            self.stop()
+            return False
+        self.timings.record(ready)
+        return True
 
     def stop(self) -> bool:
         if self._process and self._process.poll() is None:
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Ожидание готовности дочернего прокси: порты inbound действительно принимают соединения.
+Время до готовности каждого запуска сохраняется для отслеживания задержки подключения.
+"""
+import collections
+import socket
+import time
+
+# Сколько ждать открытия портов после запуска процесса
+READY_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+
+
+def port_accepts(host: str, port: int, timeout: float = 0.2) -> bool:
+    """True, если на host:port можно установить TCP-соединение."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def free_ports(count: int, host: str = "127.0.0.1") -> list[int]:
+    """count свободных локальных портов (выданных системой, на момент вызова)."""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind((host, 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def wait_for_ports(
+    host: str,
+    ports,
+    process=None,
+    timeout: float = READY_TIMEOUT,
+    interval: float = POLL_INTERVAL,
+) -> float | None:
+    """Ждать, пока все ports начнут принимать соединения.
+    Вернуть время до готовности в секундах или None (таймаут или процесс завершился)."""
+    started = time.perf_counter()
+    deadline = started + timeout
+    pending = list(ports)
+    while True:
+        pending = [p for p in pending if not port_accepts(host, p)]
+        if process is not None and process.poll() is not None:
+            return None
+        if not pending:
+            return time.perf_counter() - started
+        if time.perf_counter() >= deadline:
+            return None
+        time.sleep(interval)
+
+
+class StartupTimings:
+    """История времени до готовности (последние N запусков)."""
+
+    def __init__(self, max_items: int = 50):
+        self._items = collections.deque(maxlen=max_items)
+
+    def record(self, seconds: float):
+        self._items.append((time.time(), seconds))
+
+    @property
+    def last(self) -> float | None:
+        return self._items[-1][1] if self._items else None
+
+    def average(self) -> float | None:
+        if not self._items:
+            return None
+        return sum(s for _, s in self._items) / len(self._items)
+
+    def history(self) -> list[tuple[float, float]]:
+        """[(unix-время запуска, секунды до готовности), ...]"""
+        return list(self._items)
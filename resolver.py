@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Адрес сервера при подключении: все A/AAAA-записи разрешаются один раз, к ним
+открываются TCP-соединения (happy eyeballs — IPv6 и IPv4 вперемешку, с небольшим сдвигом);
+после первого удачного ждём ещё GRACE_WINDOW близких соперников, остальные попытки отменяются.
+Самый быстрый IP подставляется в конфиг V2Ray вместо имени. Так V2Ray не ходит в DNS
+на каждое новое соединение с сервером. Через PIN_TTL секунд адрес выбирается заново.
+"""
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from typing import NamedTuple
+
+from config_builder import SsServer
+
+# Сколько держать выбранный IP (TTL записей стандартная библиотека не сообщает)
+PIN_TTL = 300.0
+CONNECT_TIMEOUT = 3.0
+# Сдвиг между запусками попыток (RFC 8305 советует 250 мс; меряем все адреса, поэтому меньше)
+ATTEMPT_DELAY = 0.05
+# Сколько после первого удачного подключения ждать остальные (вдруг почти так же быстры)
+GRACE_WINDOW = 0.05
+MAX_ADDRESSES = 8
+
+
+class Pin(NamedTuple):
+    host: str
+    port: int
+    ip: str
+    rtt: float  # время TCP-подключения к ip, с
+    addresses: tuple[str, ...]  # все адреса имени
+    expires: float  # time.monotonic()
+
+
+def is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_all(host: str, port: int) -> list[str]:
+    """Все адреса имени: IPv6 и IPv4 вперемешку (RFC 8305), без повторов. Ошибка — пустой список."""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return []
+    v6, v4 = [], []
+    for family, _, _, _, sockaddr in infos:
+        target = v6 if family == socket.AF_INET6 else v4
+        if sockaddr[0] not in target:
+            target.append(sockaddr[0])
+    mixed = []
+    for i in range(max(len(v6), len(v4))):
+        mixed += v6[i:i + 1] + v4[i:i + 1]
+    return mixed[:MAX_ADDRESSES]
+
+
+async def _dial(ip: str, port: int, delay: float, timeout: float) -> float | None:
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    rtt = time.perf_counter() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return rtt
+
+
+async def race(
+    addresses, port: int, timeout: float = CONNECT_TIMEOUT, delay: float = ATTEMPT_DELAY, grace: float = GRACE_WINDOW
+) -> list[tuple[str, float]]:
+    """Подключаться к адресам (i-й — через i * delay) до первого удачного и ещё grace секунд,
+    незавершённые попытки отменить. Успевшие — по возрастанию задержки."""
+    loop = asyncio.get_running_loop()
+    attempts = {
+        asyncio.ensure_future(_dial(ip, port, i * delay, timeout)): ip for i, ip in enumerate(addresses)
+    }
+    pending, ranked, deadline = set(attempts), [], None
+    try:
+        while pending:
+            wait = None if deadline is None else max(deadline - loop.time(), 0.0)
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            ranked += [(attempts[t], t.result()) for t in done if t.result() is not None]
+            if ranked and deadline is None:
+                deadline = loop.time() + grace
+            if deadline is not None and loop.time() >= deadline:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return sorted(ranked, key=lambda x: x[1])
+
+
+def fastest(host: str, port: int, timeout: float = CONNECT_TIMEOUT, ttl: float = PIN_TTL) -> Pin | None:
+    """Разрешить имя и выбрать самый быстрый адрес. None — имя не разрешилось или все адреса недоступны."""
+    addresses = resolve_all(host, port)
+    if not addresses:
+        return None
+    ranked = asyncio.run(race(addresses, port, timeout))
+    if not ranked:
+        return None
+    ip, rtt = ranked[0]
+    return Pin(host, port, ip, rtt, tuple(addresses), time.monotonic() + ttl)
+
+
+class AddressPinner:
+    """Кэш выбранных адресов серверов. Можно вызывать из разных потоков."""
+
+    def __init__(self, ttl: float = PIN_TTL, timeout: float = CONNECT_TIMEOUT):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._pins = {}  # (host, port) -> Pin
+        self._lock = threading.Lock()
+
+    def pin(self, host: str, port: int) -> Pin | None:
+        """Выбранный адрес (из кэша, если не истёк)."""
+        key = (host.lower(), port)
+        with self._lock:
+            pin = self._pins.get(key)
+        if pin is not None and pin.expires > time.monotonic():
+            return pin
+        return self._refresh(key)
+
+    def _refresh(self, key) -> Pin | None:
+        pin = fastest(key[0], key[1], self.timeout, self.ttl)
+        with self._lock:
+            if pin is not None:
+                self._pins[key] = pin
+            else:
+                # Не удалось — пусть V2Ray разрешает имя сам
+                self._pins.pop(key, None)
+        return pin
+
+    def pinned(self, server: SsServer) -> SsServer:
+        """Сервер с IP вместо имени (или без изменений: IP в ссылке, есть плагин или выбрать не удалось).
+        Плагину (TLS, заголовок Host) нужно имя сервера, поэтому с ним адрес не подставляется."""
+        if is_ip(server.host) or server.plugin:
+            return server
+        pin = self.pin(server.host, server.port)
+        return server if pin is None else server._replace(host=pin.ip)
+
+    def refresh_expired(self) -> bool:
+        """Заново выбрать адреса с истёкшим сроком. True — у какого-то сервера выбран другой IP.
+        Не удалось (DNS или сеть недоступны) — прежний адрес остаётся ещё на ttl, это не изменение."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [(key, pin) for key, pin in self._pins.items() if pin.expires <= now]
+        changed = False
+        for key, old in expired:
+            pin = fastest(key[0], key[1], self.timeout, self.ttl)
+            with self._lock:
+                if pin is None:
+                    self._pins[key] = old._replace(expires=time.monotonic() + self.ttl)
+                    continue
+                self._pins[key] = pin
+            changed = changed or pin.ip != old.ip
+        return changed
+
+    def forget(self, host: str, port: int):
+        with self._lock:
+            self._pins.pop((host.lower(), port), None)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Замер реальной скорости серверов: по отдельному экземпляру V2Ray на каждый сервер
+(свои временные порты), параллельная загрузка фиксированного объёма через каждый.
+Пачка коротких запросов (burst_test) сравнивает транспорты: с mux соединения программ
+не платят за отдельное рукопожатие с сервером. В каждом результате записан профиль
+сокетов (TUNING_PROFILES), с которым он получен.
+
+    python speedtest.py ss://... [--burst 32] [--mux 8] [--tuning low-latency] — сравнение транспортов
+"""
+import statistics
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from config_builder import (
+    DEFAULT_TUNING,
+    TRANSPORT_PROFILES,
+    TUNING_PROFILES,
+    SsServer,
+    build_from_server,
+    parse_ss_link,
+    unsupported_reason,
+)
+from readiness import free_ports
+from v2ray_runner import LISTEN_HOST, InstancePool
+
+# {size} подставляется размером загрузки в байтах
+DEFAULT_URL = "http://speed.cloudflare.com/__down?bytes={size}"
+DEFAULT_PAYLOAD = 10 * 1024 * 1024
+DEFAULT_ROUNDS = 3
+DEFAULT_TIMEOUT = 30.0
+MAX_PARALLEL = 8
+READ_CHUNK = 256 * 1024
+# Пачка коротких запросов: каждый — новое соединение программы с локальным прокси
+BURST_URL = "http://www.gstatic.com/generate_204"
+BURST_REQUESTS = 32
+BURST_PARALLEL = 16
+BURST_TIMEOUT = 10.0
+
+
+class SpeedResult(NamedTuple):
+    server: SsServer
+    mbps: float | None  # средняя скорость загрузки, Мбит/с
+    ttfb: float | None  # среднее время до первого байта, с
+    jitter: float | None  # средний разброс TTFB между соседними замерами, с
+    bytes: int = 0
+    error: str = ""
+    tuning: str = DEFAULT_TUNING  # профиль сокетов конфига, на котором сделан замер
+
+
+def _jitter(values: list[float]) -> float:
+    if len(values) < 2:
+        return 0.0
+    return statistics.fmean(abs(b - a) for a, b in zip(values, values[1:]))
+
+
+def fetch_through_proxy(http_port: int, url: str, limit: int, timeout: float) -> tuple[float, float, int]:
+    """Скачать до limit байт через HTTP-прокси 127.0.0.1:http_port.
+    Вернуть (TTFB, секунды передачи после первого байта, байт)."""
+    proxy = f"http://{LISTEN_HOST}:{http_port}"
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+    started = time.perf_counter()
+    with opener.open(url, timeout=timeout) as response:
+        received = len(response.read(1))
+        first_byte = time.perf_counter()
+        while received < limit:
+            chunk = response.read(min(READ_CHUNK, limit - received))
+            if not chunk:
+                break
+            received += len(chunk)
+    return first_byte - started, time.perf_counter() - first_byte, received
+
+
+def measure(http_port: int, url: str, payload_bytes: int, rounds: int, timeout: float) -> tuple[float, float, float, int]:
+    """Несколько загрузок подряд. Вернуть (Мбит/с, средний TTFB, джиттер, всего байт)."""
+    ttfbs, speeds, total = [], [], 0
+    for _ in range(rounds):
+        ttfb, seconds, received = fetch_through_proxy(http_port, url, payload_bytes, timeout)
+        ttfbs.append(ttfb)
+        speeds.append(received * 8 / max(seconds, 1e-6) / 1e6)
+        total += received
+    return statistics.fmean(speeds), statistics.fmean(ttfbs), _jitter(ttfbs), total
+
+
+def _test_one(
+    pool: InstancePool, server: SsServer, url: str, payload_bytes: int, rounds: int, timeout: float, tuning: str
+) -> SpeedResult:
+    reason = unsupported_reason(server)
+    if reason:
+        return SpeedResult(server, None, None, None, 0, reason, tuning)
+    socks_port, http_port = free_ports(2)
+    config_json = build_from_server(
+        server, socks_port=socks_port, http_port=http_port, api_port=None, tuning=tuning
+    )
+    instance = pool.spawn(config_json)
+    if instance is None:
+        return SpeedResult(server, None, None, None, 0, "V2Ray не запустился", tuning)
+    try:
+        mbps, ttfb, jitter, total = measure(http_port, url, payload_bytes, rounds, timeout)
+    except Exception as e:
+        return SpeedResult(server, None, None, None, 0, str(e) or type(e).__name__, tuning)
+    finally:
+        instance.stop()
+    return SpeedResult(server, mbps, ttfb, jitter, total, tuning=tuning)
+
+
+def speed_test(
+    servers,
+    url: str = DEFAULT_URL,
+    payload_bytes: int = DEFAULT_PAYLOAD,
+    rounds: int = DEFAULT_ROUNDS,
+    timeout: float = DEFAULT_TIMEOUT,
+    max_parallel: int = MAX_PARALLEL,
+    tuning: str = DEFAULT_TUNING,
+) -> list[SpeedResult]:
+    """Замерить скорость всех серверов (до max_parallel экземпляров V2Ray одновременно)
+    с профилем сокетов tuning. Результат — от быстрых к медленным, ошибки в конце."""
+    servers = list(servers)
+    if not servers:
+        return []
+    url = url.format(size=payload_bytes)
+    with InstancePool() as pool, ThreadPoolExecutor(min(max_parallel, len(servers))) as executor:
+        results = list(
+            executor.map(
+                lambda s: _test_one(pool, s, url, payload_bytes, rounds, timeout, tuning), servers
+            )
+        )
+    return sorted(results, key=lambda r: -(r.mbps or -1))
+
+
+class BurstResult(NamedTuple):
+    transport: str
+    total: float | None  # секунды на всю пачку
+    median: float | None  # медиана времени до ответа на один запрос, с
+    p95: float | None
+    errors: int = 0
+    error: str = ""
+    tuning: str = DEFAULT_TUNING
+
+
+def burst(http_port: int, url: str, requests: int, parallel: int, timeout: float) -> tuple[float, list[float], int]:
+    """requests коротких запросов (до parallel одновременно) через 127.0.0.1:http_port.
+    Вернуть (секунды на всю пачку, задержки удачных запросов, число ошибок)."""
+
+    def one(_):
+        try:
+            return fetch_through_proxy(http_port, url, 1, timeout)[0]
+        except Exception:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(parallel) as executor:
+        latencies = list(executor.map(one, range(requests)))
+    total = time.perf_counter() - started
+    ok = [x for x in latencies if x is not None]
+    return total, ok, len(latencies) - len(ok)
+
+
+def _burst_one(
+    pool: InstancePool, server: SsServer, transport: str, mux_concurrency: int | None,
+    url: str, requests: int, parallel: int, timeout: float, tuning: str,
+) -> BurstResult:
+    reason = unsupported_reason(server)
+    if reason:
+        return BurstResult(transport, None, None, None, requests, reason, tuning)
+    socks_port, http_port = free_ports(2)
+    config_json = build_from_server(
+        server, socks_port=socks_port, http_port=http_port, api_port=None,
+        transport=transport, mux_concurrency=mux_concurrency, tuning=tuning,
+    )
+    instance = pool.spawn(config_json)
+    if instance is None:
+        return BurstResult(transport, None, None, None, requests, "V2Ray не запустился", tuning)
+    try:
+        # Первый запрос — прогрев (запуск V2Ray, DNS), в замер не входит
+        fetch_through_proxy(http_port, url, 1, timeout)
+        total, latencies, errors = burst(http_port, url, requests, parallel, timeout)
+    except Exception as e:
+        return BurstResult(transport, None, None, None, requests, str(e) or type(e).__name__, tuning)
+    finally:
+        instance.stop()
+    if not latencies:
+        return BurstResult(transport, total, None, None, errors, "нет ответов", tuning)
+    p95 = statistics.quantiles(latencies, n=20)[18] if len(latencies) > 1 else latencies[0]
+    return BurstResult(transport, total, statistics.median(latencies), p95, errors, tuning=tuning)
+
+
+def burst_test(
+    server: SsServer,
+    transports=tuple(TRANSPORT_PROFILES),
+    mux_concurrency: int | None = None,
+    url: str = BURST_URL,
+    requests: int = BURST_REQUESTS,
+    parallel: int = BURST_PARALLEL,
+    timeout: float = BURST_TIMEOUT,
+    tuning: str = DEFAULT_TUNING,
+) -> list[BurstResult]:
+    """Одна и та же пачка запросов через каждый транспорт по очереди (чтобы не мешали друг другу)."""
+    with InstancePool() as pool:
+        return [
+            _burst_one(pool, server, t, mux_concurrency, url, requests, parallel, timeout, tuning)
+            for t in transports
+        ]
+
+
+def _option(argv, name: str, default, convert=int):
+    if name in argv[:-1]:
+        return convert(argv[argv.index(name) + 1])
+    return default
+
+
+def main(argv=None):
+    """Сравнить транспорты на пачке коротких запросов для сервера из ссылки."""
+    argv = sys.argv[1:] if argv is None else argv
+    server = next((parse_ss_link(a) for a in argv if a.startswith("ss://")), None)
+    if server is None:
+        print("Укажите ссылку ss://")
+        return
+    tuning = _option(argv, "--tuning", DEFAULT_TUNING, str)
+    if tuning not in TUNING_PROFILES:
+        print("Профили сокетов:", ", ".join(TUNING_PROFILES))
+        return
+    results = burst_test(
+        server,
+        mux_concurrency=_option(argv, "--mux", None),
+        requests=_option(argv, "--burst", BURST_REQUESTS),
+        tuning=tuning,
+    )
+    print(f"Профиль сокетов: {tuning}")
+    base = next((r for r in results if r.transport == "tcp" and r.median is not None), None)
+    for r in results:
+        if r.median is None:
+            print(f"{r.transport:>8}: ошибка — {r.error}")
+            continue
+        line = (
+            f"{r.transport:>8}: пачка {r.total:.2f} с, запрос медиана {r.median * 1000:.0f} мс, "
+            f"p95 {r.p95 * 1000:.0f} мс, ошибок {r.errors}"
+        )
+        if base is not None and r is not base:
+            line += f", экономия на запрос {(base.median - r.median) * 1000:+.0f} мс"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Счётчики трафика V2Ray (StatsService): скорость приёма/передачи и итоги. Опрос — корутина
+run() в общем цикле asyncio окна (TaskRunner), сам запрос к V2Ray — в его пуле потоков.
+Интервал опроса меняется на ходу — часто, пока окно видно, и редко, когда оно свёрнуто;
+пока трафика нет, опрос постепенно замедляется.
+"""
+import asyncio
+import time
+from typing import NamedTuple
+
+import v2ray_api
+
+# Каждый опрос — запуск процесса `v2ray api stats` (на Windows порядка 20–50 мс CPU и
+# ~30 МБ памяти на время работы): опрос раз в секунду заметно нагружает слабый ПК
+VISIBLE_INTERVAL = 2.0
+HIDDEN_INTERVAL = 10.0
+# Без трафика интервал удваивается с каждым следующим пустым замером, но не дольше IDLE_MAX_INTERVAL
+IDLE_MAX_INTERVAL = 10.0
+# Inbound, через которые идёт трафик ПК (config_builder)
+USER_INBOUNDS = ("socks-in", "http-in")
+
+
+class TrafficSample(NamedTuple):
+    down_rate: float  # байт/с
+    up_rate: float
+    down_total: int  # байт с запуска V2Ray
+    up_total: int
+    tunnel_total: int  # из них через туннель (outbound proxy*), в обе стороны
+
+
+def _totals(stats: dict[str, int]) -> tuple[int, int, int]:
+    """(принято, отправлено, через туннель) из имён вида inbound>>>socks-in>>>traffic>>>downlink."""
+    down = up = tunnel = 0
+    for name, value in stats.items():
+        parts = name.split(">>>")
+        if len(parts) != 4 or parts[2] != "traffic":
+            continue
+        kind, tag, _, direction = parts
+        if kind == "inbound" and tag in USER_INBOUNDS:
+            if direction == "downlink":
+                down += value
+            else:
+                up += value
+        elif kind == "outbound" and tag.startswith("proxy"):
+            tunnel += value
+    return down, up, tunnel
+
+
+def format_bytes(value: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if value < 1024 or unit == "ГБ":
+            return f"{value:.0f} {unit}" if unit == "Б" else f"{value:.1f} {unit}"
+        value /= 1024
+    return ""
+
+
+def format_sample(sample: TrafficSample) -> str:
+    return (
+        f"↓ {format_bytes(sample.down_rate)}/с  ↑ {format_bytes(sample.up_rate)}/с   "
+        f"всего ↓ {format_bytes(sample.down_total)}  ↑ {format_bytes(sample.up_total)}"
+    )
+
+
+class StatsPoller:
+    """Опрос StatsService запущенного V2Ray до отмены run(); on_sample(TrafficSample) вызывается
+    в потоке цикла asyncio."""
+
+    def __init__(self, exe, server: str, on_sample, interval: float = VISIBLE_INTERVAL):
+        self.exe = exe
+        self.server = server
+        self.on_sample = on_sample
+        self._interval = interval
+        self._loop = None  # цикл, в котором идёт run()
+        self._wake = None  # asyncio.Event: интервал уменьшили — замер сразу
+        self._last = None  # (время, принято, отправлено)
+        self._idle_polls = 0  # пустых замеров подряд
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    @interval.setter
+    def interval(self, value: float):
+        """Новый интервал; при ускорении опроса — следующий замер сразу."""
+        faster = value < self._interval
+        self._interval = value
+        loop, wake = self._loop, self._wake
+        if faster and loop is not None:
+            self._idle_polls = 0
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:  # цикл уже остановлен
+                pass
+
+    def poll(self) -> TrafficSample | None:
+        """Один замер; скорость — по разнице с предыдущим."""
+        stats = v2ray_api.query_stats(self.exe, self.server)
+        if stats is None:
+            return None
+        now = time.monotonic()
+        down, up, tunnel = _totals(stats)
+        down_rate = up_rate = 0.0
+        if self._last is not None:
+            last_time, last_down, last_up = self._last
+            elapsed = now - last_time
+            # Счётчики сбросились (перезапуск V2Ray) — скорость за этот интервал неизвестна
+            if elapsed > 0 and down >= last_down and up >= last_up:
+                down_rate = (down - last_down) / elapsed
+                up_rate = (up - last_up) / elapsed
+        self._last = (now, down, up)
+        return TrafficSample(down_rate, up_rate, down, up, tunnel)
+
+    def next_delay(self, sample: TrafficSample | None) -> float:
+        """Пауза до следующего замера: интервал, а без трафика — с удвоением до IDLE_MAX_INTERVAL."""
+        if sample is not None and (sample.down_rate or sample.up_rate):
+            self._idle_polls = 0
+        else:
+            self._idle_polls += 1
+        slowest = max(self._interval, IDLE_MAX_INTERVAL)
+        return min(self._interval * 2 ** min(max(self._idle_polls - 1, 0), 8), slowest)
+
+    async def run(self):
+        """Опрашивать, пока задачу не отменят."""
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._loop = loop
+        self._last = None
+        self._idle_polls = 0
+        try:
+            while True:
+                sample = await loop.run_in_executor(None, self.poll)
+                if sample is not None:
+                    self.on_sample(sample)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.next_delay(sample))
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            self._loop = None
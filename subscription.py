@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Подписки: загрузка списка ss:// ссылок (обычно в base64), потоковый разбор,
+каталог серверов без дублей и кэш на диске с проверкой ETag / If-Modified-Since.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import time
+import urllib.error
+import urllib.request
+
+from app_dir import BASE_DIR
+from config_builder import SsServer, parse_ss_link
+
+SUBSCRIPTIONS_DIR = BASE_DIR / "subscriptions"
+# Сколько секунд кэш считается свежим (без запроса к серверу)
+DEFAULT_MAX_AGE = 6 * 3600
+FETCH_TIMEOUT = 20
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = "VPN-Obhod/1.0"
+
+_B64_TRANSLATE = bytes.maketrans(b"-_", b"+/")
+_WHITESPACE = b" \t\r\n"
+
+
+def _iter_lines(chunks):
+    """Построчно из потока байтов."""
+    tail = b""
+    for chunk in chunks:
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").strip()
+    if tail:
+        yield tail.decode("utf-8", errors="replace").strip()
+
+
+def _iter_b64_decoded(chunks):
+    """Декодировать base64 (обычный или URL-safe, с переносами строк) по частям."""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk.translate(_B64_TRANSLATE, _WHITESPACE)
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.b64decode(pending[:usable])
+            pending = pending[usable:]
+    if pending.rstrip(b"="):
+        pending = pending.rstrip(b"=")
+        yield base64.b64decode(pending + b"=" * (-len(pending) % 4))
+
+
+def iter_subscription_lines(chunks):
+    """Строки подписки из потока байтов: сам определяет, base64 это или открытый текст."""
+    chunks = iter(chunks)
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if first.strip():
+            break
+
+    def replay():
+        yield first
+        yield from chunks
+
+    if b"://" in first:
+        yield from _iter_lines(replay())
+    else:
+        yield from _iter_lines(_iter_b64_decoded(replay()))
+
+
+class Catalog:
+    """Серверы без дублей (ключ host:port:method), порядок — как в подписке."""
+
+    def __init__(self, servers=()):
+        self._by_key = {}
+        for server in servers:
+            self.add(server)
+
+    def add(self, server: SsServer) -> bool:
+        """Добавить сервер. False — если такой host:port:method уже есть."""
+        key = server.key
+        if key in self._by_key:
+            return False
+        self._by_key[key] = server
+        return True
+
+    def extend(self, servers) -> int:
+        return sum(1 for server in servers if self.add(server))
+
+    def servers(self) -> list[SsServer]:
+        return list(self._by_key.values())
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __iter__(self):
+        return iter(self._by_key.values())
+
+
+def parse_subscription(chunks) -> tuple[Catalog, int]:
+    """Разобрать поток подписки в каталог. Вернуть (каталог, число нераспознанных строк)."""
+    catalog = Catalog()
+    bad = 0
+    for line in iter_subscription_lines(chunks):
+        if not line:
+            continue
+        server = parse_ss_link(line) if line.startswith("ss://") else None
+        if server is None:
+            bad += 1
+            continue
+        catalog.add(server)
+    return catalog, bad
+
+
+def _cache_path(url: str):
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return SUBSCRIPTIONS_DIR / f"{digest}.json"
+
+
+class Subscription:
+    """Одна подписка по URL с кэшем в SUBSCRIPTIONS_DIR."""
+
+    def __init__(self, url: str):
+        self.url = url.strip()
+        self.cache_path = _cache_path(self.url)
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = 0.0
+        self.catalog = Catalog()
+        self.skipped = 0
+        # "cache", "not-modified" или "downloaded" — откуда взят каталог при последней загрузке
+        self.source = None
+
+    def _read_cache(self) -> bool:
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        self.etag = data.get("etag")
+        self.last_modified = data.get("last_modified")
+        self.fetched_at = data.get("fetched_at", 0.0)
+        self.catalog = Catalog(SsServer(*row) for row in data.get("servers", []))
+        return True
+
+    def _write_cache(self):
+        data = {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+            "servers": [list(server) for server in self.catalog],
+        }
+        try:
+            SUBSCRIPTIONS_DIR.mkdir(exist_ok=True)
+            tmp = self.cache_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(self.cache_path)
+        except OSError:
+            pass
+
+    def load(self, max_age: float = DEFAULT_MAX_AGE, offline: bool = False) -> Catalog:
+        """Каталог из кэша, если он свежий; иначе условный запрос к серверу.
+        При ошибке сети — то, что есть в кэше."""
+        cached = self._read_cache()
+        if cached and (offline or time.time() - self.fetched_at < max_age):
+            self.source = "cache"
+            return self.catalog
+        if offline:
+            return self.catalog
+        try:
+            self._fetch()
+        except (OSError, urllib.error.URLError, binascii.Error, ValueError):
+            if not cached:
+                raise
+            self.source = "cache"
+        return self.catalog
+
+    def _fetch(self):
+        request = urllib.request.Request(self.url, headers={"User-Agent": USER_AGENT})
+        if self.etag:
+            request.add_header("If-None-Match", self.etag)
+        if self.last_modified:
+            request.add_header("If-Modified-Since", self.last_modified)
+        try:
+            response = urllib.request.urlopen(request, timeout=FETCH_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            self.fetched_at = time.time()
+            self.source = "not-modified"
+            self._write_cache()
+            return
+        with response:
+            catalog, self.skipped = parse_subscription(
+                iter(lambda: response.read(CHUNK_SIZE), b"")
+            )
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+        self.catalog = catalog
+        self.fetched_at = time.time()
+        self.source = "downloaded"
+        self._write_cache()
+
+
+def load_cached_catalog() -> Catalog:
+    """Все закэшированные подписки в одном каталоге (без сети и без разбора ссылок)."""
+    catalog = Catalog()
+    if not SUBSCRIPTIONS_DIR.exists():
+        return catalog
+    for path in sorted(SUBSCRIPTIONS_DIR.glob("*.json")):
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        catalog.extend(SsServer(*row) for row in data.get("servers", []))
+    return catalog
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Переключение серверов без разрыва: новый V2Ray поднимается на запасных портах, после
+готовности системный прокси переводится на него, старый процесс останавливается позже
+(успевают завершиться открытые соединения). Упавший процесс перезапускается с паузой.
+"""
+import threading
+import time
+
+import v2ray_runner
+from config_builder import API_PORT, HTTP_PORT, SOCKS_PORT
+from v2ray_runner import V2RAY_DIR, V2RayInstance
+
+# Два набора портов: основной (как у run_v2ray.bat) и запасной для тёплой замены.
+# 3129 занят PAC-сервером
+SLOT_PORTS = (
+    {"socks_port": SOCKS_PORT, "http_port": HTTP_PORT, "api_port": API_PORT},
+    {"socks_port": SOCKS_PORT + 2, "http_port": HTTP_PORT + 10, "api_port": API_PORT + 1},
+)
+STANDBY_CONFIG_PATH = V2RAY_DIR / "config-standby.json"
+# Сколько старый процесс обслуживает уже открытые соединения после переключения
+# (следующее переключение раньше останавливает его сразу)
+DRAIN_SECONDS = 30.0
+WATCH_INTERVAL = 1.0
+# Паузы перед перезапуском упавшего процесса (дальше — последняя)
+RESTART_BACKOFF = (1.0, 2.0, 5.0, 10.0, 30.0)
+# Проработал столько без падений — счётчик перезапусков сбрасывается
+STABLE_SECONDS = 60.0
+
+
+class Supervisor:
+    """Два экземпляра V2Ray (основной v2ray_runner.default и запасной), активен один.
+    on_event(str) — сообщения о перезапусках, вызывается из фонового потока.
+    Запуск и остановка процесса (до 10 с на порты) идут под замком своего слота, _lock берётся
+    только на смену индексов — сторож и чтение active/http_port из окна не ждут запуска."""
+
+    def __init__(self, on_event=None):
+        standby = V2RayInstance(STANDBY_CONFIG_PATH)
+        # Общий журнал и история запусков для обоих экземпляров
+        standby.log = v2ray_runner.default.log
+        standby.timings = v2ray_runner.default.timings
+        self._instances = (v2ray_runner.default, standby)
+        self._active = None  # индекс в _instances
+        self._lock = threading.RLock()
+        self._slot_locks = (threading.Lock(), threading.Lock())  # запуск/остановка процесса слота
+        self._watch = None  # Event остановки сторожа
+        self._crashes = 0
+        self._started_at = 0.0
+        self._config_json = None  # конфиг активного экземпляра — для перезапуска после падения
+        self._drain_until = [0.0, 0.0]  # time.monotonic() окончания доработки каждого экземпляра
+        self.on_event = on_event
+        # "unchanged" / "hot" — без перезапуска, "switch" — через запасной экземпляр, "start" — первый запуск
+        self.last_apply = None
+        # Почему не удалось применить: "start" (V2Ray не поднялся) или "proxy" (системный прокси)
+        self.last_error = ""
+
+    @property
+    def active(self) -> V2RayInstance | None:
+        return None if self._active is None else self._instances[self._active]
+
+    @property
+    def ports(self) -> dict | None:
+        return None if self._active is None else SLOT_PORTS[self._active]
+
+    @property
+    def http_port(self) -> int:
+        return (self.ports or SLOT_PORTS[0])["http_port"]
+
+    def is_running(self) -> bool:
+        active = self.active
+        return active is not None and active.is_running()
+
+    def apply(self, build, repoint) -> bool:
+        """build(socks_port=, http_port=, api_port=) -> JSON-конфиг; repoint(http_port) -> bool
+        переводит системный прокси. Пока новый экземпляр не готов, работает старый.
+        build (с разрешением адресов) вызывается без блокировки."""
+        with self._lock:
+            self.last_error = ""
+            current = self._active
+            running = self.is_running()
+        if running:
+            config_json = build(**SLOT_PORTS[current])
+            if config_json is None:
+                self.last_error = "start"
+                return False
+            with self._slot_locks[current]:
+                active = self._instances[current]
+                if self._active == current and active.is_running() and active.apply_in_place(config_json):
+                    with self._lock:
+                        self.last_apply = active.last_apply
+                        self._config_json = config_json
+                    return True
+        target = 0 if current is None else 1 - current
+        config_json = build(**SLOT_PORTS[target])
+        if config_json is None:
+            self.last_error = "start"
+            return False
+        instance = self._instances[target]
+        with self._slot_locks[target]:
+            with self._lock:
+                # Второе переключение раньше DRAIN_SECONDS: слот ещё дорабатывает соединения
+                # сервера, с которого ушли два переключения назад. Ждать его — держать
+                # подключение (и автопереключение) до 30 с, поэтому он останавливается сразу
+                draining = self._drain_until[target] > time.monotonic() and instance.is_running()
+                self._drain_until[target] = 0.0
+            if draining:
+                self._event("Прежний сервер ещё дорабатывал соединения — они закрыты")
+            instance.stop()
+            if not instance.start(config_json):
+                self.last_error = "start"
+                return False
+            if not repoint(SLOT_PORTS[target]["http_port"]):
+                instance.stop()
+                self.last_error = "proxy"
+                return False
+            with self._lock:
+                previous = self._active
+                self.last_apply = "start" if previous is None else "switch"
+                self._active = target
+                self._config_json = config_json
+                self._crashes = 0
+                self._started_at = time.monotonic()
+                if previous is not None:
+                    self._drain(previous)
+                self._start_watch()
+        return True
+
+    def _drain(self, index: int):
+        """Остановить прежний экземпляр через DRAIN_SECONDS (если слот за это время не заняли снова)."""
+        deadline = self._drain_until[index] = time.monotonic() + DRAIN_SECONDS
+
+        def finish():
+            with self._slot_locks[index]:
+                with self._lock:
+                    if self._drain_until[index] != deadline or self._active == index:
+                        return
+                    self._drain_until[index] = 0.0
+                self._instances[index].stop()
+
+        timer = threading.Timer(DRAIN_SECONDS, finish)
+        timer.daemon = True
+        timer.start()
+
+    def stop(self):
+        """Остановить оба экземпляра и сторожа."""
+        with self._lock:
+            if self._watch is not None:
+                self._watch.set()
+                self._watch = None
+            self._active = None
+            self._config_json = None
+            self._drain_until = [0.0, 0.0]
+        for slot_lock, instance in zip(self._slot_locks, self._instances):
+            with slot_lock:
+                instance.stop()
+
+    def _start_watch(self):
+        if self._watch is not None:
+            return
+        self._watch = threading.Event()
+        threading.Thread(target=self._watch_loop, args=(self._watch,), daemon=True).start()
+
+    def _watch_loop(self, stop: threading.Event):
+        while not stop.wait(WATCH_INTERVAL):
+            with self._lock:
+                index, config_json = self._active, self._config_json
+                if index is None or config_json is None or self._instances[index].is_running():
+                    continue
+                if time.monotonic() - self._started_at > STABLE_SECONDS:
+                    self._crashes = 0
+                delay = RESTART_BACKOFF[min(self._crashes, len(RESTART_BACKOFF) - 1)]
+                self._crashes += 1
+            self._event(f"V2Ray завершился, перезапуск через {delay:.0f} с")
+            if stop.wait(delay):
+                return
+            instance = self._instances[index]
+            with self._slot_locks[index]:
+                with self._lock:
+                    if self._active != index or self._config_json != config_json or instance.is_running():
+                        continue
+                ok = instance.start(config_json)
+                with self._lock:
+                    self._started_at = time.monotonic()
+            self._event("V2Ray перезапущен" if ok else "Не удалось перезапустить V2Ray")
+
+    def _event(self, text: str):
+        if self.on_event is not None:
+            self.on_event(text)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновая работа окна: один поток с циклом asyncio вместо нового потока на каждый клик.
+Блокирующие функции идут в ограниченный пул потоков, корутины — прямо в цикл.
+Задачи с одним ключом выполняются строго по очереди (повторный клик не обгонит прежний),
+их можно отменить. Результаты складываются в очередь, которую поток Tk разбирает пачками (drain).
+Исключения обработчиков и задач без on_error пишутся в журнал (log) и в stderr.
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from proc_log import LogBuffer
+
+# Сколько блокирующих функций выполняется одновременно (опрос счётчиков и проверка
+# подключения занимают по потоку, пока идут)
+MAX_WORKERS = 6
+# Сколько результатов поток Tk разбирает за один вызов drain
+MAX_BATCH = 200
+
+
+class TaskRunner:
+    """Цикл asyncio в фоновом потоке. on_done/on_error/on_cancelled и post() вызываются
+    в потоке, который вызывает drain() (в окне — поток Tk). log — необработанные исключения."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="task")
+        self._results = queue.SimpleQueue()
+        self._keyed = {}  # ключ -> незавершённые Future
+        self._tails = {}  # ключ -> asyncio.Future окончания последней начатой работы (только в цикле)
+        self._lock = threading.Lock()
+        self.log = LogBuffer()
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, work, *args, key=None, on_done=None, on_error=None, on_cancelled=None):
+        """Выполнить work(*args) в фоне и вернуть concurrent.futures.Future (можно cancel()).
+        work — корутинная функция (отменяется сразу) или обычная: её поток доработает,
+        но результат будет отброшен, а после завершения придёт on_cancelled().
+        Задачи с одинаковым key начинаются только после окончания предыдущей."""
+        future = asyncio.run_coroutine_threadsafe(self._run(work, args, key, on_cancelled), self._loop)
+        if key is not None:
+            with self._lock:
+                self._keyed.setdefault(key, []).append(future)
+
+        def finished(f):
+            if key is not None:
+                with self._lock:
+                    futures = self._keyed.get(key, [])
+                    if f in futures:
+                        futures.remove(f)
+                    if not futures:
+                        self._keyed.pop(key, None)
+            if f.cancelled():
+                return
+            error = f.exception()
+            if error is None:
+                if on_done is not None:
+                    self.post(on_done, f.result())
+            elif on_error is not None:
+                self.post(on_error, error)
+            else:
+                self._report(work, error)
+
+        future.add_done_callback(finished)
+        return future
+
+    async def _run(self, work, args, key, on_cancelled):
+        done = self._loop.create_future()
+        if key is not None:
+            previous, self._tails[key] = self._tails.get(key), done
+            if previous is not None and not previous.done():
+                try:
+                    await asyncio.wait({previous})
+                except asyncio.CancelledError:
+                    # Следующие по ключу всё равно ждут окончания предыдущей работы
+                    previous.add_done_callback(lambda _: done.done() or done.set_result(None))
+                    raise
+        try:
+            if inspect.iscoroutinefunction(work):
+                inner = asyncio.ensure_future(work(*args))
+            else:
+                inner = self._loop.run_in_executor(None, work, *args)
+            # Очередь по ключу ждёт настоящего окончания работы, даже если задачу отменили
+            inner.add_done_callback(lambda _: done.done() or done.set_result(None))
+        except BaseException:
+            done.set_result(None)
+            raise
+        try:
+            return await asyncio.shield(inner)
+        except asyncio.CancelledError:
+            if not inner.done():
+                inner.cancel()  # корутина прервётся; поток пула — нет
+            if on_cancelled is not None:
+                inner.add_done_callback(lambda _: self.post(on_cancelled))
+            raise
+
+    def pending(self, key) -> bool:
+        """Есть ли незавершённые задачи с ключом key."""
+        with self._lock:
+            return bool(self._keyed.get(key))
+
+    def cancel(self, key) -> int:
+        """Отменить все незавершённые задачи с ключом key; вернуть их число."""
+        with self._lock:
+            futures = list(self._keyed.get(key, []))
+        return sum(1 for future in futures if future.cancel())
+
+    def post(self, callback, *args):
+        """Передать вызов в поток, который разбирает очередь (из любого потока)."""
+        self._results.put((callback, args))
+
+    def drain(self, limit: int = MAX_BATCH) -> int:
+        """Выполнить до limit накопившихся вызовов; вернуть их число."""
+        count = 0
+        while count < limit:
+            try:
+                callback, args = self._results.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                self._report(callback, e)
+        return count
+
+    def _report(self, where, error: BaseException):
+        """Исключение из where — в журнал и в stderr (у pythonw его нет)."""
+        name = getattr(where, "__qualname__", None) or repr(where)
+        lines = traceback.format_exception(type(error), error, error.__traceback__)
+        self.log.append(f"{time.strftime('%H:%M:%S')} Ошибка в {name}:")
+        for line in "".join(lines).rstrip().splitlines():
+            self.log.append(line)
+        if sys.stderr is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def shutdown(self):
+        """Отменить задачи и остановить цикл (потоки пула не ждём)."""
+        with self._lock:
+            futures = [f for fs in self._keyed.values() for f in fs]
+            self._keyed = {}
+        for future in futures:
+            future.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Ссылки ss://: разбор всех форм SIP002 и обратно (format_ss_link -> parse_ss_link), плагины в конфиге.
+Запуск: python -m pytest test_config_builder.py
+"""
+import base64
+import json
+import subprocess
+import urllib.parse
+
+import pytest
+
+from config_builder import (
+    SsServer,
+    build_balanced_config,
+    build_from_server,
+    format_ss_link,
+    parse_ss_link,
+    unsupported_reason,
+)
+from v2ray_runner import V2RAY_EXE
+
+KEY_16 = base64.b64encode(bytes(range(16))).decode()
+KEY_32 = base64.b64encode(bytes(range(32))).decode()
+KEY_32_USER = base64.b64encode(bytes(range(32, 64))).decode()
+
+
+def b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def quote(text: str) -> str:
+    return urllib.parse.quote(text, safe="")
+
+
+CORPUS = [
+    # base64 userinfo, имя с пробелом
+    (
+        "ss://" + b64("aes-256-gcm:secret") + "@example.com:8388#My%20server",
+        SsServer("example.com", 8388, "aes-256-gcm", "secret", "My server"),
+    ),
+    # base64 с паддингом и обычным алфавитом
+    (
+        "ss://" + base64.b64encode(b"chacha20-ietf-poly1305:pw?").decode() + "@1.2.3.4:443",
+        SsServer("1.2.3.4", 443, "chacha20-ietf-poly1305", "pw?"),
+    ),
+    # открытый userinfo (SIP002)
+    (
+        "ss://aes-128-gcm:plain@example.org:8000",
+        SsServer("example.org", 8000, "aes-128-gcm", "plain"),
+    ),
+    # пароль с : и @ — в base64
+    (
+        "ss://" + b64("aes-256-gcm:p@ss:w@rd") + "@example.com:8388",
+        SsServer("example.com", 8388, "aes-256-gcm", "p@ss:w@rd"),
+    ),
+    # пароль с : и @ — открытым текстом, закодированный
+    (
+        "ss://aes-256-gcm:" + quote("p@ss:w@rd") + "@example.com:8388",
+        SsServer("example.com", 8388, "aes-256-gcm", "p@ss:w@rd"),
+    ),
+    # пароль с : и @ — открытым текстом без кодирования (адрес — после последнего @)
+    (
+        "ss://aes-256-gcm:p@ss:w@rd@example.com:8388",
+        SsServer("example.com", 8388, "aes-256-gcm", "p@ss:w@rd"),
+    ),
+    # Shadowsocks-2022, один ключ
+    (
+        f"ss://2022-blake3-aes-128-gcm:{quote(KEY_16)}@example.com:443#ss2022",
+        SsServer("example.com", 443, "2022-blake3-aes-128-gcm", KEY_16, "ss2022"),
+    ),
+    # Shadowsocks-2022, многопользовательский ключ iPSK:uPSK
+    (
+        f"ss://2022-blake3-aes-256-gcm:{KEY_32}:{KEY_32_USER}@example.com:443",
+        SsServer("example.com", 443, "2022-blake3-aes-256-gcm", f"{KEY_32}:{KEY_32_USER}"),
+    ),
+    (
+        f"ss://2022-blake3-chacha20-poly1305:{quote(KEY_32 + ':' + KEY_32_USER)}@example.com:443",
+        SsServer("example.com", 443, "2022-blake3-chacha20-poly1305", f"{KEY_32}:{KEY_32_USER}"),
+    ),
+    # IPv6
+    (
+        "ss://" + b64("aes-256-gcm:pw") + "@[2001:db8::1]:8388#v6",
+        SsServer("2001:db8::1", 8388, "aes-256-gcm", "pw", "v6"),
+    ),
+    (
+        f"ss://2022-blake3-aes-128-gcm:{quote(KEY_16)}@[::1]:443",
+        SsServer("::1", 443, "2022-blake3-aes-128-gcm", KEY_16),
+    ),
+    # плагины
+    (
+        "ss://" + b64("aes-128-gcm:pw") + "@example.com:80/?plugin="
+        + quote("obfs-local;obfs=http;obfs-host=www.bing.com") + "#obfs",
+        SsServer("example.com", 80, "aes-128-gcm", "pw", "obfs", "obfs-local;obfs=http;obfs-host=www.bing.com"),
+    ),
+    (
+        "ss://" + b64("aes-128-gcm:pw") + "@example.com:443?plugin="
+        + quote("v2ray-plugin;tls;host=cdn.example.com;path=/ws"),
+        SsServer("example.com", 443, "aes-128-gcm", "pw", "", "v2ray-plugin;tls;host=cdn.example.com;path=/ws"),
+    ),
+    (
+        "ss://" + b64("aes-128-gcm:pw") + "@[2001:db8::2]:443/?plugin=" + quote("v2ray-plugin;mode=websocket"),
+        SsServer("2001:db8::2", 443, "aes-128-gcm", "pw", "", "v2ray-plugin;mode=websocket"),
+    ),
+    # старая форма: вся ссылка в base64
+    (
+        "ss://" + base64.b64encode(b"aes-256-gcm:pw@10.0.0.1:8388").decode() + "#legacy",
+        SsServer("10.0.0.1", 8388, "aes-256-gcm", "pw", "legacy"),
+    ),
+    (
+        "ss://" + b64("aes-256-gcm:p:w@[2001:db8::3]:8388"),
+        SsServer("2001:db8::3", 8388, "aes-256-gcm", "p:w"),
+    ),
+]
+
+INVALID = [
+    "ss://" + b64("aes-256-gcm:pw") + "@example.com:0",
+    "ss://" + b64("aes-256-gcm:pw") + "@example.com:65536",
+    "ss://" + b64("aes-256-gcm:pw") + "@example.com:port",
+    "ss://" + b64("aes-256-gcm:pw") + "@example.com",
+    "ss://" + b64("aes-256-gcm:pw") + "@[2001:db8::1:8388",
+    "ss://" + b64("aes-256-gcm:pw") + "@[2001:db8::1]8388",
+    "ss://" + b64("aes-256-gcm:pw") + "@[]:8388",
+    "ss://" + b64("no-colon") + "@example.com:8388",
+    "ss://" + b64("aes-256-gcm:") + "@example.com:8388",
+    "ss://@example.com:8388",
+    "ss://not-base64!!",
+    # ключ 2022 неверной длины и не base64
+    f"ss://2022-blake3-aes-128-gcm:{quote(KEY_32)}@example.com:443",
+    f"ss://2022-blake3-aes-256-gcm:{quote(KEY_32)}:short@example.com:443",
+    "ss://2022-blake3-aes-128-gcm:not-a-key@example.com:443",
+]
+
+
+@pytest.mark.parametrize("link, expected", CORPUS)
+def test_parse(link, expected):
+    assert parse_ss_link(link) == expected
+
+
+@pytest.mark.parametrize("link, expected", CORPUS)
+def test_round_trip(link, expected):
+    assert parse_ss_link(format_ss_link(expected)) == expected
+
+
+@pytest.mark.parametrize("link", INVALID)
+def test_invalid(link):
+    assert parse_ss_link(link) is None
+
+
+def test_format_2022_plaintext_and_ipv6():
+    server = SsServer("2001:db8::1", 443, "2022-blake3-aes-128-gcm", KEY_16)
+    link = format_ss_link(server)
+    assert link.startswith("ss://2022-blake3-aes-128-gcm:")
+    assert "@[2001:db8::1]:443" in link
+
+
+def _outbound(server: SsServer) -> dict:
+    config = json.loads(build_from_server(server, api_port=None))
+    return next(ob for ob in config["outbounds"] if ob["protocol"] == "shadowsocks")
+
+
+def test_v2ray_plugin_native_transport():
+    server = SsServer("example.com", 443, "aes-128-gcm", "pw", plugin="v2ray-plugin;tls;host=cdn.example.com;path=/ws")
+    stream = _outbound(server)["streamSettings"]
+    assert stream["network"] == "ws"
+    assert stream["wsSettings"] == {"path": "/ws", "headers": {"Host": "cdn.example.com"}}
+    assert stream["security"] == "tls"
+    assert stream["tlsSettings"] == {"serverName": "cdn.example.com"}
+
+
+def test_sip003_plugin_settings():
+    server = SsServer("example.com", 80, "aes-128-gcm", "pw", plugin="obfs-local;obfs=http;obfs-host=www.bing.com")
+    settings = _outbound(server)["settings"]
+    assert settings["plugin"] == "obfs-local"
+    assert settings["pluginOpts"] == "obfs=http;obfs-host=www.bing.com"
+
+
+def test_ss2022_refused():
+    server = SsServer("example.com", 443, "2022-blake3-aes-256-gcm", f"{KEY_32}:{KEY_32_USER}")
+    reason = unsupported_reason(server)
+    assert "2022-blake3-aes-256-gcm" in reason
+    with pytest.raises(ValueError, match="Shadowsocks-2022"):
+        build_from_server(server, api_port=None)
+    with pytest.raises(ValueError):
+        build_balanced_config([SsServer("example.org", 8388, "aes-256-gcm", "pw"), server], "random")
+    assert unsupported_reason(SsServer("example.com", 443, "aes-256-gcm", "pw")) == ""
+
+
+@pytest.mark.skipif(not V2RAY_EXE.exists(), reason="нет V2Ray в папке v2ray (download_v2ray.py)")
+@pytest.mark.parametrize(
+    "server, options",
+    [
+        (SsServer("example.com", 8388, "aes-256-gcm", "pw"), {}),
+        (SsServer("2001:db8::1", 8388, "chacha20-ietf-poly1305", "pw"), {"routing": "ru-direct", "dns": "fakedns"}),
+        (SsServer("example.com", 443, "aes-128-gcm", "pw", plugin="v2ray-plugin;tls;host=cdn.example.com"), {}),
+        (SsServer("example.com", 8388, "aes-256-gcm", "pw"), {"transport": "mux-udp", "tuning": "bulk"}),
+    ],
+)
+def test_bundled_v2ray_accepts_config(server, options, tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text(build_from_server(server, api_port=None, **options), encoding="utf-8")
+    out = subprocess.run(
+        [str(V2RAY_EXE), "test", "-c", str(config)], capture_output=True, text=True, timeout=60
+    )
+    assert out.returncode == 0, out.stdout + out.stderr
+
+
+@pytest.mark.parametrize(
+    "routing, direct, strategy",
+    [
+        ("full", (), "AsIs"),
+        ("ru-direct", (), "IPIfNonMatch"),
+        ("full", ("10.0.0.0/8",), "IPIfNonMatch"),
+        ("full", ("example.org",), "AsIs"),
+    ],
+)
+def test_fakedns_keeps_ip_rules(routing, direct, strategy):
+    server = SsServer("example.com", 8388, "aes-256-gcm", "pw")
+    config = json.loads(build_from_server(server, api_port=None, routing=routing, direct=direct, dns="fakedns"))
+    assert config["routing"]["domainStrategy"] == strategy
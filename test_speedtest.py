@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Тест скорости через настоящий V2Ray на локальных заменах из bench.py (HTTP-источник и сервер
+Shadowsocks на 127.0.0.1). Без V2Ray в папке v2ray или без cryptography замеры пропускаются.
+Запуск: python -m pytest test_speedtest.py
+"""
+import pytest
+
+import speedtest
+from bench import SS_METHOD, SS_PASSWORD, StandIns, _through_tunnel
+from config_builder import SsServer, build_from_server
+from prober import handshake_supported
+from readiness import free_ports
+from v2ray_runner import LISTEN_HOST, V2RAY_EXE
+
+PAYLOAD = 256 * 1024
+
+needs_v2ray = pytest.mark.skipif(
+    not (V2RAY_EXE.exists() and handshake_supported(SS_METHOD)),
+    reason="нужны V2Ray в папке v2ray (download_v2ray.py) и пакет cryptography",
+)
+
+
+@pytest.fixture
+def stand_ins(monkeypatch):
+    # Замены слушают 127.0.0.1, а профили маршрутизации пускают локальные адреса мимо туннеля
+    monkeypatch.setattr(speedtest, "build_from_server", lambda *a, **kw: _through_tunnel(build_from_server(*a, **kw)))
+    with StandIns() as s:
+        yield s
+
+
+def _dead_server() -> SsServer:
+    # Свободный порт: на нём никто не слушает
+    return SsServer(LISTEN_HOST, free_ports(1)[0], SS_METHOD, SS_PASSWORD, "dead")
+
+
+@needs_v2ray
+def test_speed_test_through_shadowsocks(stand_ins):
+    server = SsServer(LISTEN_HOST, stand_ins.ss_port, SS_METHOD, SS_PASSWORD, "stand-in")
+    url = f"http://{LISTEN_HOST}:{stand_ins.origin_port}/bytes/{{size}}"
+    results = speedtest.speed_test([_dead_server(), server], url=url, payload_bytes=PAYLOAD, rounds=2, timeout=10)
+    good, dead = results
+    assert good.server == server and good.error == ""
+    assert good.mbps > 0 and good.ttfb > 0 and good.jitter >= 0
+    assert good.bytes == 2 * PAYLOAD
+    assert dead.mbps is None and dead.bytes == 0 and dead.error
+
+
+@needs_v2ray
+def test_burst_test_through_shadowsocks(stand_ins):
+    server = SsServer(LISTEN_HOST, stand_ins.ss_port, SS_METHOD, SS_PASSWORD)
+    url = f"http://{LISTEN_HOST}:{stand_ins.origin_port}/bytes/1"
+    results = speedtest.burst_test(server, transports=("tcp",), url=url, requests=8, parallel=4, timeout=10)
+    assert [r.transport for r in results] == ["tcp"]
+    assert results[0].error == "" and results[0].errors == 0
+    assert results[0].total > 0 and results[0].median > 0
+
+
+def test_dead_server_is_an_error_result():
+    # Без V2Ray — «V2Ray не запустился», с ним — ошибка загрузки; исключения быть не должно
+    results = speedtest.speed_test([_dead_server()], url="http://127.0.0.1:9/{size}", payload_bytes=1024, timeout=2)
+    assert len(results) == 1 and results[0].mbps is None and results[0].error
+
+
+def test_unsupported_method_is_an_error_result():
+    key = "AAAAAAAAAAAAAAAAAAAAAA=="
+    server = SsServer("example.com", 443, "2022-blake3-aes-128-gcm", key)
+    [result] = speedtest.speed_test([server])
+    assert result.mbps is None and "Shadowsocks-2022" in result.error
+    [burst] = speedtest.burst_test(server, transports=("tcp",))
+    assert burst.total is None and "Shadowsocks-2022" in burst.error
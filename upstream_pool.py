@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Пул тёплых соединений с удалённым прокси для local_proxy.
+В пуле лежат соединения, уже прошедшие TCP-рукопожатие и приветствие/авторизацию SOCKS5,
+поэтому новый запрос браузера экономит один-два RTT до сервера.
+Весь код работает в потоке цикла asyncio локального прокси.
+"""
+import asyncio
+import collections
+import socket
+import time
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_MAX_IDLE_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+def _alive(sock: socket.socket) -> bool:
+    """Соединение ещё открыто и сервер ничего не прислал без запроса."""
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+class UpstreamPool:
+    """Простаивающие соединения по ключу (хост, порт, логин удалённого прокси).
+
+    dial(key) — корутина, возвращающая готовый к CONNECT сокет."""
+
+    def __init__(
+        self,
+        dial,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_idle_per_host: int = DEFAULT_MAX_IDLE_PER_HOST,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ):
+        self._dial = dial
+        self.pool_size = pool_size
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._dialing = collections.Counter()
+        self._tasks = set()
+        self._evict_task = None
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.dial_errors = 0
+        self._dial_avg = None
+
+    def idle_count(self, key=None) -> int:
+        if key is not None:
+            return len(self._idle.get(key, ()))
+        return sum(len(q) for q in self._idle.values())
+
+    def stats(self) -> dict:
+        """Счётчики пула и оценка сэкономленного времени (попадания x среднее время dial)."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "dial_errors": self.dial_errors,
+            "idle": self.idle_count(),
+            "avg_dial_ms": round(self._dial_avg * 1000, 1) if self._dial_avg else None,
+            "saved_ms": round(self.hits * (self._dial_avg or 0) * 1000, 1),
+        }
+
+    async def acquire(self, key) -> socket.socket:
+        """Взять тёплое соединение или открыть новое."""
+        queue = self._idle.get(key)
+        now = time.monotonic()
+        while queue:
+            sock, since = queue.pop()
+            if now - since <= self.idle_timeout and _alive(sock):
+                self.hits += 1
+                self.warm(key)
+                return sock
+            sock.close()
+            self.evicted += 1
+        self.misses += 1
+        self.warm(key)
+        return await self._timed_dial(key)
+
+    def warm(self, key):
+        """Дозаполнить пул для key в фоне до max_idle_per_host (с учётом общего лимита)."""
+        if self.pool_size <= 0:
+            return
+        self._ensure_evictor()
+        have = self.idle_count(key) + self._dialing[key]
+        free = self.pool_size - self.idle_count() - sum(self._dialing.values())
+        for _ in range(min(self.max_idle_per_host - have, free)):
+            self._dialing[key] += 1
+            task = asyncio.ensure_future(self._fill_one(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _timed_dial(self, key) -> socket.socket:
+        started = time.perf_counter()
+        sock = await self._dial(key)
+        elapsed = time.perf_counter() - started
+        self._dial_avg = elapsed if self._dial_avg is None else self._dial_avg * 0.8 + elapsed * 0.2
+        return sock
+
+    async def _fill_one(self, key):
+        try:
+            sock = await self._timed_dial(key)
+        except Exception:
+            self.dial_errors += 1
+            return
+        finally:
+            self._dialing[key] -= 1
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except OSError:
+            pass
+        queue = self._idle.setdefault(key, collections.deque())
+        if len(queue) >= self.max_idle_per_host or self.idle_count() >= self.pool_size:
+            sock.close()
+            return
+        queue.append((sock, time.monotonic()))
+
+    def _ensure_evictor(self):
+        if self._evict_task is None or self._evict_task.done():
+            self._evict_task = asyncio.ensure_future(self._evict_loop())
+
+    async def _evict_loop(self):
+        """Закрывать соединения, простоявшие дольше idle_timeout (без повторного заполнения)."""
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1.0))
+            now = time.monotonic()
+            for queue in self._idle.values():
+                keep = [(s, t) for s, t in queue if now - t <= self.idle_timeout and _alive(s)]
+                for s, t in queue:
+                    if (s, t) not in keep:
+                        s.close()
+                        self.evicted += 1
+                queue.clear()
+                queue.extend(keep)
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+        for queue in self._idle.values():
+            for sock, _ in queue:
+                sock.close()
+        self._idle.clear()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Вызовы gRPC API запущенного V2Ray через встроенный клиент `v2ray api ...`
+(тот же v2ray.exe, без зависимости от grpcio).
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+API_TIMEOUT = 5.0
+
+
+def run_api(exe, server: str, command: str, *args: str) -> subprocess.CompletedProcess | None:
+    """Выполнить `v2ray api <command> -s <server> args...`. None — если exe не запустился."""
+    try:
+        return subprocess.run(
+            [str(exe), "api", command, "-s", server, *args],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            timeout=API_TIMEOUT,
+            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def add_outbounds(exe, server: str, outbounds: list[dict]) -> bool:
+    """HandlerService.AddOutbound для каждого outbound (через временный JSON-файл)."""
+    fd, path = tempfile.mkstemp(prefix="v2ray-ado-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"outbounds": outbounds}, f, ensure_ascii=False)
+        result = run_api(exe, server, "ado", path)
+        return result is not None and result.returncode == 0
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_outbounds(exe, server: str, tags: list[str]) -> bool:
+    """HandlerService.RemoveOutbound по тегам."""
+    if not tags:
+        return True
+    result = run_api(exe, server, "rmo", "-tags", *tags)
+    return result is not None and result.returncode == 0
+
+
+def query_stats(exe, server: str, pattern: str = "", reset: bool = False) -> dict[str, int] | None:
+    """StatsService.QueryStats: {"inbound>>>socks-in>>>traffic>>>uplink": байт, ...}.
+    None — если API недоступен."""
+    args = ["-json"]
+    if reset:
+        args.append("-reset")
+    if pattern:
+        args.append(pattern)
+    result = run_api(exe, server, "stats", *args)
+    if result is None or result.returncode != 0:
+        return None
+    try:
+        data = json.loads(result.stdout or b"{}")
+    except ValueError:
+        return None
+    # int64 в JSON protobuf — строки; нулевые значения опускаются
+    return {item["name"]: int(item.get("value", 0)) for item in data.get("stat", []) if "name" in item}
@@ -1,63 +1,252 @@
 # -*- coding: utf-8 -*-
 """
 Запуск и остановка V2Ray на ПК (v2ray.exe с config.json).
+Основной экземпляр — функции start/stop/is_running модуля; для замеров скорости и
+резервных серверов — V2RayInstance и InstancePool (каждый со своим конфигом и портами).
 """
+import hashlib
+import json
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 
+import v2ray_api
 from app_dir import BASE_DIR
+from config_builder import API_INBOUND_TAG
+from proc_log import LogBuffer
+from readiness import StartupTimings, wait_for_ports
 
 # Папка v2ray рядом с exe или со скриптом
 V2RAY_DIR = BASE_DIR / "v2ray"
 CONFIG_PATH = V2RAY_DIR / "config.json"
-V2RAY_EXE = V2RAY_DIR / "v2ray.exe"
+V2RAY_EXE = V2RAY_DIR / ("v2ray.exe" if sys.platform == "win32" else "v2ray")
+# Адрес, на котором слушают inbound из config_builder
+LISTEN_HOST = "127.0.0.1"
 
-_process = None
 
+def config_hash(config_json: str) -> str:
+    return hashlib.sha256(config_json.encode("utf-8")).hexdigest()
 
-def start(config_json: str) -> bool:
-    """Записать config_json в config.json и запустить v2ray.exe. Вернуть True при успехе."""
-    global _process
-    if _process is not None and _process.poll() is None:
-        return True
-    if not V2RAY_EXE.exists():
+
+def _inbound_ports(config: dict) -> list[int]:
+    """Порты локальных SOCKS/HTTP inbound из конфига."""
+    return [
+        ib["port"]
+        for ib in config.get("inbounds", [])
+        if ib.get("protocol") in ("socks", "http") and isinstance(ib.get("port"), int)
+    ]
+
+
+def _api_server(config: dict) -> str | None:
+    """Адрес gRPC API (dokodemo-door inbound с тегом API_INBOUND_TAG)."""
+    for ib in config.get("inbounds", []):
+        if ib.get("tag") == API_INBOUND_TAG and isinstance(ib.get("port"), int):
+            return f"{ib.get('listen', LISTEN_HOST)}:{ib['port']}"
+    return None
+
+
+def _hot_swap(old: dict, new: dict) -> bool:
+    """Если отличаются только outbounds — заменить их через HandlerService без перезапуска."""
+    if {k: v for k, v in old.items() if k != "outbounds"} != {
+        k: v for k, v in new.items() if k != "outbounds"
+    }:
         return False
-    try:
-        CONFIG_PATH.write_text(config_json, encoding="utf-8")
-    except Exception:
+    server = _api_server(new)
+    if server is None:
         return False
-    try:
-        _process = subprocess.Popen(
-            [str(V2RAY_EXE), "-config", str(CONFIG_PATH)],
-            cwd=str(V2RAY_DIR),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
-        )
-        return _process.poll() is None
-    except Exception:
+    old_by_tag = {ob.get("tag"): ob for ob in old.get("outbounds", [])}
+    new_by_tag = {ob.get("tag"): ob for ob in new.get("outbounds", [])}
+    if None in old_by_tag or None in new_by_tag:
         return False
+    changed = [tag for tag, ob in new_by_tag.items() if old_by_tag.get(tag) != ob]
+    to_remove = [tag for tag in old_by_tag if tag not in new_by_tag or tag in changed]
+    if not v2ray_api.remove_outbounds(V2RAY_EXE, server, to_remove):
+        return False
+    return v2ray_api.add_outbounds(V2RAY_EXE, server, [new_by_tag[tag] for tag in changed])
 
 
-def stop() -> bool:
-    """Остановить v2ray.exe."""
-    global _process
-    if _process is None:
+class V2RayInstance:
+    """Один процесс v2ray со своим файлом конфига."""
+
+    def __init__(self, config_path: Path = CONFIG_PATH):
+        self.config_path = Path(config_path)
+        self._process = None
+        # Вывод v2ray (stdout + stderr) — вычитывается фоновым потоком
+        self.log = LogBuffer()
+        # Время от запуска до открытия портов inbound (или до применения конфига без перезапуска)
+        self.timings = StartupTimings()
+        # Конфиг запущенного процесса и хэш того, что лежит в config_path
+        self._config_json = None
+        self._written_hash = None
+        # Как применён последний конфиг: "unchanged", "hot" (замена outbound через API) или "restart"
+        self.last_apply = None
+
+    @property
+    def config(self) -> dict | None:
+        """Конфиг запущенного процесса."""
+        return json.loads(self._config_json) if self._config_json else None
+
+    @property
+    def api_server(self) -> str | None:
+        """Адрес gRPC API запущенного процесса (None — без API)."""
+        config = self.config
+        return _api_server(config) if config and self.is_running() else None
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid if self.is_running() else None
+
+    def _write_config(self, config_json: str, digest: str) -> bool:
+        """Записать конфиг, если на диске лежит другой."""
+        if self._written_hash == digest and self.config_path.exists():
+            return True
+        try:
+            self.config_path.write_text(config_json, encoding="utf-8")
+        except Exception:
+            return False
+        self._written_hash = digest
         return True
-    if _process.poll() is not None:
-        _process = None
+
+    def apply_in_place(self, config_json: str) -> bool:
+        """Применить конфиг к работающему процессу без перезапуска: тот же (по хэшу) —
+        ничего не делать, отличаются только outbounds — заменить их через API.
+        False — нужен перезапуск (процесс при этом не трогается)."""
+        if not (self.is_running() and self._config_json is not None):
+            return False
+        started = time.perf_counter()
+        digest = config_hash(config_json)
+        if config_hash(self._config_json) == digest:
+            self.last_apply = "unchanged"
+            self.timings.record(time.perf_counter() - started)
+            return True
+        try:
+            config = json.loads(config_json)
+        except ValueError:
+            return False
+        if not _hot_swap(json.loads(self._config_json), config):
+            return False
+        self._write_config(config_json, digest)
+        self._config_json = config_json
+        self.last_apply = "hot"
+        self.timings.record(time.perf_counter() - started)
+        self.log.append("Конфиг применён без перезапуска (замена outbound через API)")
+        return True
+
+    def start(self, config_json: str) -> bool:
+        """Применить config_json и вернуть True при успехе.
+        Сначала — без перезапуска (apply_in_place); иначе записать конфиг,
+        (пере)запустить v2ray и дождаться портов."""
+        try:
+            config = json.loads(config_json)
+        except ValueError:
+            return False
+        digest = config_hash(config_json)
+        if self.is_running() and self._config_json is not None:
+            if self.apply_in_place(config_json):
+                return True
+            self.stop()
+        elif self.is_running():
+            return True
+        if not V2RAY_EXE.exists():
+            return False
+        if not self._write_config(config_json, digest):
+            return False
+        try:
+            self._process = subprocess.Popen(
+                [str(V2RAY_EXE), "-config", str(self.config_path)],
+                cwd=str(V2RAY_DIR),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
+            )
+            self.log.attach(self._process.stdout)
+        except Exception:
+            return False
+        ready = wait_for_ports(LISTEN_HOST, _inbound_ports(config), self._process)
+        if ready is None:
+            self.stop()
+            return False
+        self._config_json = config_json
+        self.last_apply = "restart"
+        self.timings.record(ready)
         return True
-    try:
-        _process.terminate()
-        _process.wait(timeout=5)
-    except subprocess.TimeoutExpired:
-        _process.kill()
-    except Exception:
-        pass
-    _process = None
-    return True
+
+    def stop(self) -> bool:
+        """Остановить процесс."""
+        self._config_json = None
+        if self._process is None:
+            return True
+        if self._process.poll() is not None:
+            self._process = None
+            return True
+        try:
+            self._process.terminate()
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        except Exception:
+            pass
+        self._process = None
+        return True
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+
+class InstancePool:
+    """Несколько независимых экземпляров V2Ray с конфигами во временной папке.
+    spawn можно вызывать из нескольких потоков."""
+
+    def __init__(self):
+        self._dir = Path(tempfile.mkdtemp(prefix="v2ray-pool-"))
+        self._lock = threading.Lock()
+        self._count = 0
+        self.instances = []
+
+    def spawn(self, config_json: str) -> V2RayInstance | None:
+        """Запустить новый экземпляр; None — если он не поднялся."""
+        with self._lock:
+            self._count += 1
+            instance = V2RayInstance(self._dir / f"config-{self._count}.json")
+        if not instance.start(config_json):
+            return None
+        with self._lock:
+            self.instances.append(instance)
+        return instance
+
+    def stop_all(self):
+        with self._lock:
+            instances, self.instances = self.instances, []
+        for instance in instances:
+            instance.stop()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_all()
+
+
+# Основной экземпляр (подключение «весь ПК»)
+default = V2RayInstance(CONFIG_PATH)
+log = default.log
+timings = default.timings
+
+
+def start(config_json: str) -> bool:
+    """Применить config_json в основном экземпляре (см. V2RayInstance.start)."""
+    return default.start(config_json)
+
+
+def stop() -> bool:
+    """Остановить основной v2ray."""
+    return default.stop()
 
 
 def is_running() -> bool:
-    return _process is not None and _process.poll() is None
+    return default.is_running()
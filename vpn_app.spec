@@ -13,7 +13,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=ctk_datas,
-    hiddenimports=["customtkinter", "config_builder", "proxy_manager", "v2ray_runner", "app_dir"],
+    hiddenimports=["customtkinter", "config_builder", "proxy_manager", "v2ray_runner", "app_dir", "proc_log", "readiness", "local_proxy", "upstream_pool", "v2ray_api", "subscription", "prober", "speedtest", "pac_server", "geosite", "stats_poller", "access_log", "health_monitor", "supervisor", "task_runner", "profile_store", "resolver"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],